@@ -25,6 +25,7 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 import python.clang as cl
 from python.text import *
+from python.astcache import AstCache, parse_translation_unit
 
 
 class Global:
@@ -40,21 +41,21 @@ class Global:
 class CheckGuardData:
     def __init__(self):
         self.name: str
-        self.result_type: Type
-        self.arg_types: list[Type]
+        self.result_type: cl.TypeInfo
+        self.arg_types: list[cl.TypeInfo]
         self.reduced_spelling: str
         self.canonical_spelling: str
-        self.type: Type
+        self.type: cl.TypeInfo
         self.no_proto_with_args: bool
     
     def decl(self) -> str:
-        return_type_str = cl.TypeSpelling.decl(self.result_type)
-        arg_list_str = str(', ').join([f"{cl.TypeSpelling.decl(self.arg_types[i])} {f'_arg{i + 1}'}" for i in range(0, len(self.arg_types))])
+        return_type_str = self.result_type.decl
+        arg_list_str = str(', ').join([f"{self.arg_types[i].decl} {f'_arg{i + 1}'}" for i in range(0, len(self.arg_types))])
         
-        decl_str = f"{return_type_str} {self.name} (__typeof__({self.canonical_spelling if self.no_proto_with_args else self.type.get_canonical().spelling}) *_callback"
+        decl_str = f"{return_type_str} {self.name} (__typeof__({self.canonical_spelling if self.no_proto_with_args else self.type.spelling}) *_callback"
         if len(self.arg_types) > 0:
             decl_str += f', {arg_list_str}'
-        if not self.no_proto_with_args and self.type.kind == TypeKind.FUNCTIONPROTO and self.type.is_function_variadic():
+        if not self.no_proto_with_args and self.type.variadic:
             decl_str += ", ...)"
         else:
             decl_str += ")"
@@ -99,57 +100,31 @@ def clang_reveal_call_expr(c: Cursor) -> tuple[Optional[Cursor], Type]:
     return None, type.get_canonical()
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Add CFI check guard for function pointers.')
-    parser.add_argument('-X', nargs=argparse.REMAINDER, metavar="<clang args>", default=[], help='Extra arguments to pass to Clang.')
-    parser.add_argument('-c', type=str, metavar="<file>", required=False, help='File contains list of callbacks.')
-    parser.add_argument('-o', type=str, metavar="<out>", required=False, help='Output file name')
-    parser.add_argument('source_file', type=str, help='Source file to process.')
-    args = parser.parse_args()
-
-    # Read configuration file
-    with open(Global.config_path, 'r') as file:
-        json_doc = json.load(file)
-
-        # Set the path to the clang library
-        Config.set_library_file(json_doc['libclang'])
-
-    # Arguments
-    callbacks_file: str = args.c if args.c else ''
-    source_file: str = args.source_file
-    output_file: str = args.o if args.o else source_file
+"""
+Adds check guards to the indirect calls of a source file and writes the result to the output file, which can be the
+source file itself. Only the calls of the signatures in `callbacks_set` are guarded unless it's empty. The output is
+not written if no call is guarded. Returns the number of check guards.
 
-    # Configure the index to parse the header files
-    index = Index.create()
-    translation_unit = index.parse(source_file, args=['-x', 'c'] + args.X)
+The index can be shared by many calls, so that a driver lifting many files loads libclang only once.
+"""
+def lift(index: Index, ast_cache: Optional[AstCache], source_file: str, output_file: str, clang_args: list[str],
+         callbacks_set: set[str]) -> int:
+    translation_unit = parse_translation_unit(index, ast_cache, source_file, ['-x', 'c'] + clang_args)
     
     # Collect function pointer positions
     target_cursors: list[Cursor] = []
     target_cursor_last_statements: list[Cursor] = []
 
     function_decls: list[Cursor] = []
-    def walkthrough_ast(c: Cursor, stmt: Cursor, parent: Optional[Cursor]):
-        if c.extent.start.file and not os.path.samefile(str(c.extent.start.file), source_file):
-            return
-        skip_children = False
-        # if c.kind.is_statement():
-        #     stmt = c
-        # elif c.kind.is_expression():
-        #     if parent and parent.kind == CursorKind.COMPOUND_STMT:
-        #         stmt = c
-        if c.kind == CursorKind.FUNCTION_DECL:
-            stmt = c
+    def skip_children(c: Cursor) -> bool:
+        return c.kind == CursorKind.FUNCTION_DECL and c.spelling in Global.ignored_function_scopes
+
+    for c, stmt in cl.walk_cursors(translation_unit.cursor, cl.FileFilter(source_file), skip_children):
         if c.kind == CursorKind.CALL_EXPR:
             target_cursors.append(c)
             target_cursor_last_statements.append(stmt)
         elif c.kind == CursorKind.FUNCTION_DECL:
             function_decls.append(c)
-            if c.spelling in Global.ignored_function_scopes:
-                skip_children = True
-        if not skip_children:
-            for child in c.get_children():
-                walkthrough_ast(child, stmt, c)
-    walkthrough_ast(translation_unit.cursor, translation_unit.cursor, None)
 
     def contains_source_range(parent: SourceRange, child: SourceRange, accept_equal: bool = True):
         if accept_equal:
@@ -189,130 +164,101 @@ def main():
     # if 1 + 1 == 2:
     #     return
 
-    with open(source_file, mode='r') as f:
-        source_code = f.readlines()
-    source_code_copy = source_code.copy()
-
-    # Load callbacks
-    callbacks_set: set[str] = set()
-    if len(callbacks_file) > 0:
-        callbacks_set = read_list_file_as_set(callbacks_file)
+    # Edits are made by byte offsets against the original source, the source is not read into lines
+    with EditBuffer(source_file) as source:
 
-    # Range replacing helpers
-    def get_source_range(range: SourceRange) -> str:
-        start: SourceLocation = range.start
-        end: SourceLocation = range.end
-        cur_line = start.line - 1
-        cur_column = start.column - 1
-        res = ''
-        while(cur_line < end.line - 1):
-            res += source_code_copy[cur_line][cur_column:] + ' '
-            cur_line += 1
-            cur_column = 0
-        res += source_code_copy[cur_line][cur_column:end.column - 1]
-        return res
+        # Range helpers, line breaks inside a copied range are followed by a space
+        def get_source_range(range: SourceRange) -> bytes:
+            return source.text(range.start.offset, range.end.offset).replace(b'\n', b'\n ')
     
-    def replace_source_range(range: SourceRange, s: str):
-        replace_source(range.start.line, range.start.column, range.end.line, range.end.column, s)
-    
-    def replace_source(start_line: int, start_column: int, end_line: int, end_column: int, s: str):
-        cur_line = start_line - 1
+        def replace_source_range(range: SourceRange, s: str):
+            source.replace(range.start.offset, range.end.offset, s)
+
+        # Process source code
+        types = cl.TypeTable()
+        check_guards: list[CheckGuardData] = []
+        check_guard_map: dict[str, int] = {}     # signature -> index in `check_guards`
+        forward_decl_stack: list[str] = []
+        for i in range(0, len(sorted_target_cursors)):
+            idx = len(sorted_target_cursors) - 1 - i
+            c:Cursor = sorted_target_cursors[idx]
+            if sorted_target_cursors_is_statement[idx]:
+                if len(forward_decl_stack) > 0:
+                    source.insert(c.extent.start.offset, '\n'.join(forward_decl_stack) + '\n')
+                forward_decl_stack.clear()
+                continue
+
+            # call expr
+            reveal_result = clang_reveal_call_expr(list(c.get_children())[0])
+            cursor: Optional[Cursor] = reveal_result[0]
+            type: cl.TypeInfo = types.get(reveal_result[1])
+
+            # print(f'[{i + 1}]')
+            # cl.traverse_cursor(c, -1)
+            # print(" ")
+            # print(f"{cursor.kind if cursor else ''}, {type.kind}")
+
+            if cursor and cursor.kind == CursorKind.FUNCTION_DECL:
+                continue
+            if type.kind == TypeKind.POINTER:
+                type = type.pointee
+            if not type.kind in [TypeKind.FUNCTIONPROTO, TypeKind.FUNCTIONNOPROTO]:
+                continue
+
+            reduced_spelling:str
+            call_args: list[Cursor] = list(c.get_arguments())
+
+            # True if this expression calls a non-prototype function with arguments,
+            # which is deprecated in mordern C
+            no_proto_with_args = type.kind == TypeKind.FUNCTIONNOPROTO and len(call_args) > 0
+            if no_proto_with_args:
+                call_arg_types = [types.get(arg.type) for arg in call_args]
+                reduced_spelling = cl.TypeSpelling.signature(type.result, call_arg_types, False, True)
+                canonical_spelling = cl.TypeSpelling.signature(type.result, call_arg_types, False, False)
+            else:
+                reduced_spelling = type.func_type(True)
+                canonical_spelling = type.func_type(False)
         
-        cur_column = start_column - 1
-        while(cur_line < end_line - 1):
-            source_code[cur_line] = source_code[cur_line][:cur_column]
-            cur_line += 1
-            cur_column = 0
-        source_code[cur_line] = source_code[cur_line][0:cur_column] + s + source_code[cur_line][end_column - 1:]
-
-    # Process source code
-    check_guards: list[CheckGuardData] = []
-    check_guard_map: dict[str, int] = {}     # signature -> index in `check_guards`
-    forward_decl_stack: list[str] = []
-    for i in range(0, len(sorted_target_cursors)):
-        idx = len(sorted_target_cursors) - 1 - i
-        c:Cursor = sorted_target_cursors[idx]
-        if sorted_target_cursors_is_statement[idx]:
-            if len(forward_decl_stack) > 0:
-                replace_source(c.extent.start.line, c.extent.start.column, c.extent.start.line, c.extent.start.column, '\n'.join(forward_decl_stack) + '\n')
-            forward_decl_stack.clear()
-            continue
-
-        # call expr
-        reveal_result = clang_reveal_call_expr(list(c.get_children())[0])
-        cursor: Optional[Cursor] = reveal_result[0]
-        type: Type = reveal_result[1]
-
-        # print(f'[{i + 1}]')
-        # cl.traverse_cursor(c, -1)
-        # print(" ")
-        # print(f"{cursor.kind if cursor else ''}, {type.kind}")
-
-        if cursor and cursor.kind == CursorKind.FUNCTION_DECL:
-            continue
-        if type.kind == TypeKind.POINTER:
-            type = type.get_pointee()
-        if not type.kind in [TypeKind.FUNCTIONPROTO, TypeKind.FUNCTIONNOPROTO]:
-            continue
-        type = type.get_canonical()
-
-        reduced_spelling:str
-        call_args: list[Cursor] = list(c.get_arguments())
+            if len(callbacks_set) > 0 and not reduced_spelling in callbacks_set:
+                continue
+
+            children:list[Cursor] = list(c.get_children())
+            if not children or len(children) == 0:
+                continue
+            func_ptr = children[0]
+
+            # Prepend first argument
+            offset: int
+            if len(children) > 1:
+                offset = children[1].extent.start.offset
+            else:
+                offset = c.extent.end.offset - 1
+            source.insert(offset, get_source_range(func_ptr.extent) + (b', ' if len(children) > 1 else b''))
 
-        # True if this expression calls a non-prototype function with arguments,
-        # which is deprecated in mordern C
-        no_proto_with_args = type.kind == TypeKind.FUNCTIONNOPROTO and len(call_args) > 0
-        if no_proto_with_args:
-            reduced_spelling = cl.TypeSpelling.call_expr(c, type.get_result(), True)
-            canonical_spelling = cl.TypeSpelling.call_expr(c, type.get_result(), False)
-        else:
-            reduced_spelling = cl.TypeSpelling.func_type(type, True)
-            canonical_spelling = cl.TypeSpelling.func_type(type, False)
-        
-        if len(callbacks_set) > 0 and not reduced_spelling in callbacks_set:
-            continue
+            # Replace callee
+            if canonical_spelling in check_guard_map:
+                name = check_guards[check_guard_map[canonical_spelling]].name
+            else:
+                name = f'__X64NC_CHECK_GUARD_{len(check_guard_map) + 1}'
+                check_guard_map[canonical_spelling] = len(check_guards)
+            replace_source_range(func_ptr.extent, name)
+
+            cg = CheckGuardData()
+            cg.name = name
+            cg.result_type = type.result
+            if no_proto_with_args:
+                cg.arg_types = call_arg_types
+            else:
+                cg.arg_types = type.args
+            cg.reduced_spelling = reduced_spelling
+            cg.canonical_spelling = canonical_spelling
+            cg.type = type
+            cg.no_proto_with_args = no_proto_with_args
+            check_guards.append(cg)
+            forward_decl_stack.insert(0, f'static {cg.decl()};')
 
-        children:list[Cursor] = list(c.get_children())
-        if not children or len(children) == 0:
-            continue
-        func_ptr = children[0]
-
-        # Prepend first argument
-        loc: SourceLocation
-        if len(children) > 1:
-            loc = children[1].extent.start
-            start_line = loc.line
-            start_column = loc.column
-        else:
-            loc = c.extent.end
-            start_line = loc.line
-            start_column = loc.column - 1
-        line = source_code[start_line - 1]
-        line = line[:start_column - 1] + get_source_range(func_ptr.extent) + \
-             (', ' if len(children) > 1 else '') + line[start_column - 1:]
-        source_code[start_line - 1] = line
-
-        # Replace callee
-        if canonical_spelling in check_guard_map:
-            name = check_guards[check_guard_map[canonical_spelling]].name
-        else:
-            name = f'__X64NC_CHECK_GUARD_{len(check_guard_map) + 1}'
-            check_guard_map[canonical_spelling] = len(check_guards)
-        replace_source_range(func_ptr.extent, name)
-
-        cg = CheckGuardData()
-        cg.name = name
-        cg.result_type = type.get_result()
-        if no_proto_with_args:
-            cg.arg_types = [arg.type for arg in call_args]
-        else:
-            cg.arg_types = list(type.argument_types()) if type.kind == TypeKind.FUNCTIONPROTO else []
-        cg.reduced_spelling = reduced_spelling
-        cg.canonical_spelling = canonical_spelling
-        cg.type = type
-        cg.no_proto_with_args = no_proto_with_args
-        check_guards.append(cg)
-        forward_decl_stack.insert(0, f'static {cg.decl()};')
+        # The output may replace the source, so the edits are applied before the mapping is closed
+        source_code = source.apply()
 
     # Generate CFI definitions
     check_guard_declarations: dict[str, str] = {}
@@ -349,7 +295,7 @@ def main():
         print('}\n', file=f)
         for signature, idx in check_guard_map.items():
             cg: CheckGuardData = check_guards[idx]
-            return_type_str = cl.TypeSpelling.decl(cg.result_type)
+            return_type_str = cg.result_type.decl
             decl_str = cg.decl()
             check_guard_declarations[signature] = decl_str
             print(f'static {decl_str}', file=f)
@@ -373,11 +319,46 @@ def main():
             print('}\n', file=f)
         check_guard_definitions_code = f.getvalue()
 
+    # Newlines are translated as the source was read in text mode
+    if b'\r' in source_code:
+        source_code = source_code.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+
+    # The output is replaced atomically, so that a killed worker of a driver never leaves a truncated source
     if len(check_guard_declarations) > 0:
-        with open(output_file, mode='w') as f:
-            f.writelines(source_code)
-            f.write('\n\n')
-            f.writelines(check_guard_definitions_code)
+        write_file_if_changed(output_file, source_code + b'\n\n' + check_guard_definitions_code.encode('utf-8'))
+    return len(check_guard_declarations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Add CFI check guard for function pointers.')
+    parser.add_argument('-X', nargs=argparse.REMAINDER, metavar="<clang args>", default=[], help='Extra arguments to pass to Clang.')
+    parser.add_argument('-c', type=str, metavar="<file>", required=False, help='File contains list of callbacks.')
+    parser.add_argument('-o', type=str, metavar="<out>", required=False, help='Output file name')
+    parser.add_argument('--no-ast-cache', action='store_true', help='Do not read or write the parsed AST cache.')
+    parser.add_argument('source_file', type=str, help='Source file to process.')
+    args = parser.parse_args()
+
+    # Read configuration file
+    with open(Global.config_path, 'r') as file:
+        json_doc = json.load(file)
+
+        # Set the path to the clang library
+        Config.set_library_file(json_doc['libclang'])
+        ast_cache = AstCache.from_config(json_doc, args.no_ast_cache)
+
+    # Arguments
+    callbacks_file: str = args.c if args.c else ''
+    source_file: str = args.source_file
+    output_file: str = args.o if args.o else source_file
+
+    # Load callbacks
+    callbacks_set: set[str] = set()
+    if len(callbacks_file) > 0:
+        callbacks_set = read_list_file_as_set(callbacks_file)
+
+    # Configure the index to parse the header files
+    index = Index.create()
+    lift(index, ast_cache, source_file, output_file, args.X, callbacks_set)
 
 
 if __name__ == '__main__':
@@ -1,3 +1,13 @@
+# Usage: python cfiadd_cc.py <callbacks file> <compile commands> [-E] [-j <jobs>] [--keep-going] [--log-dir <dir>]
+
+# Adds CFI check guards to the sources of a compile commands file with `cfiadd.py`. The files are handed out to the
+# workers one at a time, and the commands run for each file are logged to `<log dir>/<index>_<name>.log`. The run
+# stops at the first failure unless `--keep-going` is given.
+#
+# Each worker loads libclang once and lifts its files in process. If a worker crashes, the files it and the other
+# workers were lifting fail and the remaining files are not started. With `--isolated` a new interpreter runs
+# `cfiadd.py` for each file instead, so that a crash of libclang only fails the file.
+
 from __future__ import annotations;
 
 import argparse
@@ -7,6 +17,30 @@ import sys
 import subprocess
 import os
 import re
+import io
+import time
+import multiprocessing
+import contextlib
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from clang.cindex import Config
+from clang.cindex import Index
+
+from typing import Optional
+
+class Global:
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    config_path = os.path.join(script_dir, 'ncconfig.json')
+
+sys.path.append(Global.script_dir)
+
+from python.text import *
+from python.callscan import may_call_indirectly
+from python.astcache import AstCache
+import cfiadd
 
 # test_files: list[str] = [
 #     "driver/others/blas_server.c",
@@ -33,28 +67,46 @@ import re
 #     "utest/utest_main.c"
 # ]
 
-def main():
-    parser = argparse.ArgumentParser(description='Read compile commands and add CFIs.')
-    parser.add_argument('callbacks_file', type=str, help='File contains list of callbacks.')
-    parser.add_argument('compile_commands', type=str, help='Compile commands file path.')
-    parser.add_argument('-E', action='store_true', help='Run `gcc -E` first')
-    args = parser.parse_args()
+class FileTask:
+    def __init__(self):
+        self.index: int = 0
+        self.directory: str = ''
+        self.source_file: str = ''
+        self.compiler: str = ''
+        self.compile_options: list[str] = []
+        self.log_file: str = ''
 
-    python_executable = sys.executable
-    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cfiadd.py')
 
-    callbacks_file: str = args.callbacks_file
-    compile_commands_file: str = args.compile_commands
-    expand: bool = True if args.E else False
+class FileResult:
+    def __init__(self):
+        self.index: int = 0
+        self.source_file: str = ''
+        self.status: str = 'lifted'         # 'lifted', 'skipped', 'failed' or 'cancelled'
+        self.seconds: float = 0
+        self.filter_seconds: float = 0
+        self.cfiadd_seconds: float = 0
+        self.error: Optional[str] = None
+
 
-    callbacks_file = callbacks_file if os.path.isabs(callbacks_file) else os.path.join(os.getcwd(), callbacks_file)
+class DriverOptions:
+    def __init__(self):
+        self.callbacks_file: str = ''
+        self.expand: bool = False
+        self.use_filter: bool = True
+        self.isolated: bool = False
+        self.libclang: str = ''
+        self.ast_cache: Optional[AstCache] = None
 
+
+"""
+Reads the compile commands, the source file and the compiler options without the output of each command.
+"""
+def read_tasks(compile_commands_file: str, log_dir: str) -> list[FileTask]:
     with open(compile_commands_file) as f:
         json_doc = list(json.load(f))
 
-    all_count = len(json_doc)
-    for i in range(0, all_count):
-        obj = json_doc[i]
+    tasks: list[FileTask] = []
+    for obj in json_doc:
         dir: str = obj['directory']
         filename: str = obj['file']
         
@@ -67,9 +119,6 @@ def main():
         #     continue
 
         source_file = filename if os.path.isabs(filename) else os.path.join(dir, filename)
-        temp_file = f'{source_file}.tmp'
-        
-        print(f'[{i + 1}/{all_count}] Preprocessing {source_file}')
 
         tokens = obj['arguments'] if 'arguments' in obj else shlex.split(obj['command'])
         # for i in range(len(tokens)):
@@ -89,52 +138,249 @@ def main():
             compile_options.append(tokens[i])
             i += 1
 
-        if expand:
-            # Run CC
-            cmds: list[str] = [ tokens[0], '-E', source_file, '-o', temp_file ] + compile_options
-            result = subprocess.run(
+        task = FileTask()
+        task.index = len(tasks)
+        task.directory = dir
+        task.source_file = source_file
+        task.compiler = tokens[0]
+        task.compile_options = compile_options
+        task.log_file = os.path.join(log_dir, f'{task.index + 1:05d}_{os.path.basename(source_file)}.log')
+        tasks.append(task)
+    return tasks
+
+
+# Options of a worker process, and the event set to cancel the files not started after a failure
+worker_options = DriverOptions()
+worker_stop: Optional[multiprocessing.synchronize.Event] = None
+
+# Index and callbacks of a worker process, loaded once for all files it lifts
+worker_index: Optional[Index] = None
+worker_callbacks: set[str] = set()
+
+
+def init_worker(options: DriverOptions, stop: multiprocessing.synchronize.Event):
+    global worker_options, worker_stop, worker_index, worker_callbacks
+    worker_options = options
+    worker_stop = stop
+    if options.isolated:
+        return
+    if not Config.loaded:
+        Config.set_library_file(options.libclang)
+    worker_index = Index.create()
+    worker_callbacks = read_list_file_as_set(options.callbacks_file)
+
+
+def run_worker(task: FileTask) -> FileResult:
+    result = FileResult()
+    result.index = task.index
+    result.source_file = task.source_file
+    if worker_stop is not None and worker_stop.is_set():
+        result.status = 'cancelled'
+        return result
+
+    start = time.perf_counter()
+    with io.StringIO() as log:
+        def run_command(cmds: list[str], verbose: bool = True) -> subprocess.CompletedProcess:
+            process = subprocess.run(
                 cmds,
                 capture_output=True,
                 text=True,
-                cwd=dir
+                errors='replace',
+                cwd=task.directory
             )
-            print(' '.join(cmds))
-            print(f'Exit code: {result.returncode}')
-            if result.returncode != 0:
-                print('--------------------------------------------------------------------')
-                print('[STDOUT]')
-                print(result.stdout)
-                print('[STDERR]')
-                print(result.stderr)
-                print('--------------------------------------------------------------------')
-                exit(-1)
-            
+            print(' '.join(cmds), file=log)
+            print(f'Exit code: {process.returncode}', file=log)
+            if verbose or process.returncode != 0:
+                print('--------------------------------------------------------------------', file=log)
+                print('[STDOUT]', file=log)
+                print(process.stdout, file=log)
+                print('[STDERR]', file=log)
+                print(process.stderr, file=log)
+                print('--------------------------------------------------------------------', file=log)
+            return process
+
+        try:
+            lift_file(task, result, run_command, log)
+        except Exception as e:
+            result.status = 'failed'
+            result.error = f'{type(e).__name__}: {e}'
+            print(traceback.format_exc(), file=log)
+
+        with open(task.log_file, 'w') as f:
+            f.write(log.getvalue())
+
+    if result.status == 'failed' and worker_stop is not None:
+        worker_stop.set()
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+"""
+Returns the failed result of a file whose worker died, the log only records the failure.
+"""
+def lost_result(task: FileTask) -> FileResult:
+    result = FileResult()
+    result.index = task.index
+    result.source_file = task.source_file
+    result.status = 'failed'
+    result.error = 'Worker process died, retry with --isolated'
+    with open(task.log_file, 'w') as f:
+        print('The worker process died before the file was finished.', file=f)
+    return result
+
+
+def lift_file(task: FileTask, result: FileResult, run_command, log: io.StringIO):
+    options = worker_options
+    source_file = task.source_file
+    temp_file = f'{source_file}.tmp'
+
+    if options.expand:
+        # Run CC
+        cmds: list[str] = [ task.compiler, '-E', source_file, '-o', temp_file ] + task.compile_options
+        if run_command(cmds, False).returncode != 0:
+            result.status = 'failed'
+            result.error = 'Preprocessing failed'
+            return
+
+    try:
+        # Skip the file if its preprocessed tokens prove that it has no indirect calls
+        if options.use_filter:
+            start = time.perf_counter()
+            content: Optional[str] = None
+            if options.expand:
+                with open(temp_file, errors='replace') as f:
+                    content = f.read()
+            else:
+                preprocessed = run_command([ task.compiler, '-E', source_file ] + task.compile_options, False)
+                if preprocessed.returncode == 0:
+                    content = preprocessed.stdout
+            skipped = content is not None and not may_call_indirectly(content, not options.expand)
+            result.filter_seconds = time.perf_counter() - start
+            if skipped:
+                result.status = 'skipped'
+                return
+
         # Run CFI-ADD
-        cmds = [ python_executable, script_path, '-c', callbacks_file ]
-        if expand:
-            cmds += [ temp_file, '-o', source_file ]
+        start = time.perf_counter()
+        if options.isolated:
+            script_path = os.path.join(Global.script_dir, 'cfiadd.py')
+            cmds = [ sys.executable, script_path, '-c', options.callbacks_file ]
+            if options.ast_cache is None:
+                cmds += [ '--no-ast-cache' ]
+            if options.expand:
+                cmds += [ temp_file, '-o', source_file ]
+            else:
+                cmds += [ source_file, '-o', source_file, '-X' ] + task.compile_options
+            if run_command(cmds).returncode != 0:
+                result.status = 'failed'
+                result.error = 'cfiadd failed'
         else:
-            cmds += [ source_file, '-o', source_file, '-X' ] + compile_options
-        result = subprocess.run(
-            cmds,
-            capture_output=True,
-            text=True,
-            cwd=dir
-        )
-        print(' '.join(cmds))
-        print(f'Exit code: {result.returncode}')
-        print('--------------------------------------------------------------------')
-        print('[STDOUT]')
-        print(result.stdout)
-        print('[STDERR]')
-        print(result.stderr)
-        print('--------------------------------------------------------------------')
-        if result.returncode != 0:
-            exit(-1)
-        
-        if expand:
+            # Relative paths of the options are relative to the directory of the command
+            input_file = temp_file if options.expand else source_file
+            clang_args = [] if options.expand else task.compile_options
+            cwd = os.getcwd()
+            os.chdir(task.directory)
+            try:
+                with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+                    count = cfiadd.lift(worker_index, options.ast_cache, input_file, source_file, clang_args,
+                                        worker_callbacks)
+            finally:
+                os.chdir(cwd)
+            print(f'cfiadd {input_file} -o {source_file}: {count} check guards', file=log)
+        result.cfiadd_seconds = time.perf_counter() - start
+    finally:
+        if options.expand and os.path.exists(temp_file):
             os.remove(temp_file)
 
 
+def main():
+    parser = argparse.ArgumentParser(description='Read compile commands and add CFIs.')
+    parser.add_argument('callbacks_file', type=str, help='File contains list of callbacks.')
+    parser.add_argument('compile_commands', type=str, help='Compile commands file path.')
+    parser.add_argument('-E', action='store_true', help='Run `gcc -E` first')
+    parser.add_argument('--no-filter', action='store_true', help='Run cfiadd on every file, even if no indirect calls are found in its tokens.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes.')
+    parser.add_argument('-k', '--keep-going', action='store_true', help='Process the other files after a failure, and summarize the failures at the end.')
+    parser.add_argument('--log-dir', type=str, metavar='<dir>', help='Directory of the logs of the files, `cfiadd_logs` next to the compile commands by default.')
+    parser.add_argument('--isolated', action='store_true', help='Run `cfiadd.py` in a new interpreter for each file.')
+    parser.add_argument('--no-ast-cache', action='store_true', help='Do not read or write the parsed AST cache.')
+    args = parser.parse_args()
+
+    # Read configuration file
+    with open(Global.config_path, 'r') as file:
+        json_doc = json.load(file)
+
+    callbacks_file: str = args.callbacks_file
+    compile_commands_file: str = args.compile_commands
+
+    options = DriverOptions()
+    options.callbacks_file = os.path.abspath(callbacks_file)
+    options.expand = True if args.E else False
+    options.use_filter = not args.no_filter
+    options.isolated = args.isolated
+    options.libclang = json_doc['libclang']
+    options.ast_cache = AstCache.from_config(json_doc, args.no_ast_cache)
+
+    log_dir: str = os.path.abspath(args.log_dir) if args.log_dir else \
+        os.path.join(os.path.dirname(os.path.abspath(compile_commands_file)), 'cfiadd_logs')
+    os.makedirs(log_dir, exist_ok=True)
+
+    tasks = read_tasks(compile_commands_file, log_dir)
+    jobs: int = max(1, args.jobs)
+    stop = multiprocessing.Event() if not args.keep_going else None
+
+    results: list[FileResult] = []
+    start = time.time()
+
+    def report(result: FileResult):
+        results.append(result)
+        if result.status == 'cancelled':
+            return
+        message = { 'lifted': 'Lifted', 'skipped': 'Skipped, no indirect calls' }.get(result.status, f'Failed, {result.error}')
+        print(f'[{len(results)}/{len(tasks)}] {result.source_file}: {message} ({result.seconds:.2f} s)')
+
+    if jobs == 1:
+        init_worker(options, stop)
+        for task in tasks:
+            report(run_worker(task))
+    else:
+        # Larger files first to balance the workers, each worker takes the next file when it finishes one
+        def file_size(task: FileTask) -> int:
+            try:
+                return os.path.getsize(task.source_file)
+            except OSError:
+                return 0
+        with ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(options, stop)) as executor:
+            futures = { executor.submit(run_worker, task): task for task in sorted(tasks, key=file_size, reverse=True) }
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    # A worker died, e.g. libclang crashed, and the files not finished have no result
+                    result = lost_result(futures[future])
+                report(result)
+
+    lifted = [result for result in results if result.status == 'lifted']
+    skipped = [result for result in results if result.status == 'skipped']
+    failures = [result for result in results if result.status == 'failed']
+    cancelled = [result for result in results if result.status == 'cancelled']
+    print(f'Lifted {len(lifted)} of {len(results)} files in {time.time() - start:.2f} s, logs are in {log_dir}')
+    if options.use_filter:
+        # The time saved is estimated with the average time of the files processed
+        filter_seconds = sum(result.filter_seconds for result in results)
+        average_seconds = sum(result.cfiadd_seconds for result in lifted) / len(lifted) if len(lifted) > 0 else 0
+        print(f'Skipped {len(skipped)}/{len(results)} files without indirect calls, the filter took {filter_seconds:.2f}s '
+              f'and saved about {len(skipped) * average_seconds - filter_seconds:.2f}s')
+    if len(cancelled) > 0:
+        print(f'Cancelled {len(cancelled)} files after the failure')
+
+    failures.sort(key=lambda result: result.index)
+    for result in failures:
+        print(f'Failed: {result.source_file}, {result.error}, see {tasks[result.index].log_file}')
+
+    if len(failures) > 0:
+        sys.exit(1)
+
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
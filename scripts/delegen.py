@@ -1,8 +1,11 @@
 # Usage: python delegen.py <symbols file> <header file> <library_name> [-o <output dir>] [-X <clang args>]
+#        python delegen.py --from-so <library file> <header file> <library_name> [-o <output dir>] [-X <clang args>]
+#        python delegen.py --from-ir <IR file> [-o <output dir>]
 
 # Generates "x64nc_declarations.h",
 #           "x64nc_delegate_guest_definitions.cpp"
 #           "x64nc_delegate_host_definitions.cpp"
+#           "x64nc_delegate_{guest,host}_definitions_<n>.c" with `--shards <n>`
 #           "<library_name>_callbacks.txt"
 
 from __future__ import annotations
@@ -12,7 +15,6 @@ import os
 import re
 import io
 import argparse
-import shutil
 import json
 
 from clang.cindex import Config
@@ -24,7 +26,7 @@ from clang.cindex import TypeKind
 from clang.cindex import SourceRange
 from clang.cindex import SourceLocation
 
-from typing import Optional
+from typing import Any, Iterator, Optional
 
 class Global:
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -44,226 +46,391 @@ class Global:
 sys.path.append(Global.script_dir)
 
 from python.text import *
+from python.astcache import AstCache, parse_translation_unit
+from python.elfsym import SymbolCache
+from python.apiir import ApiIr, IrFunction, IrCallback, IrType
 import python.clang as cl
 
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Generate stub functions for given symbols.')
-    parser.add_argument('-X', nargs=argparse.REMAINDER, metavar="<clang args>", default=[], help='Extra arguments to pass to Clang.')
-    parser.add_argument('-o', type=str, metavar="<out>", required=False, help='Output directory name')
-    parser.add_argument('symbols_file', type=str, help='File contains list of symbols.')
-    parser.add_argument('header_file', type=str, help='Header file to parse.')
-    parser.add_argument('library_name', type=str, help='Library name.')
-    args = parser.parse_args()
-
-    # Read configuration file
-    with open(Global.config_path, 'r') as file:
-        json_doc = json.load(file)
-
-        # Set the path to the clang library
-        Config.set_library_file(json_doc['libclang'])
-        Global.guest_cc = json_doc['nativeCompat']['guest']['cc']
-        Global.guest_include_path = json_doc['nativeCompat']['guest']['includePath']
-        Global.guest_library_path = json_doc['nativeCompat']['guest']['libraryPath']
-        Global.guest_output_path = json_doc['nativeCompat']['guest']['outputPath']
-        Global.host_cc = json_doc['nativeCompat']['host']['cc']
-        Global.host_include_path = json_doc['nativeCompat']['host']['includePath']
-        Global.host_library_path = json_doc['nativeCompat']['host']['libraryPath']
-        Global.host_output_path = json_doc['nativeCompat']['host']['outputPath']
-
-    # Arguments
-    symbols_file: str = args.symbols_file
-    header_file: str = args.header_file
-    library_name: str = args.library_name
-    output_file_directory: str = args.o if args.o else f'{library_name}_src'
-
-    input_include_dirs = cl.CommandLine.include_dirs(args.X)
-    input_definitions = cl.CommandLine.defnitions(args.X)
-    
-    # Load symbols
-    symbols_set = read_list_file_as_set(symbols_file)
-    
-    # Configure the index to parse the header files
-    index = Index.create()
-    translation_unit = index.parse(header_file, args=['-x', 'c'] + args.X)
+"""
+Reads the native compatibility paths of the configuration.
+"""
+def load_config(json_doc: dict[str, Any]):
+    Global.guest_cc = json_doc['nativeCompat']['guest']['cc']
+    Global.guest_include_path = json_doc['nativeCompat']['guest']['includePath']
+    Global.guest_library_path = json_doc['nativeCompat']['guest']['libraryPath']
+    Global.guest_output_path = json_doc['nativeCompat']['guest']['outputPath']
+    Global.host_cc = json_doc['nativeCompat']['host']['cc']
+    Global.host_include_path = json_doc['nativeCompat']['host']['includePath']
+    Global.host_library_path = json_doc['nativeCompat']['host']['libraryPath']
+    Global.host_output_path = json_doc['nativeCompat']['host']['outputPath']
+
+
+"""
+Returns the member of `X64NC_Slot` that holds a value of the type, `v` for void or empty if the type cannot be
+passed in a slot.
+"""
+def scalar_slot(type: cl.TypeInfo) -> str:
+    if type.kind == TypeKind.VOID:
+        return 'v'
+    if type.kind in [TypeKind.BOOL, TypeKind.CHAR_U, TypeKind.UCHAR, TypeKind.CHAR_S, TypeKind.SCHAR,
+                     TypeKind.WCHAR, TypeKind.CHAR16, TypeKind.CHAR32, TypeKind.USHORT, TypeKind.SHORT,
+                     TypeKind.UINT, TypeKind.INT, TypeKind.ULONG, TypeKind.LONG, TypeKind.ULONGLONG,
+                     TypeKind.LONGLONG, TypeKind.ENUM]:
+        return 'i'
+    if type.kind == TypeKind.FLOAT:
+        return 'f'
+    if type.kind == TypeKind.DOUBLE:
+        return 'd'
+    if type.kind == TypeKind.POINTER and type.decl != cl.TypeSpelling.norm_va_list:
+        return 'p'
+    return ''
+
+
+"""
+Collects the API surface of a library from its header, the index can be shared by several libraries.
+"""
+def collect(index: Index, ast_cache: Optional[AstCache], symbols_set: set[str], header_file: str,
+            library_name: str, clang_args: list[str]) -> ApiIr:
+    # Parse the header files
+    translation_unit = parse_translation_unit(index, ast_cache, header_file, ['-x', 'c'] + clang_args)
 
     # Collect function declarations and types
-    functions: dict[str, Cursor] = {}
-    symbols_remaining = symbols_set
-    all_types: list[Type] = []
+    types = cl.TypeTable()
+    functions: dict[str, tuple[cl.TypeInfo, list[cl.TypeInfo], cl.TypeInfo]] = {}     # result, arguments, function
+    symbols_remaining = set(symbols_set)
+    all_types: list[cl.TypeInfo] = []
     all_type_spellings: set[str] = set()
     c: Cursor
     for c in translation_unit.cursor.get_children():
         if c.kind == CursorKind.FUNCTION_DECL and c.spelling in symbols_remaining:
+            result_type = types.get(c.result_type)
+            arg_types = [types.get(arg.type) for arg in c.get_arguments()]
+
             # Scan types
-            cl.scan_types(c.result_type, all_types, all_type_spellings)
-            for arg in c.get_arguments():
-                cl.scan_types(arg.type, all_types, all_type_spellings)
-            
+            cl.scan_types(result_type, all_types, all_type_spellings)
+            for arg_type in arg_types:
+                cl.scan_types(arg_type, all_types, all_type_spellings)
+
             # Collect function
-            functions[c.spelling] = c
+            functions[c.spelling] = result_type, arg_types, types.get(c.type)
             symbols_remaining.remove(c.spelling)
-    
+
     # Find function prototypes
-    callback_types: list[Type] = []
+    callback_types: list[cl.TypeInfo] = []
     callback_type_spellings: set[str] = set()
-    type: Type
+    type: cl.TypeInfo
     for type in all_types:
-        type = cl.Typing.primitive(type).get_canonical()
-        if cl.Typing.is_func_ptr(type):
-            spelling: str = cl.TypeSpelling.func_type(type, True)
+        type = type.primitive
+        if type.is_func_ptr:
+            spelling: str = type.func_type(True)
             if spelling in callback_type_spellings:
                 continue
             callback_types.append(type)
             callback_type_spellings.add(spelling)
 
-    # Generate declarations file
-    with io.StringIO() as f:
-        lines: list[str] = []
-        with open(header_file, 'r') as file:
-            for line in file:
-                lines.append(line.replace('\n', ''))
-        
-        # Header content
-        print("X64NC_EXTERN_C_BEGIN", file=f)
-        for line in lines:
-            print(line, file=f)
-        print("X64NC_EXTERN_C_END", file=f)
-        print("\n", file=f)
-
-        # Functions
-        f.write('#ifndef X64NC_API_FOREACH_PRE\n#define X64NC_API_FOREACH_PRE(F)\n#endif\n')
-        f.write('#define X64NC_API_FOREACH(F) X64NC_API_FOREACH_PRE(F)')
-        for spelling in functions.keys():
-            f.write(f' \\\n    F({spelling})')
-        f.write('\n\n')
-
-        # Callbacks
-        f.write('#ifndef X64NC_CALLBACK_FOREACH_PRE\n#define X64NC_CALLBACK_FOREACH_PRE(F)\n#endif\n')
-        f.write('#define X64NC_CALLBACK_FOREACH(F) X64NC_CALLBACK_FOREACH_PRE(F)')
-        for i in range(0, len(callback_types)):
-            f.write(f' \\\n    F(\"{cl.TypeSpelling.func_type(callback_types[i], True)}\", __X64NC_CallbackThunk_{i + 1})')
-        f.write('\n\n')
-
-        declaration_file_content = cl.TypeSpelling.normalize_builtin(f.getvalue())
-    
-    # Generate guest file
+    ir = ApiIr()
+    ir.library_name = library_name
+    ir.header_file = os.path.abspath(header_file)
+    with open(header_file, 'r') as file:
+        ir.header_content = file.read()
+    ir.clang_args = clang_args
+    ir.missing_symbols = sorted(symbols_remaining)
+
+    for name, (result_type, arg_types, function_type) in functions.items():
+        function = IrFunction()
+        function.name = name
+        function.result = result_type.decl
+        function.args = [arg_type.decl for arg_type in arg_types]
+        function.variadic = function_type.variadic
+        function.canonical = cl.TypeSpelling.signature(result_type, arg_types, False, False)
+        function.reduced = cl.TypeSpelling.signature(result_type, arg_types, False, True)
+        slots = [scalar_slot(result_type)] + [scalar_slot(arg_type) for arg_type in arg_types]
+        if not function.variadic and all(slots) and not 'v' in slots[1:]:
+            function.slots = ''.join(slots)
+        ir.functions.append(function)
+
+    for type in callback_types:
+        callback = IrCallback()
+        callback.signature = type.func_type(True)
+        callback.result = type.result.decl
+        callback.args = [arg_type.decl for arg_type in type.args]
+        callback.canonical = type.spelling
+        ir.callbacks.append(callback)
+
+    # Type graph, in the order of the scan
+    type_indexes = { all_types[i].spelling: i for i in range(0, len(all_types)) }
+    for type in all_types:
+        refs: list[cl.TypeInfo] = []
+        if type.kind == TypeKind.POINTER:
+            refs = [type.pointee]
+        elif type.is_array:
+            refs = [type.element]
+        elif type.kind == TypeKind.FUNCTIONPROTO:
+            refs = [type.result] + type.args
+        elif type.kind == TypeKind.FUNCTIONNOPROTO:
+            refs = [type.result]
+        elif type.kind == TypeKind.RECORD:
+            refs = type.fields
+        ir_type = IrType()
+        ir_type.spelling = type.spelling
+        ir_type.kind = type.kind.spelling
+        ir_type.refs = [type_indexes[ref.spelling] for ref in refs if ref.spelling in type_indexes]
+        ir.types.append(ir_type)
+    return ir
+
+
+"""
+Yields the declarations file of the delegates: the header content and the lists of functions and callbacks.
+"""
+def declaration_fragments(ir: ApiIr, batching: bool) -> Iterator[str]:
+    lines = ir.header_content.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+
+    # Header content
+    yield 'X64NC_EXTERN_C_BEGIN\n'
+    for line in lines:
+        yield line + '\n'
+    yield 'X64NC_EXTERN_C_END\n\n\n'
+
+    if batching:
+        yield '#define X64NC_DELEGATE_BATCHED\n\n'
+
+    # Functions
+    yield '#ifndef X64NC_API_FOREACH_PRE\n#define X64NC_API_FOREACH_PRE(F)\n#endif\n'
+    yield '#define X64NC_API_FOREACH(F) X64NC_API_FOREACH_PRE(F)'
+    for function in ir.functions:
+        yield f' \\\n    F({function.name})'
+    yield '\n\n'
+
+    # Callbacks
+    yield '#ifndef X64NC_CALLBACK_FOREACH_PRE\n#define X64NC_CALLBACK_FOREACH_PRE(F)\n#endif\n'
+    yield '#define X64NC_CALLBACK_FOREACH(F) X64NC_CALLBACK_FOREACH_PRE(F)'
+    for i in range(0, len(ir.callbacks)):
+        yield f' \\\n    F(\"{ir.callbacks[i].signature}\", __X64NC_CallbackThunk_{i + 1})'
+    yield '\n\n'
+
+
+"""
+Returns the guest definition of a function, `batched` if the call is queued and `batching` if any function of the
+library is, so that the queue is flushed before the call.
+"""
+def guest_function_definition(function: IrFunction, batched: bool = False, batching: bool = False) -> str:
     with io.StringIO() as f:
-        # Generate function definitions
-        for c in functions.values():
-            type: Type = c.type
-            return_type_spelling = cl.TypeSpelling.decl(c.result_type)
-            args:list[Cursor] = list(c.get_arguments())
-
-            # Generate function declaration
-            decl_str = f'{return_type_spelling} {c.spelling} (' + \
-                str(', ').join([f"{cl.TypeSpelling.decl(args[i].type)} {f'_arg{i + 1}'}" for i in range(0, len(args))])
-            if type.kind == TypeKind.FUNCTIONPROTO and type.is_function_variadic():
-                decl_str += ', ...'
-            decl_str += ')'
-            print(decl_str, file=f)
-
-            # Generate function body
-            print("{", file=f)
-            
-            arg_ptr_array_str = str(', ').join(f"_R(_arg{i + 1})" for i in range(0, len(args)))
-            arg_ptr_array_str = '{' + arg_ptr_array_str + '}'
-            print(f'    void *_args[] = {arg_ptr_array_str};', file=f)
-            
+        return_type_spelling = function.result
+        args = function.args
+
+        # Generate function declaration
+        decl_str = f'{return_type_spelling} {function.name} (' + \
+            str(', ').join([f"{args[i]} {f'_arg{i + 1}'}" for i in range(0, len(args))])
+        if function.variadic:
+            decl_str += ', ...'
+        decl_str += ')'
+        print(decl_str, file=f)
+
+        # Generate function body
+        print("{", file=f)
+
+        if batched:
+            # Queue the call, the arguments are copied into the queue
+            slots = function.slots
+            print(f'    X64NC_Slot *_args = DynamicApis_BatchCall((void *) DynamicApis_p{function.name}, {len(args)});', file=f)
+            for i in range(0, len(args)):
+                print(f"    _args[{i}].{slots[i + 1]} = {'(void *) ' if slots[i + 1] == 'p' else ''}_arg{i + 1};", file=f)
+            print('}\n', file=f)
+            return f.getvalue()
+
+        if batching:
+            print('    DynamicApis_SyncBatch();', file=f)
+
+        if function.slots:
+            # Scalars only, pass the values in slots
+            slots = function.slots
+            args_str = 'NULL'
+            if len(args) > 0:
+                arg_slot_array_str = str(', ').join( \
+                    f"{{.{slots[i + 1]} = {'(void *) ' if slots[i + 1] == 'p' else ''}_arg{i + 1}}}" for i in range(0, len(args)))
+                arg_slot_array_str = '{' + arg_slot_array_str + '}'
+                print(f'    X64NC_Slot _args[] = {arg_slot_array_str};', file=f)
+                args_str = '(void **) _args'
+
             if return_type_spelling != 'void':
-                print(f'    {return_type_spelling} _ret;', file=f)
-                # print(f'    printf(\"Call {c.spelling}\\n");', file=f)
-                print(f'    x64nc_CallNativeProc(DynamicApis_p{c.spelling}, _args, &_ret, 0);', file=f)
-                # print(f'    printf(\"OK\\n");', file=f)
-                print(f'    return _ret;', file=f)
+                print(f'    X64NC_Slot _ret;', file=f)
+                print(f'    x64nc_CallNativeProc(DynamicApis_p{function.name}, {args_str}, &_ret, 0);', file=f)
+                print(f'    return ({return_type_spelling}) _ret.{slots[0]};', file=f)
             else:
-                print(f'    x64nc_CallNativeProc(DynamicApis_p{c.spelling}, _args, NULL, 0);', file=f)
+                print(f'    x64nc_CallNativeProc(DynamicApis_p{function.name}, {args_str}, NULL, 0);', file=f)
 
             print('}\n', file=f)
+            return f.getvalue()
 
-        # Print hint of undefined functions
-        for symbol in symbols_remaining:
-            print(f'// No definition found for {symbol}', file=f)
-        
-        print("\n", file=f)
+        arg_ptr_array_str = str(', ').join(f"_R(_arg{i + 1})" for i in range(0, len(args)))
+        arg_ptr_array_str = '{' + arg_ptr_array_str + '}'
+        print(f'    void *_args[] = {arg_ptr_array_str};', file=f)
 
-        # Generate callback thunks
-        for i in range(0, len(callback_types)):
-            type: Type = callback_types[i]
-            return_type_spelling = cl.TypeSpelling.decl(type.get_result())
-            arg_types:list[Type] = list(type.argument_types())
-            args_dereferenced = [ \
-                f"*(__typeof__({cl.TypeSpelling.decl(arg_types[i])}) *) {f'_args[{i}]'}" for i in range(0, len(arg_types))]
+        if return_type_spelling != 'void':
+            print(f'    {return_type_spelling} _ret;', file=f)
+            # print(f'    printf(\"Call {function.name}\\n");', file=f)
+            print(f'    x64nc_CallNativeProc(DynamicApis_p{function.name}, _args, &_ret, 0);', file=f)
+            # print(f'    printf(\"OK\\n");', file=f)
+            print(f'    return _ret;', file=f)
+        else:
+            print(f'    x64nc_CallNativeProc(DynamicApis_p{function.name}, _args, NULL, 0);', file=f)
 
-            # Generate function declaration
-            print(f"static void __X64NC_CallbackThunk_{i + 1}(void *_callback, void *_args[], void *_ret)", file=f)
+        print('}\n', file=f)
+        return f.getvalue()
 
-            # Generate function body
-            print("{", file=f)
 
-            if return_type_spelling != 'void':
-                print(f'    *(__typeof__({return_type_spelling}) *) _ret =', file=f)
+def guest_callback_thunk(index: int, callback: IrCallback, batching: bool = False) -> str:
+    with io.StringIO() as f:
+        args_dereferenced = [ \
+            f"*(__typeof__({callback.args[i]}) *) {f'_args[{i}]'}" for i in range(0, len(callback.args))]
 
-            print(f'    ((__typeof__({type.get_canonical().spelling}) *) _callback) (', file=f)
-            print('        %s' % ',\n        '.join(args_dereferenced), file=f)
-            print('    );', file=f)
-            print('}\n', file=f)
-        
-        guest_delegate_file_content = cl.TypeSpelling.normalize_builtin(f.getvalue())
-    
-    # Generate host file
+        # Generate function declaration
+        print(f"DynamicApis_Linkage void __X64NC_CallbackThunk_{index + 1}(void *_callback, void *_args[], void *_ret)", file=f)
+
+        # Generate function body
+        print("{", file=f)
+
+        if callback.result != 'void':
+            print(f'    *(__typeof__({callback.result}) *) _ret =', file=f)
+
+        print(f'    ((__typeof__({callback.canonical}) *) _callback) (', file=f)
+        print('        %s' % ',\n        '.join(args_dereferenced), file=f)
+        print('    );', file=f)
+        if batching:
+            # The host continues after the callback returns
+            print('    DynamicApis_SyncBatch();', file=f)
+        print('}\n', file=f)
+        return f.getvalue()
+
+
+def host_function_definition(function: IrFunction) -> str:
     with io.StringIO() as f:
-        print('X64NC_EXTERN_C_BEGIN', file=f)
-        print('\n', file=f)
-        for c in functions.values():
-            return_type_spelling = cl.TypeSpelling.decl(c.result_type)
-            args:list[Cursor] = list(c.get_arguments())
-            
-            # Generate function declaration
-            print(f"X64NC_DECL_EXPORT void my_{c.spelling}(void *_args[], void *_ret)", file=f)
-
-            # Generate function body
-            print("{", file=f)
+        return_type_spelling = function.result
+        args = function.args
+
+        # Generate function declaration
+        print(f"X64NC_DECL_EXPORT void my_{function.name}(void *_args[], void *_ret)", file=f)
 
+        # Generate function body
+        print("{", file=f)
+
+        if function.slots:
+            # Scalars only, the values are passed in slots
+            slots = function.slots
             if return_type_spelling != 'void':
-                print(f'    *(__typeof__({return_type_spelling}) *) _ret =', file=f)
+                print(f"    ((X64NC_Slot *) _ret)->{slots[0]} ={' (void *)' if slots[0] == 'p' else ''}", file=f)
 
-            arg_dereferenced_list_str = str(', ').join([ \
-                f"*(__typeof__({cl.TypeSpelling.decl(args[i].type)}) *) {f'_args[{i}]'}" for i in range(0, len(args))])
-            print(f'    DynamicApis_p{c.spelling}({arg_dereferenced_list_str});', file=f)
+            arg_slot_list_str = str(', ').join([ \
+                f"({args[i]}) ((X64NC_Slot *) _args)[{i}].{slots[i + 1]}" for i in range(0, len(args))])
+            print(f'    DynamicApis_p{function.name}({arg_slot_list_str});', file=f)
             print('}\n', file=f)
-        print('\n', file=f)
-        print('X64NC_EXTERN_C_END', file=f)
-        
-        host_delegate_file_content = cl.TypeSpelling.normalize_builtin(f.getvalue())
-
-    # Write files
+            return f.getvalue()
+
+        if return_type_spelling != 'void':
+            print(f'    *(__typeof__({return_type_spelling}) *) _ret =', file=f)
+
+        arg_dereferenced_list_str = str(', ').join([ \
+            f"*(__typeof__({args[i]}) *) {f'_args[{i}]'}" for i in range(0, len(args))])
+        print(f'    DynamicApis_p{function.name}({arg_dereferenced_list_str});', file=f)
+        print('}\n', file=f)
+        return f.getvalue()
+
+
+"""
+Generates the delegate sources of a library into `output_file_directory` from its API surface. With several
+shards, the definitions are split into as many translation units.
+
+The definitions are produced one at a time and streamed into the files, so that the memory use does not grow with
+the size of the API.
+
+The calls of the functions in `batch_set` are queued by the guest delegate instead, if they return void and take
+scalars only.
+"""
+def emit(ir: ApiIr, output_file_directory: str, shards: int = 1, batch_set: Optional[set[str]] = None):
+    input_include_dirs = cl.CommandLine.include_dirs(ir.clang_args)
+    input_definitions = cl.CommandLine.defnitions(ir.clang_args)
+
+    # Functions to batch
+    batched_names: set[str] = set()
+    unbatched_names: list[str] = []
+    for function in ir.functions:
+        if batch_set and function.name in batch_set:
+            if function.slots.startswith('v'):
+                batched_names.add(function.name)
+            else:
+                unbatched_names.append(function.name)
+    batching = len(batched_names) > 0
+
+    # Print hint of undefined functions and functions that cannot be batched
+    guest_hints = ''.join([f'// No definition found for {symbol}\n' for symbol in ir.missing_symbols])
+    guest_hints += ''.join([f'// Cannot batch {name}, it returns a value or takes an argument that is not a scalar\n' \
+                            for name in unbatched_names])
+
+    def guest_fragments(functions_range: range, thunks_range: range, prefix: str, separator: str) -> Iterator[str]:
+        yield prefix
+        for i in functions_range:
+            yield guest_function_definition(ir.functions[i], ir.functions[i].name in batched_names, batching)
+        yield separator
+        for i in thunks_range:
+            yield guest_callback_thunk(i, ir.callbacks[i], batching)
+
+    def host_fragments(functions_range: range, prefix: str) -> Iterator[str]:
+        yield prefix + 'X64NC_EXTERN_C_BEGIN\n\n\n'
+        for i in functions_range:
+            yield host_function_definition(ir.functions[i])
+        yield '\n\nX64NC_EXTERN_C_END\n'
+
+    def write_normalized(file_name: str, fragments: Iterator[str]):
+        write_fragments_if_changed(os.path.join(output_file_directory, file_name),
+                                   map(cl.TypeSpelling.normalize_builtin, fragments))
+
+    # Write files, unchanged files are kept so that the delegates are not rebuilt
     if not os.path.exists(output_file_directory):
         os.makedirs(output_file_directory)
 
-    with open(os.path.join(output_file_directory, '_x64nc_declarations.h'), mode='w') as f:
-        f.write(declaration_file_content)
-
-    with open(os.path.join(output_file_directory, '_x64nc_delegate_guest_definitions.c'), mode='w') as f:
-        f.write(guest_delegate_file_content)
-
-    with open(os.path.join(output_file_directory, '_x64nc_delegate_host_definitions.c'), mode='w') as f:
-        f.write(host_delegate_file_content)
-
-    with open(os.path.join(output_file_directory, f'{library_name}_callbacks.txt'), mode='w') as f:
-        f.write("\n".join(callback_type_spellings))
+    write_normalized('_x64nc_declarations.h', declaration_fragments(ir, batching))
+
+    # Split the definitions into the shards, each is a translation unit including the prefix of the delegate
+    shard_count = shards if shards > 1 else 0
+    if shard_count > 0:
+        write_file_if_changed(os.path.join(output_file_directory, '_x64nc_delegate_guest_definitions.c'), guest_hints)
+        write_file_if_changed(os.path.join(output_file_directory, '_x64nc_delegate_host_definitions.c'), '')
+        for i in range(0, shard_count):
+            functions_range = range(len(ir.functions) * i // shards, len(ir.functions) * (i + 1) // shards)
+            thunks_range = range(len(ir.callbacks) * i // shards, len(ir.callbacks) * (i + 1) // shards)
+            write_normalized(f'_x64nc_delegate_guest_definitions_{i + 1}.c',
+                guest_fragments(functions_range, thunks_range, '#include "x64nc_delegate_guest.h"\n\n', '\n'))
+            write_normalized(f'_x64nc_delegate_host_definitions_{i + 1}.c',
+                host_fragments(functions_range, '#include "x64nc_delegate_host.h"\n\n'))
+    else:
+        write_normalized('_x64nc_delegate_guest_definitions.c',
+            guest_fragments(range(0, len(ir.functions)), range(0, len(ir.callbacks)), '', guest_hints + '\n\n'))
+        write_normalized('_x64nc_delegate_host_definitions.c', host_fragments(range(0, len(ir.functions)), ''))
+
+    # Remove the shards of a previous generation
+    for name in os.listdir(output_file_directory):
+        match = re.fullmatch(r'_x64nc_delegate_(guest|host)_definitions_(\d+)\.c', name)
+        if match and int(match.group(2)) > shard_count:
+            os.remove(os.path.join(output_file_directory, name))
+
+    write_file_if_changed(os.path.join(output_file_directory, f'{ir.library_name}_callbacks.txt'),
+                          "\n".join([callback.signature for callback in ir.callbacks]))
 
     # Copy templates
-    files = [os.path.join(Global.resource_dir, file) for file in os.listdir(Global.resource_dir)]
-    for file in files:
-        if os.path.isfile(file):
-            shutil.copy(file, output_file_directory)
+    for name in sorted(os.listdir(Global.resource_dir)):
+        file = os.path.join(Global.resource_dir, name)
+        if os.path.isfile(file) and name != 'Makefile':
+            with open(file, 'rb') as f:
+                write_file_if_changed(os.path.join(output_file_directory, name), f.read())
     
-    # Rewrite Makefile
-    replace_file_placeholders(os.path.join(output_file_directory, 'Makefile'),
+    # Generate Makefile
+    replace_file_placeholders(os.path.join(Global.resource_dir, 'Makefile'),
         { 
-            'NC_USER_LIBRARY_NAME': library_name,
+            'NC_USER_LIBRARY_NAME': ir.library_name,
             'NC_USER_INCLUDE_PATHS': ' '.join(input_include_dirs),
             'NC_USER_DEFINITIONS': ' '.join(input_definitions),
             'NC_GUEST_CC': Global.guest_cc,
@@ -274,9 +441,78 @@ def main():
             'NC_HOST_RUNTIME_INCLUDE_PATH': Global.host_include_path,
             'NC_HOST_RUNTIME_LINK_PATH': Global.host_library_path,
             'NC_HOST_OUTPUT_PATH': Global.host_output_path,
-        }
+            'NC_DELEGATE_SHARDS': ' '.join([str(i + 1) for i in range(0, shard_count)]),
+        },
+        os.path.join(output_file_directory, 'Makefile')
     )
 
 
+"""
+Generates the delegate sources of a library from its header.
+"""
+def generate(index: Index, ast_cache: Optional[AstCache], symbols_set: set[str], header_file: str,
+             library_name: str, output_file_directory: str, clang_args: list[str], shards: int = 1,
+             batch_set: Optional[set[str]] = None) -> ApiIr:
+    ir = collect(index, ast_cache, symbols_set, header_file, library_name, clang_args)
+    emit(ir, output_file_directory, shards, batch_set)
+    return ir
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate stub functions for given symbols.')
+    parser.add_argument('-X', nargs=argparse.REMAINDER, metavar="<clang args>", default=[], help='Extra arguments to pass to Clang.')
+    parser.add_argument('-o', type=str, metavar="<out>", required=False, help='Output directory name')
+    parser.add_argument('--no-ast-cache', action='store_true', help='Do not read or write the parsed AST cache.')
+    parser.add_argument('--shards', type=int, metavar='<n>', default=1, help='Split the definitions into n translation units.')
+    parser.add_argument('--from-so', action='store_true', help='Read the functions exported by the shared library given as the symbols file.')
+    parser.add_argument('--save-ir', type=str, metavar='<file>', help='Write the API surface of the library to a file.')
+    parser.add_argument('--from-ir', type=str, metavar='<file>', help='Generate from the API surface written by `--save-ir` without parsing.')
+    parser.add_argument('--batch', type=str, metavar='<file>', help='File contains list of void functions whose calls are queued and executed together.')
+    parser.add_argument('symbols_file', type=str, nargs='?', help='File contains list of symbols.')
+    parser.add_argument('header_file', type=str, nargs='?', help='Header file to parse.')
+    parser.add_argument('library_name', type=str, nargs='?', help='Library name.')
+    args = parser.parse_args()
+
+    if not args.from_ir and not args.library_name:
+        parser.error('the symbols file, the header file and the library name are required without --from-ir')
+
+    # Read configuration file
+    with open(Global.config_path, 'r') as file:
+        json_doc = json.load(file)
+        load_config(json_doc)
+
+    batch_set = read_list_file_as_set(args.batch) if args.batch else None
+
+    # Regenerate from the API surface only
+    if args.from_ir:
+        ir = ApiIr.load(args.from_ir)
+        emit(ir, args.o if args.o else f'{ir.library_name}_src', args.shards, batch_set)
+        return
+
+    # Set the path to the clang library
+    Config.set_library_file(json_doc['libclang'])
+    ast_cache = AstCache.from_config(json_doc, args.no_ast_cache)
+
+    # Arguments
+    symbols_file: str = args.symbols_file
+    header_file: str = args.header_file
+    library_name: str = args.library_name
+    output_file_directory: str = args.o if args.o else f'{library_name}_src'
+
+    # Load symbols
+    if args.from_so:
+        symbol_cache = SymbolCache(SymbolCache.default_path)
+        symbols_set = set(symbol_cache.exported_functions([symbols_file]))
+        symbol_cache.save()
+    else:
+        symbols_set = read_list_file_as_set(symbols_file)
+
+    index = Index.create()
+    ir = generate(index, ast_cache, symbols_set, header_file, library_name, output_file_directory, args.X, args.shards,
+                  batch_set)
+    if args.save_ir:
+        ir.save(args.save_ir)
+
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,246 @@
+# Usage: python delegen_batch.py <manifest> [-o <output dir>] [-j <jobs>] [--report <file>]
+
+# Generates the delegate sources of all libraries in a manifest in one process, the same as running `delegen.py`
+# for each library. A library that fails is reported without stopping the others.
+#
+# The manifest is a JSON list of libraries, the entries of the ncistat info file can be used with the symbols
+# file added:
+#   {
+#       "name": "<library name>",
+#       "symbols": "<symbols file>", or "libs": ["<library file>", ...],
+#       "header": "<header file>", or "headers": ["<header file>", ...],
+#       "flags": ["<clang args>", ...],     (optional)
+#       "batch": "<batch file>",            (optional, void functions whose calls are queued, see `delegen.py --batch`)
+#       "output": "<output dir>"            (optional, `<output dir>/<name>_src` by default)
+#   }
+# Relative paths are relative to the manifest. With "libs" the exported functions are read from the libraries, so
+# that the info file of ncifilter can be used directly.
+#
+# With `--save-ir` the API surface of each library is also written to `<output>/<name>_api.json`, `--from-ir`
+# regenerates all libraries from these files without parsing any header.
+
+from __future__ import annotations
+
+import sys
+import os
+import argparse
+import json
+import time
+import multiprocessing
+
+from clang.cindex import Config
+from clang.cindex import Index
+
+from typing import Any, Optional
+
+class Global:
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    config_path = os.path.join(script_dir, 'ncconfig.json')
+
+sys.path.append(Global.script_dir)
+
+from python.text import *
+from python.astcache import AstCache
+from python.elfsym import SymbolCache
+from python.apiir import ApiIr
+import delegen
+
+
+class LibraryTask:
+    def __init__(self):
+        self.name: str = ''
+        self.symbols_file: str = ''
+        self.symbols: Optional[list[str]] = None      # exported functions of the libraries if there is no symbols file
+        self.header_file: str = ''
+        self.headers: list[str] = []        # headers to include in a generated header if there is no header file
+        self.flags: list[str] = []
+        self.batch_file: str = ''
+        self.output_dir: str = ''
+        self.error: Optional[str] = None        # reported as the failure of the library
+
+
+class LibraryResult:
+    def __init__(self):
+        self.name: str = ''
+        self.seconds: float = 0
+        self.error: Optional[str] = None
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'status': 'ok' if self.error is None else 'failed',
+            'seconds': round(self.seconds, 3),
+            'error': self.error,
+        }
+
+
+"""
+Reads the libraries of a manifest, paths are resolved relative to the manifest.
+"""
+def read_manifest(manifest_file: str, output_dir: str, symbol_cache: Optional[SymbolCache]) -> list[LibraryTask]:
+    with open(manifest_file, 'r') as file:
+        manifest_doc: list[dict[str, Any]] = json.load(file)
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+
+    def resolve(path: str) -> str:
+        return os.path.normpath(os.path.join(manifest_dir, path))
+
+    tasks: list[LibraryTask] = []
+    for i in range(0, len(manifest_doc)):
+        item = manifest_doc[i]
+        task = LibraryTask()
+        task.name = f'<entry {i + 1}>'
+        # An invalid entry fails its library only
+        try:
+            task.name = item['name']
+            if 'symbols' in item:
+                task.symbols_file = resolve(item['symbols'])
+            elif 'libs' in item:
+                if symbol_cache is not None:
+                    task.symbols = symbol_cache.exported_functions([resolve(lib) for lib in item['libs']])
+            else:
+                raise ValueError('Neither "symbols" nor "libs" is given')
+            if 'header' in item:
+                task.header_file = resolve(item['header'])
+            elif len(item.get('headers', [])) > 0:
+                task.headers = [resolve(header) for header in item['headers']]
+            else:
+                raise ValueError('Neither "header" nor "headers" is given')
+            task.flags = item.get('flags', [])
+            task.batch_file = resolve(item['batch']) if 'batch' in item else ''
+            task.output_dir = resolve(item['output']) if 'output' in item else \
+                os.path.abspath(os.path.join(output_dir, f"{task.name}_src"))
+        except (KeyError, TypeError, OSError, ValueError) as e:
+            task.error = f'{type(e).__name__}: {e}'
+        tasks.append(task)
+    return tasks
+
+
+class BatchOptions:
+    def __init__(self):
+        self.shards: int = 1
+        self.save_ir: bool = False
+        self.from_ir: bool = False
+
+
+# Index of a worker process, libclang is loaded once per worker unless generating from the IR
+worker_index: Optional[Index] = None
+worker_ast_cache: Optional[AstCache] = None
+worker_options = BatchOptions()
+
+
+def init_worker(libclang: str, ast_cache: Optional[AstCache], json_doc: dict[str, Any], options: BatchOptions):
+    global worker_index, worker_ast_cache, worker_options
+    delegen.load_config(json_doc)
+    worker_options = options
+    if options.from_ir:
+        return
+    if not Config.loaded:
+        Config.set_library_file(libclang)
+    worker_index = Index.create()
+    worker_ast_cache = ast_cache
+
+
+def ir_file(task: LibraryTask) -> str:
+    return os.path.join(task.output_dir, f'{task.name}_api.json')
+
+
+def run_worker(task: LibraryTask) -> LibraryResult:
+    result = LibraryResult()
+    result.name = task.name
+    start = time.time()
+    if task.error is not None:
+        result.error = task.error
+        return result
+    try:
+        batch_set = read_list_file_as_set(task.batch_file) if task.batch_file else None
+        if worker_options.from_ir:
+            delegen.emit(ApiIr.load(ir_file(task)), task.output_dir, worker_options.shards, batch_set)
+            result.seconds = time.time() - start
+            return result
+
+        header_file = task.header_file
+        if not header_file:
+            # Include all headers from one header
+            os.makedirs(task.output_dir, exist_ok=True)
+            header_file = os.path.join(task.output_dir, f'{task.name}_headers.h')
+            write_file_if_changed(header_file, ''.join([f'#include "{header}"\n' for header in task.headers]))
+
+        symbols_set = set(task.symbols) if task.symbols is not None else read_list_file_as_set(task.symbols_file)
+        ir = delegen.generate(worker_index, worker_ast_cache, symbols_set, header_file, task.name, task.output_dir,
+                              task.flags, worker_options.shards, batch_set)
+        if worker_options.save_ir:
+            ir.save(ir_file(task))
+    except Exception as e:
+        result.error = f'{type(e).__name__}: {e}'
+    result.seconds = time.time() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate stub functions for the libraries in a manifest.')
+    parser.add_argument('manifest_file', type=str, help='File contains list of libraries.')
+    parser.add_argument('-o', type=str, metavar='<out>', default='.', help='Directory of the libraries without an output directory.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes.')
+    parser.add_argument('--report', type=str, metavar='<file>', help='Write the timing and status of each library to a JSON file.')
+    parser.add_argument('--shards', type=int, metavar='<n>', default=1, help='Split the definitions of each library into n translation units.')
+    ir_group = parser.add_mutually_exclusive_group()
+    ir_group.add_argument('--save-ir', action='store_true', help='Write the API surface of each library to its output directory.')
+    ir_group.add_argument('--from-ir', action='store_true', help='Generate from the API surfaces written by `--save-ir` without parsing.')
+    parser.add_argument('--no-ast-cache', action='store_true', help='Do not read or write the parsed AST cache.')
+    args = parser.parse_args()
+
+    # Read configuration file
+    with open(Global.config_path, 'r') as file:
+        json_doc = json.load(file)
+    libclang: str = json_doc['libclang']
+    ast_cache = AstCache.from_config(json_doc, args.no_ast_cache)
+
+    options = BatchOptions()
+    options.shards = args.shards
+    options.save_ir = args.save_ir
+    options.from_ir = args.from_ir
+
+    # Symbols are not needed to generate from the IR
+    symbol_cache = SymbolCache(SymbolCache.default_path) if not options.from_ir else None
+    tasks = read_manifest(args.manifest_file, args.o, symbol_cache)
+    if symbol_cache:
+        symbol_cache.save()
+    jobs: int = max(1, args.jobs)
+
+    results: list[LibraryResult] = []
+    start = time.time()
+
+    def report(result: LibraryResult):
+        results.append(result)
+        if result.error is None:
+            print(f"[{len(results)}/{len(tasks)}] {result.name}: {result.seconds:.2f} s")
+        else:
+            print(f"[{len(results)}/{len(tasks)}] {result.name}: Failed after {result.seconds:.2f} s, {result.error}")
+
+    if jobs == 1:
+        init_worker(libclang, ast_cache, json_doc, options)
+        for task in tasks:
+            report(run_worker(task))
+    else:
+        with multiprocessing.Pool(jobs, initializer=init_worker, initargs=(libclang, ast_cache, json_doc, options)) as pool:
+            for result in pool.imap_unordered(run_worker, tasks):
+                report(result)
+
+    failures = [result for result in results if result.error is not None]
+    print(f"Generated {len(results) - len(failures)} of {len(results)} libraries in {time.time() - start:.2f} s")
+    for result in failures:
+        print(f"Failed: {result.name}")
+
+    if args.report:
+        order = { tasks[i].name: i for i in range(0, len(tasks)) }
+        results.sort(key=lambda result: order[result.name])
+        with open(args.report, 'w') as file:
+            json.dump([result.to_dict() for result in results], file, indent=4)
+
+    if len(failures) > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
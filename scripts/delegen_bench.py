@@ -0,0 +1,276 @@
+# Usage: python delegen_bench.py [-n <frames>] [-o <work dir>] [--shards <n>] [-X <clang args>]
+
+# Measures the transitions between the guest and the host of a delegate generated with and without `--batch`.
+#
+# A sample library with an immediate-mode style API is generated and built with the host compiler for both sides,
+# then a sample program calls it through a runtime whose `x64nc_CallNativeProc` calls the host delegate directly.
+# Each transition also makes one system call as the lower bound of the magic system call of QEMU, so the rates of the
+# two delegates can be compared with each other but not with the emulator.
+#
+# The sample library is lifted with cfiadd, so `bench_begin`, which is batched, calls back into the program through
+# the callback thunk of the guest delegate while the queue is executed, and the callback queues a call itself.
+#
+# The runtime headers in `include` need avcall.h of ffcall, pass its include path with `-X -I<dir>` if it is not
+# installed in a system directory.
+
+from __future__ import annotations
+
+import sys
+import os
+import argparse
+import json
+import subprocess
+import tempfile
+
+from clang.cindex import Config
+from clang.cindex import Index
+
+class Global:
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    config_path = os.path.join(script_dir, 'ncconfig.json')
+    include_dir = os.path.join(os.path.dirname(script_dir), 'include')
+
+    library_name = 'bench'
+    functions = ['bench_set_callback', 'bench_begin', 'bench_color3d', 'bench_texcoord2i', 'bench_vertex3f',
+                 'bench_end']
+    batched_functions = ['bench_begin', 'bench_color3d', 'bench_texcoord2i', 'bench_vertex3f']
+    calls_per_frame = 303
+
+sys.path.append(Global.script_dir)
+
+import delegen
+import cfiadd
+
+
+SAMPLE_HEADER = r'''
+typedef void (*bench_callback)(int frame);
+
+void bench_set_callback(bench_callback callback);
+void bench_begin(int frame);
+void bench_color3d(double r, double g, double b);
+void bench_texcoord2i(int s, int t);
+void bench_vertex3f(float x, float y, float z);
+long bench_end(void);
+'''
+
+SAMPLE_SOURCE = r'''
+#include "bench.h"
+
+static unsigned long state;
+static bench_callback callback;
+
+void bench_set_callback(bench_callback proc) { callback = proc; }
+void bench_begin(int frame) { state = frame; if (callback) callback(frame); }
+void bench_color3d(double r, double g, double b) { state = state * 31 + (unsigned long) (r * 4 + g * 2 + b * 8); }
+void bench_texcoord2i(int s, int t) { state = state * 31 + s - t; }
+void bench_vertex3f(float x, float y, float z) { state = state * 31 + (unsigned long) (x + y * 3 + z * 5); }
+long bench_end(void) { return (long) state; }
+'''
+
+RUNTIME_SOURCE = r'''
+#define _GNU_SOURCE
+#include <dlfcn.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <sys/syscall.h>
+
+static long transitions = 0;
+
+static const char *thunk_signatures[16];
+static void *thunks[16];
+static int thunk_count = 0;
+
+long bench_transitions(void) { return transitions; }
+
+char *x64nc_SearchLibrary(const char *path, int mode) { return getenv("BENCH_HOST_DELEGATE"); }
+char *x64nc_SearchLibraryH(const char *path, int mode) { return getenv("BENCH_LIBRARY"); }
+void *x64nc_LoadLibrary(const char *path, int flags) { return dlopen(path, flags); }
+int x64nc_FreeLibrary(void *handle) { return dlclose(handle); }
+void *x64nc_GetProcAddress(void *handle, const char *name) { return dlsym(handle, name); }
+char *x64nc_GetErrorMessage() { return dlerror(); }
+void x64nc_AddCallbackThunk(const char *sign, void *func) {
+    thunk_signatures[thunk_count] = sign;
+    thunks[thunk_count++] = func;
+}
+
+void *x64nc_LookUpCallbackThunk(const char *sign) {
+    for (int i = 0; i < thunk_count; i++) {
+        if (strcmp(thunk_signatures[i], sign) == 0) {
+            return thunks[i];
+        }
+    }
+    return NULL;
+}
+
+void x64nc_CallNativeProc(void *func, void *args[], void *ret, int convention) {
+    transitions++;
+    syscall(SYS_getppid);
+    ((void (*)(void *[], void *)) func)(args, ret);
+}
+
+static void ExecuteCallback(void *thunk, void *callback, void *args[], void *ret) {
+    transitions++;
+    syscall(SYS_getppid);
+    ((void (*)(void *, void *[], void *)) thunk)(callback, args, ret);
+}
+
+void *x64nc_GetFPExecuteCallback() { return ExecuteCallback; }
+'''
+
+PROGRAM_SOURCE = r'''
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+#include "bench.h"
+
+extern long bench_transitions(void);
+
+static void on_begin(int frame) { bench_texcoord2i(frame, -1); }
+
+int main(int argc, char *argv[]) {
+    int frames = atoi(argv[1]);
+    long checksum = 0;
+    struct timespec start, end;
+    bench_set_callback(on_begin);
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    for (int frame = 0; frame < frames; frame++) {
+        bench_begin(frame);
+        for (int i = 0; i < 100; i++) {
+            bench_color3d(i * 0.5, 1.0, 0.25);
+            bench_texcoord2i(i, frame);
+            bench_vertex3f(i, i * 2.0f, frame);
+        }
+        checksum ^= bench_end();
+    }
+    clock_gettime(CLOCK_MONOTONIC, &end);
+    double seconds = (end.tv_sec - start.tv_sec) + (end.tv_nsec - start.tv_nsec) / 1e9;
+    printf("%ld %.6f %ld\n", bench_transitions(), seconds, checksum);
+    return 0;
+}
+'''
+
+
+class BenchResult:
+    def __init__(self):
+        self.name: str = ''
+        self.calls: int = 0
+        self.transitions: int = 0
+        self.seconds: float = 0
+        self.checksum: int = 0
+
+
+def write_file(path: str, content: str):
+    with open(path, 'w') as file:
+        file.write(content)
+
+
+def run_command(cmds: list[str], env: dict[str, str] = None) -> str:
+    result = subprocess.run(cmds, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(f'{" ".join(cmds)} failed:\n{result.stdout}')
+    return result.stdout
+
+
+"""
+Generates and builds the delegates of the sample library into `<work dir>/<name>`, then runs the sample program.
+"""
+def run_variant(index: Index, work_dir: str, name: str, batch_set: set[str], frames: int, shards: int,
+                clang_args: list[str]) -> BenchResult:
+    variant_dir = os.path.join(work_dir, name)
+    source_dir = os.path.join(variant_dir, 'src')
+    guest_dir = os.path.join(variant_dir, 'guest')
+    host_dir = os.path.join(variant_dir, 'host')
+    runtime_dir = os.path.join(work_dir, 'runtime')
+    for dir in [guest_dir, host_dir]:
+        os.makedirs(dir, exist_ok=True)
+
+    delegen.load_config({
+        'nativeCompat': {
+            'guest': { 'cc': 'cc', 'includePath': Global.include_dir, 'libraryPath': runtime_dir,
+                       'outputPath': guest_dir },
+            'host': { 'cc': 'cc', 'includePath': Global.include_dir, 'libraryPath': runtime_dir,
+                      'outputPath': host_dir },
+        }
+    })
+    delegen.generate(index, None, set(Global.functions), os.path.join(work_dir, 'bench.h'), Global.library_name,
+                     source_dir, clang_args, shards, batch_set)
+    run_command(['make', '-s', '-C', source_dir])
+
+    program = os.path.join(variant_dir, 'program')
+    run_command(['cc', '-O2', '-o', program, os.path.join(work_dir, 'program.c'), f'-I{work_dir}',
+                 f'-L{guest_dir}', f'-l{Global.library_name}', f'-Wl,-rpath={guest_dir}',
+                 f'-L{runtime_dir}', '-lx64nc-guestrt', f'-Wl,-rpath={runtime_dir}'])
+
+    env = dict(os.environ)
+    env['BENCH_HOST_DELEGATE'] = os.path.join(host_dir, f'lib{Global.library_name}_host_bridge.so')
+    env['BENCH_LIBRARY'] = os.path.join(work_dir, 'native', f'lib{Global.library_name}.so')
+    output = run_command([program, str(frames)], env)
+
+    result = BenchResult()
+    result.name = name
+    result.calls = frames * Global.calls_per_frame
+    values = output.strip().split('\n')[-1].split()
+    result.transitions = int(values[0])
+    result.seconds = float(values[1])
+    result.checksum = int(values[2])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the transitions of delegates with and without batched calls.')
+    parser.add_argument('-n', '--frames', type=int, default=20000, help=f'Number of frames, each makes {Global.calls_per_frame} calls.')
+    parser.add_argument('-o', type=str, metavar='<out>', help='Work directory, a temporary directory by default.')
+    parser.add_argument('--shards', type=int, metavar='<n>', default=1, help='Split the definitions into n translation units.')
+    parser.add_argument('-X', nargs=argparse.REMAINDER, metavar="<clang args>", default=[], help='Extra arguments to pass to Clang and the compiler.')
+    args = parser.parse_args()
+
+    # Read configuration file
+    with open(Global.config_path, 'r') as file:
+        json_doc = json.load(file)
+    Config.set_library_file(json_doc['libclang'])
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = os.path.abspath(args.o) if args.o else temp_dir
+        os.makedirs(os.path.join(work_dir, 'native'), exist_ok=True)
+        os.makedirs(os.path.join(work_dir, 'runtime'), exist_ok=True)
+
+        # Sample library, program and runtime
+        write_file(os.path.join(work_dir, 'bench.h'), SAMPLE_HEADER)
+        write_file(os.path.join(work_dir, 'bench.c'), SAMPLE_SOURCE)
+        write_file(os.path.join(work_dir, 'program.c'), PROGRAM_SOURCE)
+        write_file(os.path.join(work_dir, 'runtime.c'), RUNTIME_SOURCE)
+
+        # The library calls the callback through a check guard as it would in the emulator
+        index = Index.create()
+        lifted_file = os.path.join(work_dir, 'bench_lifted.c')
+        if cfiadd.lift(index, None, os.path.join(work_dir, 'bench.c'), lifted_file, [f'-I{work_dir}'] + args.X,
+                       set()) == 0:
+            print('No callback is lifted in the sample library')
+            sys.exit(1)
+        run_command(['cc', '-O2', '-fPIC', '-shared', '-o',
+                     os.path.join(work_dir, 'native', f'lib{Global.library_name}.so'), lifted_file, f'-I{work_dir}'])
+        for runtime in ['x64nc-guestrt', 'x64nc-hostrt']:
+            run_command(['cc', '-O2', '-fPIC', '-shared', '-o', os.path.join(work_dir, 'runtime', f'lib{runtime}.so'),
+                         os.path.join(work_dir, 'runtime.c'), '-ldl'])
+
+        results = [
+            run_variant(index, work_dir, 'unbatched', set(), args.frames, args.shards, args.X),
+            run_variant(index, work_dir, 'batched', set(Global.batched_functions), args.frames, args.shards, args.X),
+        ]
+
+    print(f"{'delegate':<12}{'calls':>12}{'transitions':>14}{'seconds':>10}{'calls/s':>14}{'transitions/s':>16}")
+    for result in results:
+        print(f"{result.name:<12}{result.calls:>12}{result.transitions:>14}{result.seconds:>10.3f}"
+              f"{result.calls / result.seconds:>14.0f}{result.transitions / result.seconds:>16.0f}")
+    print(f"Transitions per call: {results[0].transitions / results[0].calls:.3f} -> "
+          f"{results[1].transitions / results[1].calls:.3f}, speedup {results[0].seconds / results[1].seconds:.1f}x")
+
+    if results[0].checksum != results[1].checksum:
+        print(f"Checksums differ: {results[0].checksum} != {results[1].checksum}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,41 +1,4 @@
-#define _GNU_SOURCE
-
-#include <dlfcn.h>
-#include <limits.h>
-
-#include <stdio.h>
-#include <stdlib.h>
-#include <string.h>
-
-#define X64NC_GUEST_DELEGATE_SOURCE
-
-#ifdef __cplusplus
-#  include <type_traits>
-static constexpr auto _R(T &&value) {
-    using NonConstType = std::remove_cv_t<std::remove_reference_t<T>>;
-    return const_cast<NonConstType *>(&value);
-}
-#else
-#  define _R(X) ((void *) &X)
-#endif
-
-#include <x64nc/guestapi.h>
-#include <x64nc/x64nc_common.h>
-
-#include "x64nc_shared.h"
-
-#ifndef X64NC_API_FOREACH
-#  define X64NC_API_FOREACH(X)
-#endif
-
-#define DynamicApis_SearchLibrary(NAME) x64nc_SearchLibrary(NAME, X64NC_SL_Mode_G2H)
-#define DynamicApis_LoadLibrary         x64nc_LoadLibrary
-#define DynamicApis_GetProcAddress      x64nc_GetProcAddress
-#define DynamicApis_FreeLibrary         x64nc_FreeLibrary
-#define DynamicApis_GetErrorMessage     x64nc_GetErrorMessage
-
-#define DynamicApis_Name(NAME) ("my_" #NAME)
-#define DynamicApis_Category   "Guest Delegate"
+#include "x64nc_delegate_guest.h"
 
 // =================================================================================================
 // Utils
@@ -57,7 +20,7 @@ static void DynamicApis_PostInitialize();
 
 // =================================================================================================
 // Declare Function Pointers
-#define _F(NAME) static __typeof__(&NAME) DynamicApis_p##NAME = NULL;
+#define _F(NAME) DynamicApis_Linkage __typeof__(&NAME) DynamicApis_p##NAME = NULL;
 X64NC_API_FOREACH(_F)
 #undef _F
 // =================================================================================================
@@ -65,6 +28,58 @@ X64NC_API_FOREACH(_F)
 
 
 
+// =================================================================================================
+// Batched Calls
+#ifdef X64NC_DELEGATE_BATCHED
+// The first slot is the number of the used slots, each call takes the function, the number of
+// arguments and the arguments
+DynamicApis_Linkage __thread X64NC_Slot DynamicApis_BatchQueue[X64NC_BATCH_CAPACITY];
+
+static __thread int DynamicApis_BatchRegistered = 0;
+
+static pthread_key_t DynamicApis_BatchKey;
+
+static void *DynamicApis_ExecuteBatch = NULL;
+
+DynamicApis_Linkage void DynamicApis_FlushBatch() {
+    int count = DynamicApis_BatchQueue[0].i;
+    if (count == 0) {
+        return;
+    }
+    // The calls may reenter the delegate through callbacks, which queue and flush their own calls,
+    // so the host executes a copy and the queue is emptied before the transition
+    X64NC_Slot batch[X64NC_BATCH_CAPACITY];
+    memcpy(batch, DynamicApis_BatchQueue, (1 + count) * sizeof(X64NC_Slot));
+    DynamicApis_BatchQueue[0].i = 0;
+    x64nc_CallNativeProc(DynamicApis_ExecuteBatch, (void **) batch, NULL, 0);
+}
+
+static void DynamicApis_BatchThreadExit(void *queue) {
+    DynamicApis_FlushBatch();
+}
+
+DynamicApis_Linkage X64NC_Slot *DynamicApis_BatchCall(void *func, int argc) {
+    X64NC_Slot *queue = DynamicApis_BatchQueue;
+    if (queue[0].i + 2 + argc >= X64NC_BATCH_CAPACITY) {
+        DynamicApis_FlushBatch();
+    }
+    if (!DynamicApis_BatchRegistered) {
+        // The value is only set to get the queue flushed at thread exit
+        pthread_setspecific(DynamicApis_BatchKey, queue);
+        DynamicApis_BatchRegistered = 1;
+    }
+    X64NC_Slot *entry = queue + 1 + queue[0].i;
+    entry[0].p = func;
+    entry[1].i = argc;
+    queue[0].i += 2 + argc;
+    return entry + 2;
+}
+#endif
+// =================================================================================================
+
+
+
+
 // =================================================================================================
 // Constructor and Destructor
 static void *DynamicApis_LibraryHandle = NULL;
@@ -103,6 +118,10 @@ static void X64NC_CONSTRUCTOR DynamicApis_Constructor() {
 }
 
 static void X64NC_DESTRUCTOR DynamicApis_Destructor() {
+#ifdef X64NC_DELEGATE_BATCHED
+    DynamicApis_FlushBatch();
+#endif
+
     // Free library
     DynamicApis_FreeLibrary(DynamicApis_LibraryHandle);
 }
@@ -115,6 +134,7 @@ static void X64NC_DESTRUCTOR DynamicApis_Destructor() {
 // x64nc_delegate_guest_definitions.c
 // 1. define all functions that forward the arguments and return value reference`
 // 2. define all callback thunks
+// with `--shards`, they're defined in _x64nc_delegate_guest_definitions_<n>.c instead
 #include "_x64nc_delegate_guest_definitions.c"
 // =================================================================================================
 
@@ -130,5 +150,14 @@ static void DynamicApis_PreInitialize() {
 }
 
 static void DynamicApis_PostInitialize() {
+#ifdef X64NC_DELEGATE_BATCHED
+    DynamicApis_ExecuteBatch =
+        DynamicApis_GetProcAddress(DynamicApis_LibraryHandle, DynamicApis_Name(__X64NC_ExecuteBatch));
+    if (!DynamicApis_ExecuteBatch) {
+        printf(DynamicApis_Category ": Batch executor cannot be resolved!\n");
+        abort();
+    }
+    pthread_key_create(&DynamicApis_BatchKey, DynamicApis_BatchThreadExit);
+#endif
 }
 // =================================================================================================
\ No newline at end of file
@@ -0,0 +1,84 @@
+#ifndef X64NC_DELEGATE_GUEST_H
+#define X64NC_DELEGATE_GUEST_H
+
+// Prefix of the delegate and the shards of its definitions, precompiled by the Makefile if sharded
+
+#define _GNU_SOURCE
+
+#include <dlfcn.h>
+#include <limits.h>
+#include <pthread.h>
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#define X64NC_GUEST_DELEGATE_SOURCE
+
+#ifdef __cplusplus
+#  include <type_traits>
+static constexpr auto _R(T &&value) {
+    using NonConstType = std::remove_cv_t<std::remove_reference_t<T>>;
+    return const_cast<NonConstType *>(&value);
+}
+#else
+#  define _R(X) ((void *) &X)
+#endif
+
+#include <x64nc/guestapi.h>
+#include <x64nc/x64nc_common.h>
+
+#include "x64nc_shared.h"
+
+#ifndef X64NC_API_FOREACH
+#  define X64NC_API_FOREACH(X)
+#endif
+
+#define DynamicApis_SearchLibrary(NAME) x64nc_SearchLibrary(NAME, X64NC_SL_Mode_G2H)
+#define DynamicApis_LoadLibrary         x64nc_LoadLibrary
+#define DynamicApis_GetProcAddress      x64nc_GetProcAddress
+#define DynamicApis_FreeLibrary         x64nc_FreeLibrary
+#define DynamicApis_GetErrorMessage     x64nc_GetErrorMessage
+
+#define DynamicApis_Name(NAME) ("my_" #NAME)
+#define DynamicApis_Category   "Guest Delegate"
+
+// =================================================================================================
+// Linkage of the function pointers and callback thunks, they're shared by the shards of the definitions if
+// generated with `--shards`
+#ifdef X64NC_DELEGATE_SHARDED
+#  define DynamicApis_Linkage __attribute__((visibility("hidden")))
+
+#  define _F(NAME) extern DynamicApis_Linkage __typeof__(&NAME) DynamicApis_p##NAME;
+X64NC_API_FOREACH(_F)
+#  undef _F
+#  define _F(SIGNATURE, FUNC) DynamicApis_Linkage void FUNC(void *_callback, void *_args[], void *_ret);
+X64NC_CALLBACK_FOREACH(_F)
+#  undef _F
+#  ifdef X64NC_DELEGATE_BATCHED
+extern DynamicApis_Linkage __thread X64NC_Slot DynamicApis_BatchQueue[];
+DynamicApis_Linkage void DynamicApis_FlushBatch();
+DynamicApis_Linkage X64NC_Slot *DynamicApis_BatchCall(void *func, int argc);
+#  endif
+#else
+#  define DynamicApis_Linkage static
+#endif
+// =================================================================================================
+
+
+
+
+// =================================================================================================
+// Calls of the functions generated with `--batch` are queued per thread and executed by the host
+// delegate in one call, the queue is flushed before any other function of the library is called
+#ifdef X64NC_DELEGATE_BATCHED
+#  define X64NC_BATCH_CAPACITY 1024
+
+#  define DynamicApis_SyncBatch()                                                                  \
+    if (DynamicApis_BatchQueue[0].i) {                                                             \
+        DynamicApis_FlushBatch();                                                                  \
+    }
+#endif
+// =================================================================================================
+
+#endif // X64NC_DELEGATE_GUEST_H
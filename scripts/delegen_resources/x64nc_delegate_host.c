@@ -1,31 +1,4 @@
-#define _GNU_SOURCE
-
-#include <dlfcn.h>
-#include <limits.h>
-
-#include <stdio.h>
-#include <stdlib.h>
-#include <string.h>
-
-#define X64NC_HOST_DELEGATE_SOURCE
-
-#include <x64nc/hostapi.h>
-#include <x64nc/x64nc_common.h>
-
-#include "x64nc_shared.h"
-
-#ifndef X64NC_API_FOREACH
-#  define X64NC_API_FOREACH(X)
-#endif
-
-#define DynamicApis_SearchLibrary(NAME) x64nc_SearchLibraryH(NAME, X64NC_SL_Mode_H2N)
-#define DynamicApis_LoadLibrary         dlopen
-#define DynamicApis_GetProcAddress      dlsym
-#define DynamicApis_FreeLibrary         dlclose
-#define DynamicApis_GetErrorMessage     dlerror
-
-#define DynamicApis_Name(NAME) #NAME
-#define DynamicApis_Category   "Host Delegate"
+#include "x64nc_delegate_host.h"
 
 // =================================================================================================
 // Utils
@@ -47,7 +20,7 @@ static void DynamicApis_PostInitialize();
 
 // =================================================================================================
 // Declare Function Pointers
-#define _F(NAME) static __typeof__(&NAME) DynamicApis_p##NAME = NULL;
+#define _F(NAME) DynamicApis_Linkage __typeof__(&NAME) DynamicApis_p##NAME = NULL;
 X64NC_API_FOREACH(_F)
 #undef _F
 // =================================================================================================
@@ -100,9 +73,29 @@ static void X64NC_DESTRUCTOR DynamicApis_Destructor() {
 
 
 
+// =================================================================================================
+// Batched Calls
+#ifdef X64NC_DELEGATE_BATCHED
+// Executes the calls queued by the guest delegate, see `DynamicApis_BatchCall`
+X64NC_DECL_EXPORT void my___X64NC_ExecuteBatch(void *_args[], void *_ret) {
+    X64NC_Slot *queue = (X64NC_Slot *) _args;
+    X64NC_Slot *entry = queue + 1;
+    X64NC_Slot *end = entry + queue[0].i;
+    while (entry < end) {
+        ((void (*)(void *[], void *)) entry[0].p)((void **) (entry + 2), NULL);
+        entry += 2 + entry[1].i;
+    }
+}
+#endif
+// =================================================================================================
+
+
+
+
 // =================================================================================================
 // x64nc_delegate_host_definitions.c
 // 1. define all functions in form of `void my_XXX(void *, void *)`
+// with `--shards`, they're defined in _x64nc_delegate_host_definitions_<n>.c instead
 #include "_x64nc_delegate_host_definitions.c"
 // =================================================================================================
 
@@ -0,0 +1,49 @@
+#ifndef X64NC_DELEGATE_HOST_H
+#define X64NC_DELEGATE_HOST_H
+
+// Prefix of the delegate and the shards of its definitions, precompiled by the Makefile if sharded
+
+#define _GNU_SOURCE
+
+#include <dlfcn.h>
+#include <limits.h>
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#define X64NC_HOST_DELEGATE_SOURCE
+
+#include <x64nc/hostapi.h>
+#include <x64nc/x64nc_common.h>
+
+#include "x64nc_shared.h"
+
+#ifndef X64NC_API_FOREACH
+#  define X64NC_API_FOREACH(X)
+#endif
+
+#define DynamicApis_SearchLibrary(NAME) x64nc_SearchLibraryH(NAME, X64NC_SL_Mode_H2N)
+#define DynamicApis_LoadLibrary         dlopen
+#define DynamicApis_GetProcAddress      dlsym
+#define DynamicApis_FreeLibrary         dlclose
+#define DynamicApis_GetErrorMessage     dlerror
+
+#define DynamicApis_Name(NAME) #NAME
+#define DynamicApis_Category   "Host Delegate"
+
+// =================================================================================================
+// Linkage of the function pointers, they're shared by the shards of the definitions if
+// generated with `--shards`
+#ifdef X64NC_DELEGATE_SHARDED
+#  define DynamicApis_Linkage __attribute__((visibility("hidden")))
+
+#  define _F(NAME) extern DynamicApis_Linkage __typeof__(&NAME) DynamicApis_p##NAME;
+X64NC_API_FOREACH(_F)
+#  undef _F
+#else
+#  define DynamicApis_Linkage static
+#endif
+// =================================================================================================
+
+#endif // X64NC_DELEGATE_HOST_H
@@ -12,4 +12,19 @@
 
 #ifndef X64NC_LIBRARY_NAME
 #  define X64NC_LIBRARY_NAME "sample"
-#endif
\ No newline at end of file
+#endif
+
+
+
+
+// =================================================================================================
+// Slot of a value passed between the delegates, the functions whose arguments and return value are
+// all integers, floating points or pointers pass an array of slots instead of the addresses of
+// the arguments
+typedef union X64NC_Slot {
+    long long i;
+    float f;
+    double d;
+    void *p;
+} X64NC_Slot;
+// =================================================================================================
@@ -10,7 +10,11 @@ import shlex
 import pathlib
 import csv
 
-from typing import Any
+from typing import Any, Optional
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from python.elfsym import SymbolCache
 
 
 
@@ -18,10 +22,22 @@ def main():
     parser = argparse.ArgumentParser(description='Generate CSV file')
     parser.add_argument('input_dir', type=str, help='Directory contains statistic result.')
     parser.add_argument('output_file', type=str, help='File of the CSV.')
+    parser.add_argument('--from-so', type=str, metavar='<info file>', help='Count the functions exported by the libraries of the info file.')
     args = parser.parse_args()
     
     input_dir: str = args.input_dir
     output_file: str = args.output_file
+
+    # Exported functions of each library
+    exported_cnts: Optional[dict[str, int]] = None
+    if args.from_so:
+        with open(args.from_so, 'r') as file:
+            info_doc: list[dict[str, Any]] = json.load(file)
+        symbol_cache = SymbolCache(SymbolCache.default_path)
+        exported_cnts = {}
+        for item in info_doc:
+            exported_cnts[item['name']] = len(symbol_cache.exported_functions(item['libs']))
+        symbol_cache.save()
     
     output_content = [
         [
@@ -33,8 +49,12 @@ def main():
             'complex_fp_functions'
         ]
     ]
+    if exported_cnts is not None:
+        output_content[0].append('exported_functions')
     
     for item in os.listdir(input_dir):
+        if not item.endswith('.json'):
+            continue
         with open(os.path.join(input_dir, item), 'r') as file:
             obj = json.load(file)
             name: str = obj['name']
@@ -63,6 +83,8 @@ def main():
                                 complex_fp_functions
                             ]
             )
+            if exported_cnts is not None:
+                output_content[-1].append(exported_cnts.get(name, ''))
     
     with open(output_file, mode='w', newline='', encoding='utf-8') as file:
         writer = csv.writer(file)
@@ -1,147 +1,352 @@
-import sys
-import os
-import re
-import io
-import argparse
-import shutil
-import json
-import subprocess
-import shlex
-import pathlib
-
-from typing import Any, Optional
-
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-
-import python.clang as cl
-from python.text import *
-
-class PackageInfo:
-    def __init__(self):
-        self.name: str = ''
-        self.flags: list[str] = []
-        self.libs: list[str] = []
-        self.headers: list[str] = []
-
-
-def process_package(pkg: str) -> Optional[PackageInfo]:
-    # Get name
-    idx = pkg.find('-dev')
-    if idx < 0:
-        return None
-    name = pkg[0:idx]
-
-    flags: list[str] = []
-    libs: list[str] = []
-    headers: list[str] = []
-
-    # 1. Use `dpkg -L` to search headers
-    cmds: list[str] = [ "dpkg", "-L", pkg ]
-    result = subprocess.run(
-        cmds,
-        capture_output=True,
-        text=True
-    )
-    if result.returncode != 0:
-        print(f"Running `{' '.join(cmds)}` error:\n {result.stderr}")
-        return None
-    files = result.stdout.split('\n')
-    for file in files:
-        if len(file) == 0:
-            continue
-        file = os.path.realpath(file)
-        if not os.path.exists(file):
-            continue
-
-        ext = (''.join(pathlib.Path(file).suffixes)).lower()
-        print(f'OK: {file}, {ext}')
-        if ext == '.pc':
-            cmds: list[str] = [ "pkg-config", file, '--cflags' ]
-            result = subprocess.run(
-                cmds,
-                capture_output=True,
-                text=True
-            )
-            if result.returncode != 0:
-                print(f"Running `{' '.join(cmds)}` error:\n {result.stderr}")
-                continue
-            flags += shlex.split(result.stdout)
-        elif ext == '.h':
-            if file in headers:
-                continue
-            headers.append(file)
-        elif '.so' in ext:
-            if file in libs:
-                continue
-            print(file)
-            libs.append(file)
-    
-    # Check headers
-    valid_headers: list[str] = []
-    for header in headers:
-        cmds: list[str] = [ "gcc", '-x', 'c', header, '-fsyntax-only' ] + flags
-        result = subprocess.run(
-            cmds,
-            capture_output=True,
-        )
-        if result.returncode != 0:
-            # print(f"Running `{' '.join(cmds)}` error:\n {result.stderr}")
-            print(f"\"{header}\": not a C source file")
-            continue
-        valid_headers.append(header)
-    
-    if len(valid_headers) == 0:
-        print(f"\"{pkg}\": not a C library")
-        return None
-    
-    info = PackageInfo()
-    info.name = name
-    info.flags = flags
-    info.libs = libs
-    info.headers = valid_headers
-    return info
-
-
-def main():
-    parser = argparse.ArgumentParser(description='Collect information of interfaces of the libraries.')
-    parser.add_argument('packages_file', type=str, help='File contains list of packages.')
-    parser.add_argument('output_file', type=str, help='File of the result.')
-    args = parser.parse_args()
-
-    # Required tools
-    # llvm-18
-    # apt
-    # apt-file
-    # dpkg
-    # pkg-config
-
-    # Args
-    packages_file: str = args.packages_file
-    output_file: str = args.output_file
-    
-    # Load names
-    packages_set = read_list_file_as_set(packages_file)
-
-    i = 0
-    doc = []
-    for pkg in packages_set:
-        i += 1
-        print(f"[{i}/{len(packages_set)}] {pkg}")
-        info = process_package(pkg)
-        if info is None:
-            continue
-        obj = {
-            'name': info.name,
-            'flags': info.flags,
-            'libs': info.libs,
-            'headers': info.headers
-        }
-        doc.append(obj)
-
-    jsondata = json.dumps(doc)
-    with open(output_file, 'w') as file:
-        file.write(jsondata)
-
-
-if __name__ == '__main__':
+from __future__ import annotations
+
+import sys
+import os
+import re
+import io
+import argparse
+import shutil
+import json
+import subprocess
+import shlex
+import pathlib
+import asyncio
+
+from typing import Any, Optional
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import python.clang as cl
+from python.text import *
+from python.dpkg import Dpkg
+from python.pkgconfig import PkgConfig, PkgConfigError
+
+class PackageInfo:
+    def __init__(self):
+        self.name: str = ''
+        self.flags: list[str] = []
+        self.libs: list[str] = []
+        self.headers: list[str] = []
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'flags': self.flags,
+            'libs': self.libs,
+            'headers': self.headers
+        }
+
+    @staticmethod
+    def from_dict(obj: dict[str, Any]) -> PackageInfo:
+        info = PackageInfo()
+        info.name = obj['name']
+        info.flags = obj['flags']
+        info.libs = obj['libs']
+        info.headers = obj['headers']
+        return info
+
+
+"""
+Persistent results of the previous runs, an entry stays valid as long as the installed version of the package,
+the modification time of its headers and of the `.pc` files read to evaluate its flags, and the options that
+change the result are unchanged.
+"""
+class PackageCache:
+    format_version = 2
+
+    def __init__(self, path: str, options: dict[str, Any]):
+        self.path = path
+        self.options = options
+        self.entries: dict[str, Any] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    doc = json.load(file)
+                if doc.get('version') == PackageCache.format_version:
+                    self.entries = doc['packages']
+            except (OSError, ValueError, KeyError):
+                self.entries = {}
+
+    """
+    Returns whether the package is cached, and the cached result.
+    """
+    def lookup(self, pkg: str, version: Optional[str]) -> tuple[bool, Optional[PackageInfo]]:
+        entry = self.entries.get(pkg)
+        if version is None or entry is None or entry['version'] != version or entry['options'] != self.options:
+            return False, None
+        for file, mtime in entry['inputs'].items():
+            try:
+                if os.stat(file).st_mtime_ns != mtime:
+                    return False, None
+            except OSError:
+                return False, None
+        return True, PackageInfo.from_dict(entry['info']) if entry['info'] else None
+
+    def store(self, pkg: str, version: Optional[str], inputs: list[str], info: Optional[PackageInfo]):
+        if version is None:
+            return
+        try:
+            input_mtimes = { file: os.stat(file).st_mtime_ns for file in inputs }
+        except OSError:
+            return
+        self.entries[pkg] = {
+            'version': version,
+            'options': self.options,
+            'inputs': input_mtimes,
+            'info': info.to_dict() if info else None
+        }
+
+    def save(self):
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({ 'version': PackageCache.format_version, 'packages': self.entries }, file)
+        os.replace(temp_path, self.path)
+
+
+async def run_command(cmds: list[str], semaphore: asyncio.Semaphore) -> tuple[int, str, str]:
+    async with semaphore:
+        process = await asyncio.create_subprocess_exec(
+            *cmds,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+    return process.returncode, stdout.decode(errors='replace'), stderr.decode(errors='replace')
+
+
+"""
+Parses the diagnostics of compiling many headers in one `gcc` invocation, returns the index of the headers that
+errors are blamed on. An error is blamed on the outermost file of its include chain, or on the file itself if it's
+one of the headers. The blame is only a hint, it may be wrong or missing.
+"""
+def parse_diagnostics(stderr: str, headers: list[str]) -> set[int]:
+    culprits: set[int] = set()
+    header_indexes: dict[str, int] = { headers[i]: i for i in range(0, len(headers)) }
+    chain_top: Optional[str] = None     # outermost file of the include chain printed before the next diagnostic
+    last_top: Optional[str] = None      # file the last error was blamed on
+    for line in stderr.splitlines():
+        match = re.match(r'^(?:In file included|\s+) from (.+):(\d+)[:,]$', line)
+        if match:
+            chain_top = match.group(1)
+            continue
+        match = re.match(r'^(.+?):(\d+):(?:\d+:)? (?:fatal )?error:', line)
+        if not match:
+            continue
+        if chain_top is not None:
+            top = chain_top
+        elif match.group(1) in header_indexes:
+            top = match.group(1)
+        else:
+            # Errors in the same included file are printed without the include chain again
+            top = last_top
+        chain_top = None
+        last_top = top
+        if top in header_indexes:
+            culprits.add(header_indexes[top])
+    return culprits
+
+
+"""
+Compiles the headers in one `gcc` invocation, each header is a translation unit of its own. Returns the exit code
+and the index of the headers that errors are blamed on.
+"""
+async def compile_headers(headers: list[str], flags: list[str], semaphore: asyncio.Semaphore) -> tuple[int, set[int]]:
+    returncode, _, stderr = await run_command([ "gcc", '-x', 'c', '-fsyntax-only' ] + headers + flags, semaphore)
+    if returncode == 0:
+        return returncode, set()
+    return returncode, set([0]) if len(headers) == 1 else parse_diagnostics(stderr, headers)
+
+
+"""
+Checks whether each header compiles on its own with as few compiler runs as possible, returns the set of
+valid headers.
+
+The headers are compiled by one `gcc` invocation, which compiles each input as a separate translation unit, so a
+passing batch proves every header valid exactly as the per-header check does. A header is only rejected after it
+fails alone. When a batch fails, the blamed headers are checked alone and the others are compiled again as a batch;
+if nothing can be blamed, the batch is bisected.
+"""
+async def validate_headers(headers: list[str], flags: list[str], semaphore: asyncio.Semaphore) -> set[str]:
+    if len(headers) == 0:
+        return set()
+
+    returncode, culprits = await compile_headers(headers, flags, semaphore)
+    if returncode == 0:
+        return set(headers)
+    if len(headers) == 1:
+        return set()
+
+    batches: list[list[str]]
+    if 0 < len(culprits) < len(headers):
+        batches = [ [ headers[i] ] for i in sorted(culprits) ] + \
+                  [ [ headers[i] for i in range(0, len(headers)) if not i in culprits ] ]
+    else:
+        mid = len(headers) // 2
+        batches = [ headers[:mid], headers[mid:] ]
+    results = await asyncio.gather(*[validate_headers(batch, flags, semaphore) for batch in batches])
+    return set().union(*results)
+
+
+async def process_package(pkg: str, dpkg: Dpkg, pkg_config: PkgConfig, semaphore: asyncio.Semaphore, batch_headers: bool,
+                          inputs: list[str], log: list[str]) -> Optional[PackageInfo]:
+    # Get name
+    idx = pkg.find('-dev')
+    if idx < 0:
+        return None
+    name = pkg[0:idx]
+
+    flags: list[str] = []
+    libs: list[str] = []
+    headers: list[str] = []
+    pc_files: list[str] = []
+
+    # 1. Read the file list of the package to search headers
+    files = dpkg.files(pkg)
+    if files is None:
+        log.append(f"Package `{pkg}` is not installed")
+        return None
+    for file in files:
+        if len(file) == 0:
+            continue
+        file = os.path.realpath(dpkg.rooted(file))
+        if not os.path.exists(file):
+            continue
+
+        ext = (''.join(pathlib.Path(file).suffixes)).lower()
+        log.append(f'OK: {file}, {ext}')
+        if ext == '.pc':
+            try:
+                flags += pkg_config.cflags(file, pc_files)
+            except PkgConfigError as e:
+                log.append(f"Evaluating `{file}` error:\n {e}")
+        elif ext == '.h':
+            if file in headers:
+                continue
+            headers.append(file)
+        elif '.so' in ext:
+            if file in libs:
+                continue
+            log.append(file)
+            libs.append(file)
+
+    # The `.pc` files include the modules required by the package
+    inputs += pc_files + headers
+
+    # Check headers
+    valid_header_set: set[str]
+    if batch_headers:
+        # Batches of a bounded size, so that the headers of a large package are still compiled in parallel
+        batches = [ headers[i:i + 32] for i in range(0, len(headers), 32) ]
+        results = await asyncio.gather(*[validate_headers(batch, flags, semaphore) for batch in batches])
+        valid_header_set = set().union(*results)
+    else:
+        results = await asyncio.gather(*[compile_headers([ header ], flags, semaphore) for header in headers])
+        valid_header_set = set([ headers[i] for i in range(0, len(headers)) if results[i][0] == 0 ])
+    valid_headers: list[str] = []
+    for header in headers:
+        if not header in valid_header_set:
+            log.append(f"\"{header}\": not a C source file")
+            continue
+        valid_headers.append(header)
+
+    if len(valid_headers) == 0:
+        log.append(f"\"{pkg}\": not a C library")
+        return None
+
+    info = PackageInfo()
+    info.name = name
+    info.flags = flags
+    info.libs = libs
+    info.headers = valid_headers
+    return info
+
+
+"""
+Processes all packages with at most `jobs` packages in flight and `jobs` running subprocesses,
+returns the results in the same order as `packages`. Packages found in `cache` are not processed again.
+"""
+async def collect_packages(packages: list[str], dpkg: Dpkg, pkg_config: PkgConfig, jobs: int, batch_headers: bool,
+                           cache: Optional[PackageCache]) -> list[Optional[PackageInfo]]:
+    package_semaphore = asyncio.Semaphore(jobs)
+    process_semaphore = asyncio.Semaphore(jobs)
+    versions = dpkg.versions()
+    finished = 0
+
+    async def collect(pkg: str) -> Optional[PackageInfo]:
+        nonlocal finished
+        version = versions.get(pkg)
+        log: list[str] = []
+        cached = False
+        if cache:
+            cached, info = cache.lookup(pkg, version)
+        if cached:
+            log.append('Cached')
+        else:
+            async with package_semaphore:
+                inputs: list[str] = []
+                info = await process_package(pkg, dpkg, pkg_config, process_semaphore, batch_headers, inputs, log)
+            if cache:
+                cache.store(pkg, version, inputs, info)
+        finished += 1
+        print(f"[{finished}/{len(packages)}] {pkg}")
+        for line in log:
+            print(line)
+        return info
+
+    return await asyncio.gather(*[collect(pkg) for pkg in packages])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Collect information of interfaces of the libraries.')
+    parser.add_argument('packages_file', type=str, help='File contains list of packages.')
+    parser.add_argument('output_file', type=str, help='File of the result.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of concurrent subprocesses.')
+    parser.add_argument('--batch-headers', action='store_true', help='Check the headers of a package in batches, each batch is compiled by one gcc invocation.')
+    parser.add_argument('--cache', type=str, metavar='<file>', help='Result cache file, defaults to `<output_file>.cache`.')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the result cache.')
+    parser.add_argument('--root', type=str, metavar='<dir>', default='/', help='Root directory of the dpkg database and `.pc` files.')
+    parser.add_argument('--refresh', action='store_true', help='Recompute all packages and rewrite their cache entries.')
+    args = parser.parse_args()
+
+    # Required tools
+    # llvm-18
+    # apt
+    # apt-file
+
+    # Args
+    packages_file: str = args.packages_file
+    output_file: str = args.output_file
+    jobs: int = max(1, args.jobs)
+    batch_headers: bool = args.batch_headers
+    cache_file: str = args.cache if args.cache else f'{output_file}.cache'
+    
+    # Load names
+    packages = sorted(read_list_file_as_set(packages_file))
+
+    dpkg = Dpkg(args.root)
+    pkg_config = PkgConfig(args.root)
+
+    # Load cache
+    cache: Optional[PackageCache] = None
+    if not args.no_cache:
+        cache = PackageCache(cache_file, { 'root': os.path.abspath(args.root), 'batch_headers': batch_headers })
+        if args.refresh:
+            for pkg in packages:
+                cache.entries.pop(pkg, None)
+
+    doc = []
+    for info in asyncio.run(collect_packages(packages, dpkg, pkg_config, jobs, batch_headers, cache)):
+        if info is None:
+            continue
+        doc.append(info.to_dict())
+
+    if cache:
+        cache.save()
+
+    jsondata = json.dumps(doc)
+    with open(output_file, 'w') as file:
+        file.write(jsondata)
+
+
+if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 import sys
 import os
 import re
@@ -8,6 +10,8 @@ import json
 import subprocess
 import shlex
 import pathlib
+import tempfile
+import multiprocessing
 from tqdm import tqdm
 
 from clang.cindex import Config
@@ -20,6 +24,7 @@ from clang.cindex import Type
 from clang.cindex import TypeKind
 from clang.cindex import SourceRange
 from clang.cindex import SourceLocation
+from clang.cindex import TranslationUnit
 
 from typing import Any, Optional
 
@@ -27,11 +32,17 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 import python.clang as cl
 from python.text import *
+from python.astcache import AstCache, FileHashes, parse_translation_unit
+from python.quickscan import QuickScanner
 
 class Global:
     script_dir = os.path.dirname(os.path.abspath(__file__))
     config_path = os.path.join(script_dir, 'ncconfig.json')
 
+    ast_cache: Optional[AstCache] = None
+    record_cache: Optional[RecordCache] = None
+    include_graph: Optional[IncludeGraph] = None
+
 
 class FileStat:
     def __init__(self):
@@ -41,6 +52,8 @@ class FileStat:
         self.complex_va_functions: list[str] = []
         self.simple_fp_functions: list[str] = []
         self.complex_fp_functions: list[str] = []
+        self.functions: list[str] = []      # counted functions, used to journal the header
+        self.includes: list[str] = []       # files seen by the header, used to journal the header
     
     def to_dict(self):
         return {
@@ -52,6 +65,18 @@ class FileStat:
             'complex_fp_functions': self.complex_fp_functions
         }
 
+    @staticmethod
+    def from_dict(doc: dict[str, Any]) -> FileStat:
+        file_stat = FileStat()
+        file_stat.file = doc['file']
+        file_stat.function_cnt = doc['function_cnt']
+        file_stat.simple_va_functions = doc['simple_va_functions']
+        file_stat.complex_va_functions = doc['complex_va_functions']
+        file_stat.simple_fp_functions = doc['simple_fp_functions']
+        file_stat.complex_fp_functions = doc['complex_fp_functions']
+        file_stat.functions = doc['functions']
+        return file_stat
+
 
 class LibStat:
     def __init__(self):
@@ -59,25 +84,168 @@ class LibStat:
         self.files: list[FileStat] = []
         self.simple_fp_records: list[str] = []
         self.complex_fp_records: list[str] = []
+        self.approximate: bool = False      # collected by `--quick`
     
     def to_dict(self):
-        return {
+        res = {
             'name': self.name,
             'files': [item.to_dict() for item in self.files],
             'simple_fp_records': self.simple_fp_records,
             'complex_fp_records': self.complex_fp_records,
         }
+        if self.approximate:
+            res['approximate'] = True
+        return res
+
+"""
+Persistent classification of records, shared across libraries and runs.
+
+An entry is the result of classifying a record from the top of a walk, keyed by the USR of the record. It holds
+the content hashes of the headers defining the records walked through, the records classified by the walk and
+the classifications it has taken from `records_map`. An entry is only reused if all of them still hold, so that
+the walk would have the same result. Records left incomplete by the headers are assumed to stay incomplete.
+"""
+class RecordCache:
+    format_version = 1
+
+    default_path = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'qemu-nc', 'records.json')
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: dict[str, Any] = {}
+        self.new_entries: dict[str, Any] = {}
+        self.file_hashes = FileHashes()
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    doc = json.load(file)
+                if doc.get('version') == RecordCache.format_version:
+                    self.entries = doc['records']
+            except (OSError, ValueError, KeyError):
+                self.entries = {}
+
+        # State of the current walk
+        self.walking = False
+        self.clean = True
+        self.deps: set[str] = set()
+        self.assumed: dict[str, tuple[bool, bool]] = {}
+
+    """
+    Returns the classification of a record if the entry is still valid, the records classified by the walk are
+    added to `records_map`.
+    """
+    def lookup(self, usr: str, records_map: dict[str, tuple[bool, bool]],
+               visible_files: Optional[set[str]]) -> Optional[tuple[bool, bool]]:
+        entry = self.entries.get(usr)
+        if entry is None:
+            return None
+        for spelling, is_fp, is_complex in entry['records']:
+            if spelling in records_map:
+                return None
+        for spelling, is_fp, is_complex in entry['assumed']:
+            if records_map.get(spelling) != (is_fp, is_complex):
+                return None
+        for file, content_hash in entry['deps'].items():
+            if visible_files is not None and not file in visible_files:
+                return None
+            if self.file_hashes.get(file) != content_hash:
+                return None
+
+        for spelling, is_fp, is_complex in entry['records']:
+            records_map[spelling] = is_fp, is_complex
+        return entry['verdict'][0], entry['verdict'][1]
 
-def is_fp_record(type: Type, visited_spellings: set[str], records_map: dict[str, tuple[bool, bool]]) -> tuple[bool, bool]:
+    def begin(self):
+        self.walking = True
+        self.clean = True
+        self.deps = set()
+        self.assumed = {}
+
+    def end(self, usr: str, records: list[tuple[str, tuple[bool, bool]]], verdict: tuple[bool, bool]):
+        self.walking = False
+        if not self.clean:
+            return
+        deps: dict[str, str] = {}
+        for file in self.deps:
+            content_hash = self.file_hashes.get(file)
+            if content_hash is None:
+                return
+            deps[file] = content_hash
+        entry = {
+            'deps': deps,
+            'verdict': [verdict[0], verdict[1]],
+            'records': [[spelling, v[0], v[1]] for spelling, v in records],
+            'assumed': [[spelling, v[0], v[1]] for spelling, v in self.assumed.items()],
+        }
+        self.entries[usr] = entry
+        self.new_entries[usr] = entry
+
+    """
+    Records that the walk has taken a classification from `records_map`.
+    """
+    def assume(self, spelling: str, verdict: tuple[bool, bool]):
+        if self.walking:
+            self.assumed[spelling] = verdict
+
+    """
+    Records that the walk depends on the file defining the declaration.
+    """
+    def depend(self, declaration: Cursor):
+        if not self.walking:
+            return
+        definition = declaration.get_definition()
+        if definition is not None and definition.location.file:
+            self.deps.add(str(definition.location.file))
+
+    """
+    Marks the walk as depending on the context, it will not be stored.
+    """
+    def taint(self):
+        self.clean = False
+
+    def take_new_entries(self) -> dict[str, Any]:
+        entries = self.new_entries
+        self.new_entries = {}
+        return entries
+
+    def merge(self, entries: dict[str, Any]):
+        self.entries.update(entries)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({ 'version': RecordCache.format_version, 'records': self.entries }, file)
+        os.replace(temp_path, self.path)
+
+
+"""
+If `visible_files` is given, records defined outside these files are treated as incomplete, as if the header
+was parsed alone.
+"""
+def is_fp_record(type: Type, visited_spellings: set[str], records_map: dict[str, tuple[bool, bool]],
+                 visible_files: Optional[set[str]] = None) -> tuple[bool, bool]:
     spelling = cl.TypeSpelling.remove_cv(type.get_canonical().spelling)
     if spelling in visited_spellings:
         return False, False
     visited_spellings.add(spelling)
     
     if spelling in records_map:
+        if Global.record_cache:
+            Global.record_cache.assume(spelling, records_map[spelling])
         return records_map[spelling]
     
     declaration = type.get_declaration()
+    if visible_files is not None and declaration.kind in [CursorKind.UNION_DECL, CursorKind.STRUCT_DECL]:
+        definition = declaration.get_definition()
+        if definition is None or (definition.location.file and not str(definition.location.file) in visible_files):
+            if Global.record_cache:
+                Global.record_cache.taint()
+            records_map[spelling] = False, False
+            return False, False
+    if Global.record_cache:
+        Global.record_cache.depend(declaration)
+
     type = type.get_canonical()
     if declaration.kind == CursorKind.UNION_DECL:
         for field in type.get_fields():
@@ -86,7 +254,7 @@ def is_fp_record(type: Type, visited_spellings: set[str], records_map: dict[str,
                 records_map[spelling] = True, True
                 return True, True
             if sub_type.kind == TypeKind.RECORD:
-                is_fp1, _ = is_fp_record(sub_type, visited_spellings, records_map)
+                is_fp1, _ = is_fp_record(sub_type, visited_spellings, records_map, visible_files)
                 if is_fp1:
                     records_map[spelling] = True, True
                     return True, True
@@ -102,7 +270,7 @@ def is_fp_record(type: Type, visited_spellings: set[str], records_map: dict[str,
                     is_fp = True
                     continue
             elif field_type.kind == TypeKind.RECORD:
-                is_fp1, is_complex1 = is_fp_record(field_type, visited_spellings, records_map)
+                is_fp1, is_complex1 = is_fp_record(field_type, visited_spellings, records_map, visible_files)
                 if is_fp1:
                     is_fp = True
                     if is_complex1:
@@ -111,7 +279,7 @@ def is_fp_record(type: Type, visited_spellings: set[str], records_map: dict[str,
                 continue
             sub_type = cl.Typing.primitive(field_type)
             if sub_type.kind == TypeKind.RECORD:
-                is_fp1, _ = is_fp_record(sub_type, visited_spellings, records_map)
+                is_fp1, _ = is_fp_record(sub_type, visited_spellings, records_map, visible_files)
                 if is_fp1:
                     records_map[spelling] = True, True
                     return True, True
@@ -122,7 +290,36 @@ def is_fp_record(type: Type, visited_spellings: set[str], records_map: dict[str,
         return is_fp, False
 
 
-def is_fp_function(c: Cursor, records_map: dict[str, tuple[bool, bool]]) -> tuple[bool, bool]:
+"""
+Classifies a record at the top of a walk, through the record cache if it's enabled.
+"""
+def classify_record(type: Type, records_map: dict[str, tuple[bool, bool]],
+                    visible_files: Optional[set[str]] = None) -> tuple[bool, bool]:
+    record_cache = Global.record_cache
+    if record_cache is None:
+        return is_fp_record(type, set(), records_map, visible_files)
+
+    spelling = cl.TypeSpelling.remove_cv(type.get_canonical().spelling)
+    if spelling in records_map:
+        return is_fp_record(type, set(), records_map, visible_files)
+    definition = type.get_declaration().get_definition()
+    usr = definition.get_usr() if definition is not None else ''
+    if len(usr) == 0:
+        return is_fp_record(type, set(), records_map, visible_files)
+
+    verdict = record_cache.lookup(usr, records_map, visible_files)
+    if verdict is not None:
+        return verdict
+
+    records_cnt = len(records_map)
+    record_cache.begin()
+    verdict = is_fp_record(type, set(), records_map, visible_files)
+    record_cache.end(usr, [(k, records_map[k]) for k in list(records_map)[records_cnt:]], verdict)
+    return verdict
+
+
+def is_fp_function(c: Cursor, records_map: dict[str, tuple[bool, bool]],
+                   visible_files: Optional[set[str]] = None) -> tuple[bool, bool]:
     all_types: list[Type] = []
     all_types.append(c.result_type)
     for arg in c.get_arguments():
@@ -138,8 +335,7 @@ def is_fp_function(c: Cursor, records_map: dict[str, tuple[bool, bool]]) -> tupl
                 exists = True
                 continue
             elif pointee_type.kind == TypeKind.RECORD:
-                visited_spellings = set()
-                exists1, complex = is_fp_record(pointee_type, visited_spellings, records_map)
+                exists1, complex = classify_record(pointee_type, records_map, visible_files)
                 if not exists1:
                     continue
                 exists = True
@@ -147,8 +343,7 @@ def is_fp_function(c: Cursor, records_map: dict[str, tuple[bool, bool]]) -> tupl
                     continue
                 return True, True
         elif type.kind == TypeKind.RECORD:
-            visited_spellings = set()
-            exists1, complex = is_fp_record(type, visited_spellings, records_map)
+            exists1, complex = classify_record(type, records_map, visible_files)
             if not exists1:
                 continue
             exists = True
@@ -157,8 +352,7 @@ def is_fp_function(c: Cursor, records_map: dict[str, tuple[bool, bool]]) -> tupl
             return True, True
         sub_type = cl.Typing.primitive(type)
         if sub_type.kind == TypeKind.RECORD:
-            visited_spellings = set()
-            is_fp1, _ = is_fp_record(sub_type, visited_spellings, records_map)
+            is_fp1, _ = classify_record(sub_type, records_map, visible_files)
             if is_fp1:
                 return True, True
         elif cl.Typing.is_func_ptr(sub_type):
@@ -192,10 +386,724 @@ def is_va_function(c: Cursor) -> tuple[bool, bool]:
         return False, False
 
 
+def stat_function(c: Cursor, file_stat: FileStat, records_map: dict[str, tuple[bool, bool]],
+                  visible_files: Optional[set[str]] = None):
+    spelling: str = c.spelling
+    is_fp, is_fp_complex = is_fp_function(c, records_map, visible_files)
+    if is_fp:
+        if is_fp_complex:
+            file_stat.complex_fp_functions.append(spelling)
+        else:
+            file_stat.simple_fp_functions.append(spelling)
+
+    is_va, is_va_complex = is_va_function(c)
+    if is_va:
+        if is_va_complex:
+            file_stat.complex_va_functions.append(spelling)
+        else:
+            file_stat.simple_va_functions.append(spelling)
+
+    file_stat.functions.append(spelling)
+    file_stat.function_cnt += 1
+
+
+"""
+Append-only journal of the headers of a library collected so far, one JSON object per line after a line of
+the options. Each header is recorded with its statistics, the records it has classified and the content hashes
+of the files it includes, a run resumes after the last header whose include closure is unchanged.
+"""
+class HeaderJournal:
+    format_version = 1
+
+    def __init__(self, path: str, flags: list[str], mode: str):
+        self.path = path
+        self.options = { 'version': HeaderJournal.format_version, 'flags': flags, 'mode': mode }
+        self.entries: list[dict[str, Any]] = []
+        self.file_hashes = FileHashes()
+        self.file: Optional[io.TextIOWrapper] = None
+
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    lines = file.read().split('\n')
+                if json.loads(lines[0]) == self.options:
+                    for line in lines[1:]:
+                        # The last line may be incomplete
+                        try:
+                            self.entries.append(json.loads(line))
+                        except ValueError:
+                            break
+            except (OSError, ValueError):
+                self.entries = []
+
+    """
+    Restores the state of the headers recorded in the journal, returns the number of headers restored and
+    their statistics.
+    """
+    def replay(self, headers: list[str], function_names: set[str],
+               records_map: dict[str, tuple[bool, bool]]) -> tuple[int, list[FileStat]]:
+        file_stats: list[FileStat] = []
+        count = 0
+        for entry in self.entries:
+            if count >= len(headers) or entry['header'] != headers[count]:
+                break
+            if any(self.file_hashes.get(file) != content_hash for file, content_hash in entry['closure'].items()):
+                break
+            if entry['stat'] is not None:
+                file_stat = FileStat.from_dict(entry['stat'])
+                function_names.update(file_stat.functions)
+                file_stats.append(file_stat)
+            for spelling, is_fp, is_complex in entry['records']:
+                records_map[spelling] = is_fp, is_complex
+            count += 1
+        self.entries = self.entries[:count]
+        return count, file_stats
+
+    """
+    Rewrites the journal with the entries restored, and opens it for appending.
+    """
+    def open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as file:
+            for doc in [self.options] + self.entries:
+                file.write(json.dumps(doc) + '\n')
+        os.replace(temp_path, self.path)
+        self.file = open(self.path, 'a')
+
+    def append(self, header_file: str, file_stat: Optional[FileStat],
+               records_map: dict[str, tuple[bool, bool]], records_cnt: int):
+        closure: dict[str, Optional[str]] = {}
+        for file in (file_stat.includes if file_stat else [header_file]):
+            closure[file] = self.file_hashes.get(file)
+        stat: Optional[dict[str, Any]] = None
+        if file_stat:
+            stat = file_stat.to_dict()
+            stat['functions'] = file_stat.functions
+        entry = {
+            'header': header_file,
+            'stat': stat,
+            'records': [[k, records_map[k][0], records_map[k][1]] for k in list(records_map)[records_cnt:]],
+            'closure': closure,
+        }
+        self.entries.append(entry)
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+"""
+Parses a header as a translation unit, counts the functions declared by the header itself.
+"""
+def stat_header(index: Index, header_file: str, flags: list[str],
+                function_names: set[str], records_map: dict[str, tuple[bool, bool]]) -> Optional[FileStat]:
+    file_stat = FileStat()
+    file_stat.file = header_file
+
+    try:
+        translation_unit = parse_translation_unit(index, Global.ast_cache, header_file, ['-x', 'c'] + flags)
+    except Exception as e:
+        print('Exception:', e)
+        return None
+    file_stat.includes = [header_file] + [str(inclusion.include) for inclusion in translation_unit.get_includes()]
+
+    # Scan
+    c: Cursor
+    for c, _ in cl.walk_cursors(translation_unit.cursor, cl.FileFilter(header_file), lambda c: True):
+        spelling: str = c.spelling
+        if c.kind == CursorKind.FUNCTION_DECL:
+            if not spelling in function_names:
+                function_names.add(spelling)
+                stat_function(c, file_stat, records_map)
+
+    return file_stat
+
+
+def stat_headers(index: Index, headers: list[str], flags: list[str],
+                 function_names: set[str], records_map: dict[str, tuple[bool, bool]],
+                 progress: bool = True, journal: Optional[HeaderJournal] = None, start: int = 0) -> list[FileStat]:
+    file_stats: list[FileStat] = []
+    for header_file in tqdm(headers[start:], disable=not progress):
+        records_cnt = len(records_map)
+        file_stat = stat_header(index, header_file, flags, function_names, records_map)
+        if file_stat is not None:
+            file_stats.append(file_stat)
+        if journal:
+            journal.append(header_file, file_stat, records_map, records_cnt)
+    return file_stats
+
+
+"""
+Returns the macro of the include guard of a header, or None if it has no include guard.
+"""
+def include_guard(header_file: str) -> Optional[str]:
+    try:
+        with open(header_file, 'r', errors='replace') as file:
+            content = file.read()
+    except OSError:
+        return None
+    content = re.sub(r'/\*.*?\*/|//[^\n]*', '', content, flags=re.S)
+    match = re.match(r'\s*#\s*(?:ifndef\s+(\w+)|if\s+!\s*defined\s*\(?\s*(\w+)\s*\)?)\s*#\s*define\s+(\w+)', content)
+    if not match:
+        return None
+    macro = match.group(1) or match.group(2)
+    return macro if macro == match.group(3) else None
+
+
+"""
+Maps files to the index of the header in a list, files are identified by device and inode the same as
+`os.path.samefile`.
+"""
+class HeaderIndexes:
+    def __init__(self, headers: list[str]):
+        self.indexes: dict[tuple[int, int], int] = {}
+        for i in range(0, len(headers)):
+            try:
+                st = os.stat(headers[i])
+            except OSError:
+                continue
+            self.indexes.setdefault((st.st_dev, st.st_ino), i)
+        self.file_indexes: dict[str, int] = {}
+
+    def get(self, file: str) -> int:
+        if not file in self.file_indexes:
+            try:
+                st = os.stat(file)
+                self.file_indexes[file] = self.indexes.get((st.st_dev, st.st_ino), -1)
+            except OSError:
+                self.file_indexes[file] = -1
+        return self.file_indexes[file]
+
+
+"""
+Function declarations, include directives and macro definitions of a translation unit covering some of the
+headers. The translation unit must be parsed with `PARSE_DETAILED_PROCESSING_RECORD`, functions without a
+location are attributed to the header at `default_index`.
+"""
+class HeaderScan:
+    def __init__(self, translation_unit: TranslationUnit, main_file: str, headers: list[str],
+                 header_indexes: HeaderIndexes, default_index: int):
+        self.headers = headers
+        self.header_indexes = header_indexes
+        self.header_cursors: list[list[Cursor]] = [[] for _ in headers]
+        self.header_files: list[Optional[str]] = [None for _ in headers]    # names in the translation unit
+        self.includes: dict[str, set[str]] = {}
+        self.macro_files: dict[str, str] = {}
+
+        idx = header_indexes.get(main_file)
+        if idx >= 0:
+            self.header_files[idx] = main_file
+
+        c: Cursor
+        for c in translation_unit.cursor.get_children():
+            if c.kind == CursorKind.MACRO_DEFINITION:
+                if c.location.file and not c.spelling in self.macro_files:
+                    self.macro_files[c.spelling] = str(c.location.file)
+                continue
+            if c.kind == CursorKind.INCLUSION_DIRECTIVE:
+                # An include that cannot be resolved leaves no edge
+                included_file = cl.included_file(c)
+                if c.location.file and included_file:
+                    self.includes.setdefault(str(c.location.file), set()).add(included_file)
+                    idx = header_indexes.get(included_file)
+                    if idx >= 0 and self.header_files[idx] is None:
+                        self.header_files[idx] = included_file
+                continue
+            if c.kind != CursorKind.FUNCTION_DECL:
+                continue
+            file = c.extent.start.file
+            idx = header_indexes.get(str(file)) if file else default_index
+            if idx >= 0:
+                self.header_cursors[idx].append(c)
+
+    def covers(self, i: int) -> bool:
+        return self.header_files[i] is not None
+
+    """
+    Returns the files a header would see if it was parsed alone.
+    """
+    def visible_files(self, i: int) -> set[str]:
+        files: set[str] = set()
+        stack = [self.header_files[i]] if self.header_files[i] else []
+        while len(stack) > 0:
+            file = stack.pop()
+            if file in files:
+                continue
+            files.add(file)
+            stack.extend(self.includes.get(file, []))
+        return files
+
+    """
+    Returns if the include guard of a header is defined by another file, the header is skipped in the
+    translation unit.
+    """
+    def is_shadowed(self, i: int) -> bool:
+        guard = include_guard(self.headers[i])
+        return guard is not None and guard in self.macro_files and \
+            self.header_indexes.get(self.macro_files[guard]) != i
+
+
+"""
+Collects the headers from the translation units covering them, in the same order as parsing each header alone.
+Records are only considered complete if they are defined in the files a header includes, headers not covered or
+skipped in their translation unit are parsed alone.
+"""
+def stat_scanned_headers(index: Index, headers: list[str], flags: list[str], scans: list[Optional[HeaderScan]],
+                         function_names: set[str], records_map: dict[str, tuple[bool, bool]],
+                         journal: Optional[HeaderJournal], start: int) -> list[FileStat]:
+    file_stats: list[FileStat] = []
+    for i in range(start, len(headers)):
+        records_cnt = len(records_map)
+
+        scan = scans[i]
+        if scan is None or scan.is_shadowed(i):
+            file_stat = stat_header(index, headers[i], flags, function_names, records_map)
+            if file_stat is not None:
+                file_stats.append(file_stat)
+            if journal:
+                journal.append(headers[i], file_stat, records_map, records_cnt)
+            continue
+
+        file_stat = FileStat()
+        file_stat.file = headers[i]
+        files = scan.visible_files(i)
+        file_stat.includes = [headers[i]] + sorted(files)
+        for c in scan.header_cursors[i]:
+            if not c.spelling in function_names:
+                function_names.add(c.spelling)
+                stat_function(c, file_stat, records_map, files)
+        file_stats.append(file_stat)
+        if journal:
+            journal.append(headers[i], file_stat, records_map, records_cnt)
+    return file_stats
+
+
+"""
+Parses one umbrella translation unit including all headers, functions are attributed to the header declaring
+them by their location.
+"""
+def stat_headers_umbrella(index: Index, name: str, headers: list[str], flags: list[str],
+                          function_names: set[str], records_map: dict[str, tuple[bool, bool]],
+                          journal: Optional[HeaderJournal] = None, start: int = 0) -> Optional[list[FileStat]]:
+    umbrella_file = os.path.join(tempfile.gettempdir(), f'__ncistat_umbrella_{name}.c')
+    umbrella_content = ''.join([f'#include "{header}"\n' for header in headers])
+    try:
+        translation_unit = parse_translation_unit(index, Global.ast_cache, umbrella_file, ['-x', 'c'] + flags,
+                                                  unsaved_files=[(umbrella_file, umbrella_content)],
+                                                  options=TranslationUnit.PARSE_SKIP_FUNCTION_BODIES |
+                                                          TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD)
+    except Exception as e:
+        print('Exception:', e)
+        return None
+
+    scan = HeaderScan(translation_unit, umbrella_file, headers, HeaderIndexes(headers), 0)
+    scans = [scan if scan.covers(i) else None for i in range(0, len(headers))]
+    return stat_scanned_headers(index, headers, flags, scans, function_names, records_map, journal, start)
+
+
+"""
+Files included by the headers, kept between runs to choose the headers to parse. An outdated graph only makes
+the choice less efficient, since headers not covered by the translation units parsed are parsed anyway.
+"""
+class IncludeGraph:
+    format_version = 1
+
+    default_path = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'qemu-nc', 'include_graph.json')
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: dict[str, list[str]] = {}
+        self.new_entries: dict[str, list[str]] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    doc = json.load(file)
+                if doc.get('version') == IncludeGraph.format_version:
+                    self.entries = doc['headers']
+            except (OSError, ValueError, KeyError):
+                self.entries = {}
+
+    @staticmethod
+    def key(header_file: str, flags: list[str]) -> str:
+        return json.dumps([header_file, flags])
+
+    def get(self, header_file: str, flags: list[str]) -> Optional[list[str]]:
+        return self.entries.get(IncludeGraph.key(header_file, flags))
+
+    def store(self, header_file: str, flags: list[str], files: list[str]):
+        key = IncludeGraph.key(header_file, flags)
+        self.entries[key] = files
+        self.new_entries[key] = files
+
+    def take_new_entries(self) -> dict[str, list[str]]:
+        entries = self.new_entries
+        self.new_entries = {}
+        return entries
+
+    def merge(self, entries: dict[str, list[str]]):
+        self.entries.update(entries)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({ 'version': IncludeGraph.format_version, 'headers': self.entries }, file)
+        os.replace(temp_path, self.path)
+
+
+"""
+Parses only the headers not included by other headers, functions of the headers they include are attributed to
+the header declaring them by their location. The roots are taken from the include graph of the previous run,
+then the headers not covered yet are parsed in order.
+"""
+def stat_headers_roots(index: Index, headers: list[str], flags: list[str],
+                       function_names: set[str], records_map: dict[str, tuple[bool, bool]],
+                       journal: Optional[HeaderJournal] = None, start: int = 0) -> list[FileStat]:
+    header_indexes = HeaderIndexes(headers)
+    include_graph = Global.include_graph
+
+    # Headers covered by each header in the previous run
+    covered_by: list[Optional[set[int]]] = [None for _ in headers]
+    if include_graph:
+        for i in range(0, len(headers)):
+            files = include_graph.get(headers[i], flags)
+            if files is not None:
+                covered_by[i] = set([header_indexes.get(file) for file in files]) - set([-1, i])
+    included = set().union(*[covered for covered in covered_by if covered])
+    order = [i for i in range(0, len(headers)) if not i in included] + sorted(included)
+
+    scans: list[Optional[HeaderScan]] = [None for _ in headers]
+    for i in order:
+        if all(scans[j] is not None for j in range(start, len(headers))):
+            break
+        if scans[i] is not None:
+            continue
+        if i < start and not any(scans[j] is None for j in (covered_by[i] or set()) if j >= start):
+            continue
+
+        try:
+            translation_unit = parse_translation_unit(index, Global.ast_cache, headers[i], ['-x', 'c'] + flags,
+                                                      options=TranslationUnit.PARSE_SKIP_FUNCTION_BODIES |
+                                                              TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD)
+        except Exception:
+            # Parsed alone again later
+            continue
+        if include_graph:
+            include_graph.store(headers[i], flags, [str(inclusion.include) for inclusion in translation_unit.get_includes()])
+
+        scan = HeaderScan(translation_unit, headers[i], headers, header_indexes, i)
+        for j in range(0, len(headers)):
+            if scans[j] is None and scan.covers(j):
+                scans[j] = scan
+
+    return stat_scanned_headers(index, headers, flags, scans, function_names, records_map, journal, start)
+
+
+"""
+Collects the headers from their tokens without parsing them, see `python/quickscan.py`. All headers are scanned
+before classifying the functions, so that the types defined by any header of the library are known.
+"""
+def stat_headers_quick(headers: list[str], flags: list[str], function_names: set[str],
+                       records_map: dict[str, tuple[bool, bool]]) -> list[FileStat]:
+    scanner = QuickScanner(headers, flags)
+    for header_file in headers:
+        if not scanner.scan_header(header_file):
+            print('Exception: Cannot read', header_file)
+
+    file_stats: list[FileStat] = []
+    for header_file in headers:
+        if not header_file in scanner.functions:
+            continue
+        functions = scanner.functions[header_file]
+        visible = scanner.visible_headers(header_file)
+        file_stat = FileStat()
+        file_stat.file = header_file
+        file_stat.includes = [header_file]
+        for function in functions:
+            if function.name in function_names:
+                continue
+            function_names.add(function.name)
+
+            is_fp, is_fp_complex = scanner.is_fp_function(function, records_map, visible)
+            if is_fp:
+                if is_fp_complex:
+                    file_stat.complex_fp_functions.append(function.name)
+                else:
+                    file_stat.simple_fp_functions.append(function.name)
+
+            is_va, is_va_complex = scanner.is_va_function(function)
+            if is_va:
+                if is_va_complex:
+                    file_stat.complex_va_functions.append(function.name)
+                else:
+                    file_stat.simple_va_functions.append(function.name)
+
+            file_stat.functions.append(function.name)
+            file_stat.function_cnt += 1
+        file_stats.append(file_stat)
+    return file_stats
+
+
+"""
+Collects the statistics of the headers of a library, returns the file statistics and the records classified. If
+`journal_path` is given, each header is checkpointed in the journal and the headers already recorded are not
+collected again.
+"""
+def stat_library(index: Index, name: str, headers: list[str], flags: list[str], mode: str,
+                 progress: bool = True, journal_path: Optional[str] = None) \
+        -> tuple[list[FileStat], dict[str, tuple[bool, bool]]]:
+    function_names: set[str] = set()
+    records_map: dict[str, tuple[bool, bool]] = {}
+    if mode == 'quick':
+        # Not worth journaling
+        return stat_headers_quick(headers, flags, function_names, records_map), records_map
+
+    journal: Optional[HeaderJournal] = None
+    start = 0
+    file_stats: list[FileStat] = []
+    if journal_path:
+        journal = HeaderJournal(journal_path, flags, mode)
+        start, file_stats = journal.replay(headers, function_names, records_map)
+        journal.open()
+
+    try:
+        if start < len(headers):
+            remaining_stats: Optional[list[FileStat]] = None
+            if mode == 'umbrella':
+                remaining_stats = stat_headers_umbrella(index, name, headers, flags, function_names, records_map,
+                                                        journal, start)
+            elif mode == 'roots':
+                remaining_stats = stat_headers_roots(index, headers, flags, function_names, records_map,
+                                                     journal, start)
+            if remaining_stats is None:
+                remaining_stats = stat_headers(index, headers, flags, function_names, records_map, progress,
+                                               journal, start)
+            file_stats += remaining_stats
+    finally:
+        if journal:
+            journal.close()
+    return file_stats, records_map
+
+
+def make_lib_stat(name: str, file_stats: list[FileStat], records_map: dict[str, tuple[bool, bool]]) -> LibStat:
+    lib_stat = LibStat()
+    lib_stat.name = name
+    lib_stat.files = file_stats
+    for k, v in records_map.items():
+        if v[0]:
+            if v[1]:
+                lib_stat.complex_fp_records.append(k)
+            else:
+                lib_stat.simple_fp_records.append(k)
+    return lib_stat
+
+
+def write_lib_stat(lib_stat: LibStat, output_file: str):
+    jsondata = json.dumps(lib_stat.to_dict())
+    temp_file = f'{output_file}.tmp'
+    with open(temp_file, 'w') as file:
+        file.write(jsondata)
+    os.replace(temp_file, output_file)
+
+
+# Index of a worker process, libclang is loaded once per worker
+worker_index: Optional[Index] = None
+
+
+def init_worker(libclang: str, ast_cache: Optional[AstCache], record_cache_path: Optional[str],
+                include_graph_path: Optional[str]):
+    global worker_index
+    if not Config.loaded:
+        Config.set_library_file(libclang)
+    Global.ast_cache = ast_cache
+    if record_cache_path is None:
+        Global.record_cache = None
+    elif Global.record_cache is None or Global.record_cache.path != record_cache_path:
+        Global.record_cache = RecordCache(record_cache_path)
+    if include_graph_path is None:
+        Global.include_graph = None
+    elif Global.include_graph is None or Global.include_graph.path != include_graph_path:
+        Global.include_graph = IncludeGraph(include_graph_path)
+    worker_index = Index.create()
+
+
+"""
+Returns the result of a task, and the entries the worker has added to the record cache and the include graph.
+"""
+def run_worker(task: tuple[int, str, list[str], list[str], str, Optional[str]]) \
+        -> tuple[int, tuple[list[FileStat], dict[str, tuple[bool, bool]]], dict[str, Any], dict[str, list[str]]]:
+    lib_index, name, headers, flags, mode, journal_path = task
+    result = stat_library(worker_index, name, headers, flags, mode, False, journal_path)
+    return lib_index, result, \
+        Global.record_cache.take_new_entries() if Global.record_cache else {}, \
+        Global.include_graph.take_new_entries() if Global.include_graph else {}
+
+
+def stat_libraries(info_doc: list[dict[str, Any]], output_dir: str, mode: str,
+                   journal_dir: Optional[str], incremental: bool):
+    index = Index.create()
+
+    i: int = 0
+    for info in info_doc:
+        name: str = info['name']
+        flags: list[str] = info['flags']
+        headers: list[str] = info['headers']
+
+        print(f"[{i + 1}/{len(info_doc)}] Processing {name}")
+        i += 1
+
+        output_file = os.path.join(output_dir, f'{name}.json')
+        if os.path.exists(output_file) and not incremental:
+            print("Exists")
+            continue
+
+        journal_path = os.path.join(journal_dir, f'{name}.journal') if journal_dir else None
+        file_stats, records_map = stat_library(index, name, headers, flags, mode, True, journal_path)
+        lib_stat = make_lib_stat(name, file_stats, records_map)
+        lib_stat.approximate = mode == 'quick'
+        write_lib_stat(lib_stat, output_file)
+
+
+def stat_libraries_parallel(info_doc: list[dict[str, Any]], output_dir: str, mode: str,
+                            journal_dir: Optional[str], incremental: bool, jobs: int,
+                            libclang: str, record_cache_path: Optional[str], include_graph_path: Optional[str]):
+    tasks: list[tuple[int, str, list[str], list[str], str, Optional[str]]] = []
+    for lib_index in range(0, len(info_doc)):
+        info = info_doc[lib_index]
+        name: str = info['name']
+        if os.path.exists(os.path.join(output_dir, f'{name}.json')) and not incremental:
+            print(f"[{lib_index + 1}/{len(info_doc)}] {name}: Exists")
+            continue
+        journal_path = os.path.join(journal_dir, f'{name}.journal') if journal_dir else None
+        tasks.append((lib_index, name, info['headers'], info['flags'], mode, journal_path))
+
+    # Larger libraries first to balance the workers
+    tasks.sort(key=lambda task: len(task[2]), reverse=True)
+
+    total = len(tasks)
+    finished = 0
+    with multiprocessing.Pool(jobs, initializer=init_worker,
+                              initargs=(libclang, Global.ast_cache, record_cache_path, include_graph_path)) as pool:
+        for lib_index, (file_stats, records_map), record_entries, graph_entries in pool.imap_unordered(run_worker, tasks):
+            if Global.record_cache:
+                Global.record_cache.merge(record_entries)
+            if Global.include_graph:
+                Global.include_graph.merge(graph_entries)
+
+            name: str = info_doc[lib_index]['name']
+            lib_stat = make_lib_stat(name, file_stats, records_map)
+            lib_stat.approximate = mode == 'quick'
+            write_lib_stat(lib_stat, os.path.join(output_dir, f'{name}.json'))
+
+            finished += 1
+            print(f"[{finished}/{total}] {name}")
+
+
+"""
+Collects a sample of libraries in both the quick and the full mode, and writes the rate of functions classified
+differently by the quick mode to `.sample/error_rate.json` under the output directory.
+"""
+def measure_error_rate(info_doc: list[dict[str, Any]], output_dir: str, sample: int):
+    index = Index.create()
+    sample = min(sample, len(info_doc))
+    sample_infos = [info_doc[i * len(info_doc) // sample] for i in range(0, sample)]
+
+    def classify(file_stats: list[FileStat]) -> dict[str, tuple[int, int]]:
+        res: dict[str, tuple[int, int]] = {}
+        for file_stat in file_stats:
+            for spelling in file_stat.functions:
+                va = 2 if spelling in file_stat.complex_va_functions else 1 if spelling in file_stat.simple_va_functions else 0
+                fp = 2 if spelling in file_stat.complex_fp_functions else 1 if spelling in file_stat.simple_fp_functions else 0
+                res[spelling] = va, fp
+        return res
+
+    categories = ['function_cnt', 'simple_va_functions', 'complex_va_functions',
+                  'simple_fp_functions', 'complex_fp_functions']
+    def count(functions: dict[str, tuple[int, int]]) -> list[int]:
+        labels = list(functions.values())
+        return [len(labels)] + [len([label for label in labels if label[0] == 1]),
+                                len([label for label in labels if label[0] == 2]),
+                                len([label for label in labels if label[1] == 1]),
+                                len([label for label in labels if label[1] == 2])]
+
+    libraries: list[dict[str, Any]] = []
+    total_functions = 0
+    total_errors = 0
+    total_quick = [0] * len(categories)
+    total_full = [0] * len(categories)
+    i: int = 0
+    for info in sample_infos:
+        name: str = info['name']
+        print(f"[{i + 1}/{len(sample_infos)}] Sampling {name}")
+        i += 1
+
+        quick_stats, _ = stat_library(index, name, info['headers'], info['flags'], 'quick')
+        full_stats, _ = stat_library(index, name, info['headers'], info['flags'], 'headers', False)
+        quick = classify(quick_stats)
+        full = classify(full_stats)
+
+        functions = set(quick.keys()) | set(full.keys())
+        errors = len([spelling for spelling in functions if quick.get(spelling) != full.get(spelling)])
+        quick_counts = count(quick)
+        full_counts = count(full)
+        libraries.append({
+            'name': name,
+            'functions': len(functions),
+            'errors': errors,
+            'quick': dict(zip(categories, quick_counts)),
+            'full': dict(zip(categories, full_counts)),
+        })
+        total_functions += len(functions)
+        total_errors += errors
+        total_quick = [a + b for a, b in zip(total_quick, quick_counts)]
+        total_full = [a + b for a, b in zip(total_full, full_counts)]
+
+    # Functions missed, extra or classified differently, and the relative error of the counts
+    function_error_rate = total_errors / total_functions if total_functions > 0 else 0.0
+    count_error_rates = {
+        categories[k]: abs(total_quick[k] - total_full[k]) / total_full[k] if total_full[k] > 0 else float(total_quick[k] > 0)
+        for k in range(0, len(categories))
+    }
+    print(f"Function error rate: {function_error_rate:.2%} ({total_errors}/{total_functions})")
+    for category, rate in count_error_rates.items():
+        print(f"{category} error rate: {rate:.2%}")
+
+    report_dir = os.path.join(output_dir, '.sample')
+    os.makedirs(report_dir, exist_ok=True)
+    with open(os.path.join(report_dir, 'error_rate.json'), 'w') as file:
+        json.dump({
+            'function_error_rate': function_error_rate,
+            'count_error_rates': count_error_rates,
+            'libraries': libraries,
+        }, file, indent=4)
+
+
 def main():
     parser = argparse.ArgumentParser(description='Collect information of interfaces of the libraries.')
     parser.add_argument('info_file', type=str, help='File contains list of libraries info.')
     parser.add_argument('output_dir', type=str, help='Directory of the result.')
+    mode_group = parser.add_mutually_exclusive_group()
+    mode_group.add_argument('--umbrella', action='store_true', help='Parse all headers of a library as one translation unit.')
+    mode_group.add_argument('--roots', action='store_true',
+                            help='Parse only the headers not included by other headers of a library.')
+    mode_group.add_argument('--quick', action='store_true',
+                            help='Scan the tokens of the headers without parsing them, the result is approximate.')
+    parser.add_argument('--sample', type=int, metavar='<n>', default=0,
+                        help='With `--quick`, measure the error rate against the full mode on <n> libraries.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes.')
+    parser.add_argument('--no-ast-cache', action='store_true', help='Do not read or write the parsed AST cache.')
+    parser.add_argument('--record-cache', type=str, metavar='<file>',
+                        help=f'Record classification cache file, defaults to `{RecordCache.default_path}`.')
+    parser.add_argument('--no-record-cache', action='store_true', help='Do not read or write the record classification cache.')
+    parser.add_argument('--include-graph', type=str, metavar='<file>',
+                        help=f'Include graph file used by `--roots`, defaults to `{IncludeGraph.default_path}`.')
+    parser.add_argument('--no-journal', action='store_true', help='Do not checkpoint the headers collected.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Collect existing libraries again, only headers whose include closure changed are parsed.')
     args = parser.parse_args()
     
     # Read configuration file
@@ -204,10 +1112,24 @@ def main():
 
         # Set the path to the clang library
         Config.set_library_file(json_doc['libclang'])
+
+        Global.ast_cache = AstCache.from_config(json_doc, args.no_ast_cache)
         
     # Args
     info_file: str = args.info_file
     output_dir: str = args.output_dir
+    mode: str = 'umbrella' if args.umbrella else 'roots' if args.roots else 'quick' if args.quick else 'headers'
+    jobs: int = max(1, args.jobs)
+    journal_dir: Optional[str] = None if args.no_journal else os.path.join(output_dir, '.journal')
+    incremental: bool = args.incremental
+    record_cache_path: Optional[str] = None
+    if not args.no_record_cache:
+        record_cache_path = args.record_cache if args.record_cache else RecordCache.default_path
+        Global.record_cache = RecordCache(record_cache_path)
+    include_graph_path: Optional[str] = None
+    if mode == 'roots':
+        include_graph_path = args.include_graph if args.include_graph else IncludeGraph.default_path
+        Global.include_graph = IncludeGraph(include_graph_path)
     
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
@@ -215,83 +1137,21 @@ def main():
     # Read info file
     with open(info_file) as file:
         info_doc = json.load(file)
-    
-    i: int = 0
-    for info in info_doc:
-        name: str = info['name']
-        flags: list[str] = info['flags']
-        headers: list[str] = info['headers']
-        
-        print(f"[{i + 1}/{len(info_doc)}] Processing {name}")
-        i += 1
-        
-        output_file = os.path.join(output_dir, f'{name}.json')
-        if os.path.exists(output_file):
-            print("Exists")
-            continue
-        
-        lib_stat = LibStat()
-        lib_stat.name = name
-        
-        all_function_names: set[str] = set()
-        function_names: set[str] = set()
-        records_map: dict[str, tuple[bool, bool]] = {}
-        
-        for header_file in tqdm(headers):
-            file_stat = FileStat()
-            file_stat.file = header_file
-            
-            # Configure the index to parse the header files
-            index = Index.create()
-            # print(header_file)
-            try:
-                translation_unit = index.parse(header_file, args=['-x', 'c'] + flags)
-            except Exception as e:
-                print('Exception:', e)
-                continue
-            
-            # Scan
-            c: Cursor
-            for c in translation_unit.cursor.get_children():
-                spelling: str = c.spelling
-                if c.kind == CursorKind.FUNCTION_DECL:
-                    if c.extent.start.file:
-                        if not os.path.samefile(str(c.extent.start.file), header_file):
-                            continue
-                        
-                    if not spelling in function_names:
-                        function_names.add(spelling)
-                        
-                        is_fp, is_fp_complex = is_fp_function(c, records_map)
-                        if is_fp:
-                            if is_fp_complex:
-                                file_stat.complex_fp_functions.append(spelling)
-                            else:
-                                file_stat.simple_fp_functions.append(spelling)
-                        
-                        is_va, is_va_complex = is_va_function(c)
-                        if is_va:
-                            if is_va_complex:
-                                file_stat.complex_va_functions.append(spelling)
-                            else:
-                                file_stat.simple_va_functions.append(spelling)
-                        
-                        file_stat.function_cnt += 1
-
-            lib_stat.files.append(file_stat)
-        
-            
-        for k, v in records_map.items():
-            if v[0]:
-                if v[1]:
-                    lib_stat.complex_fp_records.append(k)
-                else:
-                    lib_stat.simple_fp_records.append(k)
 
-        jsondata = json.dumps(lib_stat.to_dict())
-        with open(os.path.join(output_file), 'w') as file:
-            file.write(jsondata)
-    
+    try:
+        if jobs == 1:
+            stat_libraries(info_doc, output_dir, mode, journal_dir, incremental)
+        else:
+            stat_libraries_parallel(info_doc, output_dir, mode, journal_dir, incremental, jobs,
+                                    json_doc['libclang'], record_cache_path, include_graph_path)
+        if mode == 'quick' and args.sample > 0:
+            measure_error_rate(info_doc, output_dir, args.sample)
+    finally:
+        if Global.record_cache:
+            Global.record_cache.save()
+        if Global.include_graph:
+            Global.include_graph.save()
+
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import json
+import itertools
+
+from typing import Any
+
+from python.text import write_fragments_if_changed
+
+
+class IrError(ValueError):
+    pass
+
+
+"""
+Function exported by the library, with the spellings the emitters need.
+"""
+class IrFunction:
+    def __init__(self):
+        self.name: str = ''
+        self.result: str = ''               # declaration spelling of the return type
+        self.args: list[str] = []           # declaration spellings of the arguments
+        self.variadic: bool = False
+        self.canonical: str = ''            # canonical signature, e.g. `int (const char *, int)`
+        self.reduced: str = ''              # reduced signature, e.g. `int (char *, int)`
+        self.slots: str = ''                # slot of the return value and the arguments, e.g. `ipd`, or empty if
+                                            # any of them is not a scalar
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'result': self.result,
+            'args': self.args,
+            'variadic': self.variadic,
+            'canonical': self.canonical,
+            'reduced': self.reduced,
+            'slots': self.slots,
+        }
+
+    @staticmethod
+    def from_dict(doc: dict[str, Any]) -> IrFunction:
+        function = IrFunction()
+        function.name = doc['name']
+        function.result = doc['result']
+        function.args = doc['args']
+        function.variadic = doc['variadic']
+        function.canonical = doc['canonical']
+        function.reduced = doc['reduced']
+        function.slots = doc['slots']
+        return function
+
+
+"""
+Function prototype reachable from the exported functions, a thunk is generated for each one.
+"""
+class IrCallback:
+    def __init__(self):
+        self.signature: str = ''            # reduced signature, also the key of the thunk
+        self.result: str = ''               # declaration spelling of the return type
+        self.args: list[str] = []           # declaration spellings of the arguments
+        self.canonical: str = ''            # canonical spelling of the function type
+
+    def to_dict(self):
+        return {
+            'signature': self.signature,
+            'result': self.result,
+            'args': self.args,
+            'canonical': self.canonical,
+        }
+
+    @staticmethod
+    def from_dict(doc: dict[str, Any]) -> IrCallback:
+        callback = IrCallback()
+        callback.signature = doc['signature']
+        callback.result = doc['result']
+        callback.args = doc['args']
+        callback.canonical = doc['canonical']
+        return callback
+
+
+"""
+Canonical type reachable from the exported functions, `refs` are the indexes of the types it refers to (pointee,
+element, result and arguments, or fields).
+"""
+class IrType:
+    def __init__(self):
+        self.spelling: str = ''
+        self.kind: str = ''
+        self.refs: list[int] = []
+
+    def to_dict(self):
+        return {
+            'spelling': self.spelling,
+            'kind': self.kind,
+            'refs': self.refs,
+        }
+
+    @staticmethod
+    def from_dict(doc: dict[str, Any]) -> IrType:
+        type = IrType()
+        type.spelling = doc['spelling']
+        type.kind = doc['kind']
+        type.refs = doc['refs']
+        return type
+
+
+"""
+API surface of a library collected from its header, enough to generate the delegate sources without parsing the
+header again.
+"""
+class ApiIr:
+    format_version = 2
+
+    def __init__(self):
+        self.library_name: str = ''
+        self.header_file: str = ''
+        self.header_content: str = ''
+        self.clang_args: list[str] = []
+        self.functions: list[IrFunction] = []
+        self.missing_symbols: list[str] = []        # symbols without a declaration in the header
+        self.callbacks: list[IrCallback] = []
+        self.types: list[IrType] = []
+
+    def to_dict(self):
+        return {
+            'version': ApiIr.format_version,
+            'library_name': self.library_name,
+            'header_file': self.header_file,
+            'header_content': self.header_content,
+            'clang_args': self.clang_args,
+            'functions': [item.to_dict() for item in self.functions],
+            'missing_symbols': self.missing_symbols,
+            'callbacks': [item.to_dict() for item in self.callbacks],
+            'types': [item.to_dict() for item in self.types],
+        }
+
+    @staticmethod
+    def from_dict(doc: dict[str, Any]) -> ApiIr:
+        if doc.get('version') != ApiIr.format_version:
+            raise IrError(f'unsupported IR version {doc.get("version")}, expected {ApiIr.format_version}')
+        ir = ApiIr()
+        ir.library_name = doc['library_name']
+        ir.header_file = doc['header_file']
+        ir.header_content = doc['header_content']
+        ir.clang_args = doc['clang_args']
+        ir.functions = [IrFunction.from_dict(item) for item in doc['functions']]
+        ir.missing_symbols = doc['missing_symbols']
+        ir.callbacks = [IrCallback.from_dict(item) for item in doc['callbacks']]
+        ir.types = [IrType.from_dict(item) for item in doc['types']]
+        return ir
+
+    def save(self, path: str):
+        write_fragments_if_changed(path, itertools.chain(json.JSONEncoder(indent=1).iterencode(self.to_dict()), ['\n']))
+
+    @staticmethod
+    def load(path: str) -> ApiIr:
+        with open(path, 'r') as file:
+            return ApiIr.from_dict(json.load(file))
@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import os
+import json
+import hashlib
+import tempfile
+
+from clang.cindex import conf
+from clang.cindex import Index
+from clang.cindex import TranslationUnit
+from clang.cindex import TranslationUnitLoadError
+from clang.cindex import TranslationUnitSaveError
+
+from typing import Any, Optional
+
+
+"""
+Returns the version string of the loaded libclang, or the identity of the library file if it's not available.
+"""
+def libclang_version() -> str:
+    try:
+        from clang.cindex import _CXString
+        func = conf.lib.clang_getClangVersion
+        func.argtypes = []
+        func.restype = _CXString
+        version = conf.lib.clang_getCString(func())
+        return version.decode() if isinstance(version, bytes) else str(version)
+    except Exception:
+        path = conf.get_filename()
+        try:
+            st = os.stat(path)
+            return f'{path}:{st.st_size}:{st.st_mtime_ns}'
+        except OSError:
+            return path
+
+
+"""
+Content hashes of files, memoized by their size and modification time.
+"""
+class FileHashes:
+    def __init__(self):
+        self.hashes: dict[tuple[str, int, int], str] = {}     # (path, size, mtime) -> content hash
+
+    def get(self, path: str) -> Optional[str]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = (path, st.st_size, st.st_mtime_ns)
+        if key in self.hashes:
+            return self.hashes[key]
+
+        h = hashlib.sha256()
+        try:
+            with open(path, 'rb') as file:
+                for block in iter(lambda: file.read(1024 * 1024), b''):
+                    h.update(block)
+        except OSError:
+            return None
+        self.hashes[key] = h.hexdigest()
+        return self.hashes[key]
+
+
+"""
+On-disk cache of parsed translation units.
+
+A manifest keyed by the input file, the arguments, the parse options and the libclang version records the
+content hash of every file the translation unit includes, the AST file is named after all these hashes. An
+entry is reused only if all included files still have the same content, the least recently used AST files
+are evicted when the cache grows over `max_size` bytes.
+"""
+class AstCache:
+    default_dir = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'qemu-nc', 'ast')
+    default_max_size = 4 * 1024 * 1024 * 1024
+
+    def __init__(self, cache_dir: Optional[str] = None, max_size: Optional[int] = None):
+        self.cache_dir = cache_dir if cache_dir else AstCache.default_dir
+        self.max_size = max_size if max_size is not None else AstCache.default_max_size
+        self.file_hashes = FileHashes()
+        self.version: Optional[str] = None
+
+        self.hits = 0
+        self.misses = 0
+
+
+    """
+    Creates a cache from the optional `astCache` object of the configuration, returns None if the cache is
+    disabled.
+    """
+    @staticmethod
+    def from_config(json_doc: dict[str, Any], disabled: bool = False) -> Optional[AstCache]:
+        if disabled:
+            return None
+        config: dict[str, Any] = json_doc.get('astCache', {})
+        if not config.get('enabled', True):
+            return None
+        return AstCache(config.get('path'), config.get('maxSize'))
+
+
+    def manifest_key(self, filename: str, args: list[str], unsaved_files: list[tuple[str, str]],
+                     options: int) -> Optional[str]:
+        if self.version is None:
+            self.version = libclang_version()
+
+        h = hashlib.sha256()
+        h.update(json.dumps([self.version, os.path.abspath(filename), args, options]).encode())
+        unsaved_names: set[str] = set()
+        for name, content in unsaved_files:
+            unsaved_names.add(name)
+            h.update(json.dumps([name, hashlib.sha256(content.encode()).hexdigest()]).encode())
+        if not filename in unsaved_names:
+            content_hash = self.file_hashes.get(filename)
+            if content_hash is None:
+                return None
+            h.update(content_hash.encode())
+        return h.hexdigest()
+
+
+    @staticmethod
+    def ast_key(manifest_key: str, includes: list[list[str]]) -> str:
+        h = hashlib.sha256()
+        h.update(manifest_key.encode())
+        h.update(json.dumps(includes).encode())
+        return h.hexdigest()
+
+
+    """
+    Returns the translation unit from the cache if it's up to date, otherwise parses it and stores the
+    result.
+    """
+    def parse(self, index: Index, filename: str, args: list[str],
+              unsaved_files: Optional[list[tuple[str, str]]] = None, options: int = 0) -> TranslationUnit:
+        unsaved_files = unsaved_files if unsaved_files else []
+        key = self.manifest_key(filename, args, unsaved_files, options)
+        if key is None:
+            return index.parse(filename, args=args, unsaved_files=unsaved_files, options=options)
+
+        manifest_path = os.path.join(self.cache_dir, f'{key}.json')
+        translation_unit = self.load(index, key, manifest_path)
+        if translation_unit is not None:
+            self.hits += 1
+            return translation_unit
+
+        self.misses += 1
+        translation_unit = index.parse(filename, args=args, unsaved_files=unsaved_files, options=options)
+        self.store(translation_unit, key, manifest_path)
+        return translation_unit
+
+
+    def load(self, index: Index, key: str, manifest_path: str) -> Optional[TranslationUnit]:
+        try:
+            with open(manifest_path, 'r') as file:
+                includes: list[list[str]] = json.load(file)['includes']
+        except (OSError, ValueError, KeyError):
+            return None
+
+        for path, content_hash in includes:
+            if self.file_hashes.get(path) != content_hash:
+                return None
+
+        ast_path = os.path.join(self.cache_dir, f'{AstCache.ast_key(key, includes)}.ast')
+        try:
+            translation_unit = TranslationUnit.from_ast_file(ast_path, index)
+        except TranslationUnitLoadError:
+            return None
+
+        # Mark as recently used
+        for path in [ast_path, manifest_path]:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return translation_unit
+
+
+    def store(self, translation_unit: TranslationUnit, key: str, manifest_path: str):
+        includes: list[list[str]] = []
+        seen: set[str] = set()
+        for inclusion in translation_unit.get_includes():
+            path = str(inclusion.include)
+            if path in seen:
+                continue
+            seen.add(path)
+            content_hash = self.file_hashes.get(path)
+            if content_hash is None:
+                return
+            includes.append([path, content_hash])
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        ast_path = os.path.join(self.cache_dir, f'{AstCache.ast_key(key, includes)}.ast')
+
+        # Write to temporary files first, the cache may be shared by several processes
+        fd, temp_ast_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.ast.tmp')
+        os.close(fd)
+        try:
+            translation_unit.save(temp_ast_path)
+            os.replace(temp_ast_path, ast_path)
+        except (TranslationUnitSaveError, OSError):
+            if os.path.exists(temp_ast_path):
+                os.remove(temp_ast_path)
+            return
+
+        fd, temp_manifest_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.json.tmp')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump({'includes': includes}, file)
+            os.replace(temp_manifest_path, manifest_path)
+        except OSError:
+            if os.path.exists(temp_manifest_path):
+                os.remove(temp_manifest_path)
+            return
+
+        self.evict()
+
+
+    """
+    Removes the least recently used entries until the cache fits in `max_size`.
+    """
+    def evict(self):
+        entries: list[tuple[float, int, str]] = []
+        total_size = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith('.ast') and not entry.name.endswith('.json'):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total_size += st.st_size
+        if total_size <= self.max_size:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+
+
+"""
+Parses a translation unit through the cache if it's given.
+"""
+def parse_translation_unit(index: Index, ast_cache: Optional[AstCache], filename: str, args: list[str],
+                           unsaved_files: Optional[list[tuple[str, str]]] = None, options: int = 0) -> TranslationUnit:
+    if ast_cache is None:
+        return index.parse(filename, args=args, unsaved_files=unsaved_files, options=options)
+    return ast_cache.parse(index, filename, args, unsaved_files, options)
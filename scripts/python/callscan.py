@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import re
+
+from python.quickscan import tokenize, keywords, match_group
+
+
+"""
+Conservative check of whether a translation unit may contain an indirect call, from the tokens of its preprocessed
+source without semantic analysis.
+
+A translation unit is proved free of indirect calls if every call in the checked part is made through the name of a
+function declared at file scope, and the name is never declared as anything else there. Calls through parenthesized
+expressions (other than casts), subscripts and members, calls of unknown names and function-typed parameters all
+count as possibly indirect.
+"""
+
+type_keywords = set([
+    'void', 'char', 'short', 'int', 'long', 'float', 'double', 'signed', 'unsigned', '_Bool', '_Complex', 'bool',
+    'const', 'volatile', 'restrict', '__restrict', '__restrict__', '__const', '__const__', '__volatile__', '__signed',
+    '__signed__', '__int128', '__float128', '_Atomic', 'struct', 'union', 'enum',
+])
+
+qualified_pointer = set(['*', 'const', 'volatile', 'restrict', '__restrict', '__restrict__', '__const', '__const__'])
+
+# Names followed by a parenthesized group that is neither a call nor evaluated
+attribute_names = set(['__attribute__', '__attribute', '__declspec', '__asm__', '__asm', 'asm'])
+
+# Names followed by a parenthesized group that is not a call, the group is checked
+operator_names = set([
+    '_Generic', '_Alignof', '__alignof__', '__alignof', 'alignof', '_Static_assert', 'static_assert', 'typeof',
+    '__typeof__', '__typeof', 'typeof_unqual', '__typeof_unqual__', '__real__', '__imag__',
+])
+
+linemarker_pattern = re.compile(r'#\s*(?:line\s+)?\d+\s+"((?:\\.|[^"\\])*)"')
+
+
+def is_name(token: str) -> bool:
+    return (token[0].isalpha() or token[0] == '_') and not token in keywords
+
+
+"""
+Returns if the token may precede a declarator, a name after it may be declared rather than used.
+"""
+def precedes_declarator(token: str) -> bool:
+    return token == '*' or token in type_keywords or is_name(token)
+
+
+"""
+Returns if the tokens inside parentheses are a type name of a cast.
+"""
+def is_type_name(group: list[str], types: set[str]) -> bool:
+    if len(group) == 0 or group[0] == '*':
+        return False
+    for k in range(0, len(group)):
+        if not (group[k] == '*' or group[k] in type_keywords or group[k] in types or
+                (k > 0 and group[k - 1] in ['struct', 'union', 'enum'])):
+            return False
+    return True
+
+
+"""
+Returns if the parentheses from `start` to `end` are `(*name)` after a type, which declares a function pointer
+rather than calls one.
+"""
+def is_pointer_declarator(tokens: list[str], start: int, end: int, types: set[str]) -> bool:
+    if start < 1 or end - start < 3 or tokens[start + 1] != '*' or not is_name(tokens[end - 1]):
+        return False
+    for k in range(start + 1, end - 1):
+        if not tokens[k] in qualified_pointer:
+            return False
+    before = tokens[start - 1]
+    return before in type_keywords or before in types or (start >= 2 and tokens[start - 2] in ['struct', 'union', 'enum'])
+
+
+"""
+Returns the tokens of a preprocessed source, and for each token whether it's in the main file, which is the first
+file named by the line markers.
+"""
+def preprocessed_tokens(content: str) -> tuple[list[str], list[bool]]:
+    tokens: list[str] = []
+    in_main: list[bool] = []
+    main_file = None
+    current = True
+    chunk: list[str] = []
+
+    def flush():
+        if len(chunk) > 0:
+            chunk_tokens = tokenize('\n'.join(chunk))
+            tokens.extend(chunk_tokens)
+            in_main.extend([current] * len(chunk_tokens))
+            chunk.clear()
+
+    for line in content.split('\n'):
+        if not line.lstrip().startswith('#'):
+            chunk.append(line)
+            continue
+        match = linemarker_pattern.match(line.lstrip())
+        if match:
+            flush()
+            if main_file is None:
+                main_file = match.group(1)
+            current = match.group(1) == main_file
+    flush()
+    return tokens, in_main
+
+
+"""
+Returns the names declared by a typedef statement, `tokens` starts after `typedef` and ends with the semicolon. Names
+of nested declarators are not returned.
+"""
+def typedef_names(tokens: list[str]) -> list[str]:
+    names: list[str] = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ['{', '[']:
+            i = match_group(tokens, i) + 1
+            continue
+        if (token in operator_names or token in attribute_names or token == '_Atomic') and \
+                i + 1 < len(tokens) and tokens[i + 1] == '(':
+            # `typeof(...)` and the like name no type themselves
+            i = match_group(tokens, i + 1) + 1
+            continue
+        if token == '(':
+            # `(*name)` or `(name)` directly in the statement
+            j = i + 1
+            while j < len(tokens) and tokens[j] in qualified_pointer:
+                j += 1
+            if j + 1 < len(tokens) and is_name(tokens[j]) and tokens[j + 1] in [')', '[']:
+                names.append(tokens[j])
+            i = match_group(tokens, i) + 1
+            continue
+        if is_name(token) and not token in attribute_names and (i == 0 or not tokens[i - 1] in ['struct', 'union', 'enum']) \
+                and i + 1 < len(tokens) and tokens[i + 1] in [';', ',', '[', '(', '__attribute__', '__attribute']:
+            names.append(token)
+        i += 1
+    return names
+
+
+"""
+Returns False if no call in the preprocessed source can be indirect. Only the calls in the main file are checked if
+`main_only` is True, the declarations are read from the whole source.
+"""
+def may_call_indirectly(content: str, main_only: bool = True) -> bool:
+    tokens, in_main = preprocessed_tokens(content)
+    count = len(tokens)
+
+    functions: set[str] = set()     # names declared as functions at file scope
+    types: set[str] = set()         # typedef names
+    called: set[str] = set()        # names called in the checked part
+    cast_types: set[str] = set()    # typedef names of casts followed by a parenthesized operand
+    declared: set[str] = set()      # names that may be declared as objects in the checked part
+
+    braces: list[bool] = []         # whether each open brace is the initializer of a compound literal
+    parens: list[int] = []          # indexes of the open parentheses
+    cast_end = -1                   # index of the closing parenthesis of the last cast
+    specifier_end = -1              # index of the closing parenthesis of the last `typeof(...)` or `_Atomic(...)`
+    statement_typedef = False
+    prev = ''                       # previous token outside attributes
+    i = 0
+    while i < count:
+        token = tokens[i]
+        next = tokens[i + 1] if i + 1 < count else ''
+        checked = in_main[i] or not main_only
+
+        if token == 'typedef':
+            statement_typedef = True
+            end = i + 1
+            while end < count and tokens[end] != ';':
+                end = match_group(tokens, end) + 1 if tokens[end] in ['(', '[', '{'] else end + 1
+            types.update(typedef_names(tokens[i + 1:end + 1]))
+        elif token in attribute_names and next == '(':
+            i = match_group(tokens, i + 1) + 1
+            continue
+        elif token == '{':
+            braces.append(cast_end == i - 1)
+        elif token == '}':
+            compound_literal = braces.pop() if len(braces) > 0 else False
+            statement_typedef = False
+            if checked and next == '(' and compound_literal:
+                return True
+        elif token == ';':
+            statement_typedef = False
+        elif token == '(':
+            parens.append(i)
+        elif token == ')':
+            start = parens.pop() if len(parens) > 0 else i
+            if start > 0 and (tokens[start - 1] in operator_names or tokens[start - 1] == '_Atomic'):
+                # A name after it may be declared
+                specifier_end = i
+            if next in ['(', '{'] and (start == 0 or not tokens[start - 1] in ['if', 'while', 'for', 'switch']):
+                # A cast of a parenthesized operand or a compound literal, or a call through an expression
+                group = tokens[start + 1:i]
+                if is_type_name(group, types):
+                    cast_end = i
+                    if checked:
+                        cast_types.update([item for item in group if item in types])
+                elif checked and next == '(':
+                    if not is_pointer_declarator(tokens, start, i, types):
+                        return True
+                    if not statement_typedef:
+                        declared.add(tokens[i - 1])
+        elif token == ']' and checked and next == '(':
+            return True
+        elif is_name(token):
+            precedes = precedes_declarator(prev) or specifier_end == i - 1
+            if next == '(':
+                if len(braces) == 0 and len(parens) == 0 and not statement_typedef and precedes:
+                    functions.add(token)
+                if checked and not token.startswith('__builtin_') and not token in operator_names:
+                    if prev in ['.', '->']:
+                        return True
+                    if len(braces) == 0 and len(parens) > 0 and precedes:
+                        # A parameter of function type is a pointer
+                        return True
+                    called.add(token)
+            elif checked and not statement_typedef and (precedes or (prev == ',' and len(parens) == 0)) and \
+                    (next in [';', '=', ',', '[', ')', ':'] or next in attribute_names):
+                declared.add(token)
+        prev = token
+        i += 1
+
+    for name in called:
+        if not name in functions or name in declared:
+            return True
+    return len(cast_types & declared) > 0
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import os
 import re
 
 from clang.cindex import Config
@@ -12,6 +13,8 @@ from clang.cindex import SourceRange
 from clang.cindex import SourceLocation
 from clang.cindex import TranslationUnit
 
+from typing import Callable, Iterator, Optional
+
 
 class StringLiteral:
     extern_c = "extern \"C\""
@@ -22,8 +25,7 @@ class StringLiteral:
 """
 Walk through the given type and collect all emerged types.
 """
-def scan_types(type: Type, visited_types: list[Type], visited_type_spellings: set[str], scan_fields: bool = True):
-    type = type.get_canonical()
+def scan_types(type: TypeInfo, visited_types: list[TypeInfo], visited_type_spellings: set[str], scan_fields: bool = True):
     if type.spelling in visited_type_spellings:
         return
     visited_types.append(type)
@@ -31,22 +33,22 @@ def scan_types(type: Type, visited_types: list[Type], visited_type_spellings: se
 
     if type.kind == TypeKind.POINTER:
         # Pointer type
-        scan_types(type.get_pointee(), visited_types, visited_type_spellings)
-    elif Typing.is_array(type):
+        scan_types(type.pointee, visited_types, visited_type_spellings)
+    elif type.is_array:
         # Array type, convert to pointer
-        scan_types(type.element_type, visited_types, visited_type_spellings)
+        scan_types(type.element, visited_types, visited_type_spellings)
     elif type.kind == TypeKind.FUNCTIONPROTO:
         # Function pointer type, scan return type and argument types
-        scan_types(type.get_result(), visited_types, visited_type_spellings)
-        for arg in type.argument_types():
+        scan_types(type.result, visited_types, visited_type_spellings)
+        for arg in type.args:
             scan_types(arg, visited_types, visited_type_spellings)
     elif type.kind == TypeKind.FUNCTIONNOPROTO:
-        scan_types(type.get_result(), visited_types, visited_type_spellings)
+        scan_types(type.result, visited_types, visited_type_spellings)
     elif type.kind == TypeKind.RECORD:
             # Struct/Union type, scan members
         if scan_fields:
-            for field in type.get_fields():
-                scan_types(field.type, visited_types, visited_type_spellings)
+            for field in type.fields:
+                scan_types(field, visited_types, visited_type_spellings)
 
 
 """
@@ -70,6 +72,71 @@ def is_statement_block(c: Cursor) -> bool:
     # return tokens[0].spelling == ';'
 
 
+"""
+Tells whether the files of cursors are a given file, files are identified by device and inode the same as
+`os.path.samefile`. Each file name is checked only once.
+"""
+class FileFilter:
+    def __init__(self, file: str):
+        st = os.stat(file)
+        self.key = (st.st_dev, st.st_ino)
+        self.names: dict[str, bool] = {}
+
+    """
+    Returns True if the file is the given file, or if there is no file such as for builtin cursors.
+    """
+    def accepts(self, file) -> bool:
+        if not file:
+            return True
+        name = str(file)
+        res = self.names.get(name)
+        if res is None:
+            try:
+                st = os.stat(name)
+                res = (st.st_dev, st.st_ino) == self.key
+            except OSError:
+                res = False
+            self.names[name] = res
+        return res
+
+
+"""
+Returns the name of the file included by an inclusion directive, or None if the include cannot be resolved, for
+which `Cursor.get_included_file` raises instead.
+"""
+def included_file(c: Cursor) -> Optional[str]:
+    try:
+        file = c.get_included_file()
+    except AssertionError:
+        return None
+    return str(file) if file else None
+
+
+"""
+Walks through the descendants of the given cursor in pre-order with an explicit stack, yields each cursor with the
+nearest function declaration containing it (itself for a function declaration, or the root outside functions).
+
+Cursors whose extent starts in a file not accepted by `files` are skipped with all their descendants, and the
+descendants of cursors for which `prune` returns True are not visited.
+"""
+def walk_cursors(root: Cursor, files: Optional[FileFilter] = None,
+                 prune: Optional[Callable[[Cursor], bool]] = None) -> Iterator[tuple[Cursor, Cursor]]:
+    stack = [(root.get_children(), root)]
+    while len(stack) > 0:
+        children, scope = stack[-1]
+        c: Optional[Cursor] = next(children, None)
+        if c is None:
+            stack.pop()
+            continue
+        if files and not files.accepts(c.extent.start.file):
+            continue
+        if c.kind == CursorKind.FUNCTION_DECL:
+            scope = c
+        yield c, scope
+        if not prune or not prune(c):
+            stack.append((c.get_children(), scope))
+
+
 """
 Walk through the given cursor and print in tree structure.
 """
@@ -192,6 +259,22 @@ class TypeSpelling:
         return TypeSpelling.remove_cv(res) if reduce else res
 
 
+    """
+    Returns the spelling of a signature from the type information of its result and arguments.
+    """
+    @staticmethod
+    def signature(result: TypeInfo, args: list[TypeInfo], variadic: bool, reduce: bool = True) -> str:
+        res = result.reduced if reduce else result.decl
+        if res[-1] != '*':
+            res += ' '
+        res += '('
+        res += ', '.join([(arg.reduced if reduce else arg.spelling) for arg in args])
+        if variadic:
+            res += ', ...'
+        res += ')'
+        return TypeSpelling.remove_cv(res) if reduce else res
+
+
     """
     Returns the spelling of a fucntion proto type.
     """
@@ -211,6 +294,157 @@ class TypeSpelling:
         return TypeSpelling.remove_cv(res) if reduce else res
 
 
+"""
+Properties of a canonical type, each one is computed with libclang once and then kept, the links to other types
+are resolved through the table.
+"""
+class TypeInfo:
+    __slots__ = ('table', 'type', 'kind', 'spelling', 'is_array', '_pointee', '_element', '_result', '_args',
+                 '_variadic', '_fields', '_primitive', '_decl', '_reduced', '_func_types')
+
+    def __init__(self, table: TypeTable, type: Type):
+        self.table = table
+        self.type = type        # canonical type
+        self.kind: TypeKind = type.kind
+        self.spelling: str = type.spelling
+        self.is_array = Typing.is_array(type)
+        self._pointee: Optional[TypeInfo] = None
+        self._element: Optional[TypeInfo] = None
+        self._result: Optional[TypeInfo] = None
+        self._args: Optional[list[TypeInfo]] = None
+        self._variadic: Optional[bool] = None
+        self._fields: Optional[list[TypeInfo]] = None
+        self._primitive: Optional[TypeInfo] = None
+        self._decl: Optional[str] = None
+        self._reduced: Optional[str] = None
+        self._func_types: dict[bool, str] = {}
+
+    @property
+    def pointee(self) -> TypeInfo:
+        if self._pointee is None:
+            self._pointee = self.table.get(self.type.get_pointee())
+        return self._pointee
+
+    @property
+    def element(self) -> TypeInfo:
+        if self._element is None:
+            self._element = self.table.get(self.type.element_type)
+        return self._element
+
+    @property
+    def result(self) -> TypeInfo:
+        if self._result is None:
+            self._result = self.table.get(self.type.get_result())
+        return self._result
+
+    """
+    Argument types of a function prototype, empty for other types.
+    """
+    @property
+    def args(self) -> list[TypeInfo]:
+        if self._args is None:
+            self._args = [self.table.get(arg) for arg in self.type.argument_types()] \
+                if self.kind == TypeKind.FUNCTIONPROTO else []
+        return self._args
+
+    @property
+    def variadic(self) -> bool:
+        if self._variadic is None:
+            self._variadic = self.kind == TypeKind.FUNCTIONPROTO and self.type.is_function_variadic()
+        return self._variadic
+
+    @property
+    def fields(self) -> list[TypeInfo]:
+        if self._fields is None:
+            self._fields = [self.table.get(field.type) for field in self.type.get_fields()] \
+                if self.kind == TypeKind.RECORD else []
+        return self._fields
+
+    """
+    Same as `Typing.primitive`.
+    """
+    @property
+    def primitive(self) -> TypeInfo:
+        if self._primitive is None:
+            if self.kind == TypeKind.POINTER:
+                self._primitive = self.pointee.primitive
+            elif self.is_array:
+                self._primitive = self.element.primitive
+            else:
+                self._primitive = self
+        return self._primitive
+
+    @property
+    def is_func_ptr(self) -> bool:
+        return self.primitive.kind in [TypeKind.FUNCTIONPROTO, TypeKind.FUNCTIONNOPROTO]
+
+    """
+    Same as `TypeSpelling.decl`.
+    """
+    @property
+    def decl(self) -> str:
+        if self._decl is None:
+            if self.spelling in ['struct __va_list_tag[1]', 'struct __va_list_tag *']:
+                self._decl = TypeSpelling.norm_va_list
+            elif self.is_func_ptr:
+                self._decl = f'__typeof__({self.spelling})/*FP*/'
+            elif self.is_array:
+                self._decl = f'__typeof__({self.spelling})/*ARR*/'
+            else:
+                self._decl = self.spelling
+        return self._decl
+
+    """
+    Same as `TypeSpelling.reduced`.
+    """
+    @property
+    def reduced(self) -> str:
+        if self._reduced is None:
+            if self.kind in [ TypeKind.CHAR_U, TypeKind.UCHAR, TypeKind.CHAR_S, TypeKind.SCHAR ]:
+                self._reduced = 'char'
+            elif self.kind in [ TypeKind.USHORT, TypeKind.SHORT ]:
+                self._reduced = 'short'
+            elif self.kind in [ TypeKind.INT, TypeKind.UINT, TypeKind.ENUM ]:
+                self._reduced = 'int'
+            elif self.kind in [ TypeKind.LONG, TypeKind.LONGLONG, TypeKind.ULONG, TypeKind.ULONGLONG ]:
+                self._reduced = 'long'
+            elif self.kind in [ TypeKind.POINTER, TypeKind.FUNCTIONPROTO, TypeKind.FUNCTIONNOPROTO ] or self.is_array:
+                self._reduced = 'void *'
+            else:
+                self._reduced = TypeSpelling.remove_cv(self.spelling)
+        return self._reduced
+
+    """
+    Same as `TypeSpelling.func_type`.
+    """
+    def func_type(self, reduce: bool = True) -> str:
+        if not reduce in self._func_types:
+            self._func_types[reduce] = TypeSpelling.signature(self.result, self.args, self.variadic, reduce)
+        return self._func_types[reduce]
+
+
+"""
+Type information of a translation unit, keyed by the identity of the types. The types of different translation
+units must not share a table.
+"""
+class TypeTable:
+    def __init__(self):
+        self.infos: dict[tuple[int, int, int], TypeInfo] = {}
+
+    def get(self, type: Type) -> TypeInfo:
+        key = (type._kind_id, type.data[0], type.data[1])
+        info = self.infos.get(key)
+        if info is None:
+            canonical = type.get_canonical()
+            canonical_key = (canonical._kind_id, canonical.data[0], canonical.data[1])
+            info = self.infos.get(canonical_key)
+            if info is None:
+                info = TypeInfo(self, canonical)
+                self.infos[canonical_key] = info
+            self.infos[key] = info
+        return info
+
+
 class CommandLine:
     @staticmethod
     def flag_values(cmds: list[str], flag: str) -> list[str]:
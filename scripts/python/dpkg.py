@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import os
+import glob
+
+from typing import Optional
+
+
+"""
+Reads the dpkg database directly instead of running `dpkg -L` and `dpkg-query`.
+"""
+class Dpkg:
+    def __init__(self, root: str = '/'):
+        self.root = root
+        self.admin_dir = os.path.join(root, 'var', 'lib', 'dpkg')
+        self.info_dir = os.path.join(self.admin_dir, 'info')
+
+
+    """
+    Returns the path of `path` inside the root directory.
+    """
+    def rooted(self, path: str) -> str:
+        if self.root == '/':
+            return path
+        return os.path.join(self.root, path.lstrip('/'))
+
+
+    """
+    Returns the `.list` file of a package, the package name may be qualified with an architecture.
+    """
+    def list_file(self, pkg: str) -> Optional[str]:
+        path = os.path.join(self.info_dir, f'{pkg}.list')
+        if os.path.isfile(path):
+            return path
+        name, _, arch = pkg.partition(':')
+        if arch:
+            path = os.path.join(self.info_dir, f'{name}.list')
+            return path if os.path.isfile(path) else None
+        candidates = sorted(glob.glob(os.path.join(glob.escape(self.info_dir), f'{glob.escape(name)}:*.list')))
+        return candidates[0] if len(candidates) > 0 else None
+
+
+    """
+    Returns the files installed by a package in the same form as `dpkg -L`, or None if it's not installed.
+    """
+    def files(self, pkg: str) -> Optional[list[str]]:
+        path = self.list_file(pkg)
+        if path is None:
+            return None
+        with open(path, 'r', errors='surrogateescape') as file:
+            return [line.rstrip('\n') for line in file if line.strip()]
+
+
+    """
+    Returns the version of all packages in the status file, indexed by both the plain and the
+    architecture-qualified name.
+    """
+    def versions(self) -> dict[str, str]:
+        versions: dict[str, str] = {}
+        path = os.path.join(self.admin_dir, 'status')
+        if not os.path.isfile(path):
+            return versions
+
+        fields: dict[str, str] = {}
+        def flush():
+            if 'Package' in fields and 'Version' in fields:
+                versions[fields['Package']] = fields['Version']
+                if 'Architecture' in fields:
+                    versions[f"{fields['Package']}:{fields['Architecture']}"] = fields['Version']
+            fields.clear()
+
+        with open(path, 'r', errors='replace') as file:
+            for line in file:
+                line = line.rstrip('\n')
+                if len(line) == 0:
+                    flush()
+                    continue
+                if line[0] in ' \t':
+                    continue
+                key, _, value = line.partition(':')
+                fields[key] = value.strip()
+        flush()
+        return versions
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import os
+import json
+import mmap
+import struct
+
+from typing import Any, Optional
+
+
+class ElfError(ValueError):
+    pass
+
+
+class NotElfError(ElfError):
+    pass
+
+
+"""
+Symbol of the dynamic symbol table of an ELF file.
+"""
+class ElfSymbol:
+    bindings = { 0: 'LOCAL', 1: 'GLOBAL', 2: 'WEAK', 10: 'UNIQUE' }
+    types = { 0: 'NOTYPE', 1: 'OBJECT', 2: 'FUNC', 3: 'SECTION', 4: 'FILE', 5: 'COMMON', 6: 'TLS', 10: 'IFUNC' }
+
+    def __init__(self, name: str, version: Optional[str], default: bool, binding: str, type: str, defined: bool):
+        self.name = name
+        self.version = version      # None if the symbol is not versioned
+        self.default = default      # whether it's the default version of the symbol, i.e. `name@@version`
+        self.binding = binding
+        self.type = type
+        self.defined = defined
+
+    def versioned_name(self) -> str:
+        if self.version is None:
+            return self.name
+        return f'{self.name}@@{self.version}' if self.default else f'{self.name}@{self.version}'
+
+    def is_exported_function(self) -> bool:
+        return self.defined and self.binding in ['GLOBAL', 'WEAK'] and self.type in ['FUNC', 'IFUNC']
+
+    def to_list(self) -> list[Any]:
+        return [self.name, self.version, self.default, self.binding, self.type, self.defined]
+
+    @staticmethod
+    def from_list(item: list[Any]) -> ElfSymbol:
+        return ElfSymbol(*item)
+
+
+"""
+Reads the dynamic symbols of an ELF file with their versions from `.dynsym`, `.gnu.version` and `.gnu.version_d`
+or `.gnu.version_r`, the file is mapped instead of being read.
+"""
+def read_dynamic_symbols(path: str) -> list[ElfSymbol]:
+    with open(path, 'rb') as file:
+        try:
+            mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise NotElfError(f'{path}: empty file')
+    with mm:
+        try:
+            return read_dynamic_symbols_from(mm, path)
+        except struct.error:
+            raise ElfError(f'{path}: truncated ELF file')
+
+
+def read_dynamic_symbols_from(mm: mmap.mmap, path: str) -> list[ElfSymbol]:
+    if mm[:4] != b'\x7fELF':
+        raise NotElfError(f'{path}: not an ELF file')
+    is_64 = mm[4] == 2
+    endian = '<' if mm[5] == 1 else '>'
+
+    if is_64:
+        shoff, = struct.unpack_from(endian + 'Q', mm, 0x28)
+        shentsize, shnum, shstrndx = struct.unpack_from(endian + 'HHH', mm, 0x3a)
+        section_format = endian + 'IIQQQQIIQQ'
+        symbol_format = endian + 'IBBHQQ'
+    else:
+        shoff, = struct.unpack_from(endian + 'I', mm, 0x20)
+        shentsize, shnum, shstrndx = struct.unpack_from(endian + 'HHH', mm, 0x2e)
+        section_format = endian + 'IIIIIIIIII'
+        symbol_format = endian + 'IIIBBH'
+    symbol_size = struct.calcsize(symbol_format)
+
+    # (type, offset, size, link, info) of the sections
+    sections: list[tuple[int, int, int, int, int]] = []
+    for i in range(0, shnum):
+        _, sh_type, _, _, sh_offset, sh_size, sh_link, sh_info, _, _ = \
+            struct.unpack_from(section_format, mm, shoff + i * shentsize)
+        sections.append((sh_type, sh_offset, sh_size, sh_link, sh_info))
+
+    def find_section(sh_type: int) -> Optional[tuple[int, int, int, int, int]]:
+        for section in sections:
+            if section[0] == sh_type:
+                return section
+        return None
+
+    def read_string(offset: int) -> str:
+        end = mm.find(b'\0', offset)
+        return mm[offset:end].decode('utf-8', errors='replace')
+
+    dynsym = find_section(11)       # SHT_DYNSYM
+    if dynsym is None:
+        return []
+    strtab_offset = sections[dynsym[3]][1]
+
+    # Version names by index, from the definitions and the requirements
+    version_names: dict[int, str] = {}
+    verdef = find_section(0x6ffffffd)       # SHT_GNU_verdef
+    if verdef is not None:
+        offset = verdef[1]
+        for _ in range(0, verdef[4]):
+            _, vd_flags, vd_ndx, vd_cnt, _, vd_aux, vd_next = struct.unpack_from(endian + 'HHHHIII', mm, offset)
+            if vd_cnt > 0 and not vd_flags & 1:     # not the base version, the name of the file
+                vda_name, = struct.unpack_from(endian + 'I', mm, offset + vd_aux)
+                version_names[vd_ndx] = read_string(strtab_offset + vda_name)
+            if vd_next == 0:
+                break
+            offset += vd_next
+    verneed = find_section(0x6ffffffe)      # SHT_GNU_verneed
+    if verneed is not None:
+        offset = verneed[1]
+        for _ in range(0, verneed[4]):
+            _, vn_cnt, _, vn_aux, vn_next = struct.unpack_from(endian + 'HHIII', mm, offset)
+            aux_offset = offset + vn_aux
+            for _ in range(0, vn_cnt):
+                _, _, vna_other, vna_name, vna_next = struct.unpack_from(endian + 'IHHII', mm, aux_offset)
+                version_names[vna_other] = read_string(strtab_offset + vna_name)
+                if vna_next == 0:
+                    break
+                aux_offset += vna_next
+            if vn_next == 0:
+                break
+            offset += vn_next
+
+    versym = find_section(0x6fffffff)       # SHT_GNU_versym
+
+    symbols: list[ElfSymbol] = []
+    count = dynsym[2] // symbol_size
+    for i in range(1, count):
+        if is_64:
+            st_name, st_info, _, st_shndx, _, _ = struct.unpack_from(symbol_format, mm, dynsym[1] + i * symbol_size)
+        else:
+            st_name, _, _, st_info, _, st_shndx = struct.unpack_from(symbol_format, mm, dynsym[1] + i * symbol_size)
+
+        version: Optional[str] = None
+        default = True
+        if versym is not None:
+            index, = struct.unpack_from(endian + 'H', mm, versym[1] + i * 2)
+            version = version_names.get(index & 0x7fff)
+            default = (index & 0x8000) == 0 and st_shndx != 0      # references are never the default
+
+        symbols.append(ElfSymbol(read_string(strtab_offset + st_name), version, default,
+                                 ElfSymbol.bindings.get(st_info >> 4, str(st_info >> 4)),
+                                 ElfSymbol.types.get(st_info & 0xf, str(st_info & 0xf)),
+                                 st_shndx != 0))
+    return symbols
+
+
+"""
+Returns the names of the functions exported by the symbols, including weak and indirect functions.
+"""
+def exported_functions(symbols: list[ElfSymbol]) -> list[str]:
+    return sorted(set([symbol.name for symbol in symbols if symbol.is_exported_function()]))
+
+
+"""
+Dynamic symbols of the libraries read before, keyed by the inode of the file and checked against its modification
+time. Files other than ELF files, like the linker scripts installed as `libfoo.so`, have no symbols.
+"""
+class SymbolCache:
+    format_version = 1
+
+    default_path = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'qemu-nc', 'elf_symbols.json')
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: dict[str, dict[str, Any]] = {}
+        self.modified = False
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    doc = json.load(file)
+                if doc.get('version') == SymbolCache.format_version:
+                    self.entries = doc['files']
+            except (OSError, ValueError, KeyError):
+                self.entries = {}
+
+    def get(self, path: str) -> list[ElfSymbol]:
+        st = os.stat(path)
+        key = f'{st.st_dev}:{st.st_ino}'
+        entry = self.entries.get(key)
+        if entry is not None and entry['mtime'] == st.st_mtime_ns and entry['size'] == st.st_size:
+            return [ElfSymbol.from_list(item) for item in entry['symbols']]
+
+        try:
+            symbols = read_dynamic_symbols(path)
+        except NotElfError:
+            symbols = []
+        self.entries[key] = {
+            'mtime': st.st_mtime_ns,
+            'size': st.st_size,
+            'symbols': [symbol.to_list() for symbol in symbols],
+        }
+        self.modified = True
+        return symbols
+
+    """
+    Returns the names of the functions exported by all the libraries.
+    """
+    def exported_functions(self, paths: list[str]) -> list[str]:
+        res: set[str] = set()
+        for path in paths:
+            res.update(exported_functions(self.get(path)))
+        return sorted(res)
+
+    def save(self):
+        if not self.modified:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({ 'version': SymbolCache.format_version, 'files': self.entries }, file)
+        os.replace(temp_path, self.path)
+        self.modified = False
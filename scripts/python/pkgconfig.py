@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import os
+import re
+import shlex
+import sysconfig
+
+from typing import Optional
+
+
+class PkgConfigError(Exception):
+    pass
+
+
+class PcFile:
+    def __init__(self):
+        self.path: str = ''
+        self.variables: dict[str, str] = {}
+        self.fields: dict[str, str] = {}     # lower-cased keyword -> expanded value
+
+
+"""
+Evaluates `.pc` files the way `pkg-config --cflags` does, without running it.
+"""
+class PkgConfig:
+    multiarch = sysconfig.get_config_var('MULTIARCH') or 'x86_64-linux-gnu'
+
+    default_search_dirs: list[str] = [
+        f'/usr/local/lib/{multiarch}/pkgconfig',
+        '/usr/local/lib/pkgconfig',
+        '/usr/local/share/pkgconfig',
+        f'/usr/lib/{multiarch}/pkgconfig',
+        '/usr/lib/pkgconfig',
+        '/usr/share/pkgconfig',
+    ]
+
+    default_system_include_dirs: list[str] = [
+        '/usr/include',
+    ]
+
+    def __init__(self, root: str = '/', search_dirs: Optional[list[str]] = None):
+        self.root = root
+        self.search_dirs: list[str] = []
+        env_path = os.environ.get('PKG_CONFIG_PATH', '')
+        for dir in [dir for dir in env_path.split(':') if dir] + \
+                   (search_dirs if search_dirs is not None else PkgConfig.default_search_dirs):
+            self.search_dirs.append(self.rooted(dir))
+        self.system_include_dirs = PkgConfig.default_system_include_dirs
+        self.pc_files: dict[str, PcFile] = {}
+
+
+    """
+    Returns the path of `path` inside the root directory.
+    """
+    def rooted(self, path: str) -> str:
+        if self.root == '/' or not os.path.isabs(path):
+            return path
+        return os.path.join(self.root, path.lstrip('/'))
+
+
+    """
+    Returns the path of the `.pc` file of a module, or None if it cannot be found.
+    """
+    def find(self, module: str) -> Optional[str]:
+        for dir in self.search_dirs:
+            path = os.path.join(dir, f'{module}.pc')
+            if os.path.isfile(path):
+                return path
+        return None
+
+
+    """
+    Parses a `.pc` file, variables and fields are expanded in the order they are defined.
+    """
+    def load(self, path: str) -> PcFile:
+        path = os.path.realpath(path)
+        if path in self.pc_files:
+            return self.pc_files[path]
+
+        pc = PcFile()
+        pc.path = path
+        pc.variables['pcfiledir'] = os.path.dirname(path)
+        pc.variables['pc_sysrootdir'] = self.root
+
+        try:
+            with open(path, 'r', errors='replace') as file:
+                content = file.read()
+        except OSError as e:
+            raise PkgConfigError(f'Cannot read {path}: {e}')
+
+        content = content.replace('\\\n', '')
+        for line in content.split('\n'):
+            line = line.split('#', 1)[0].strip()
+            if len(line) == 0:
+                continue
+            match = re.match(r'^([A-Za-z0-9_.]+)\s*([:=])\s*(.*)$', line)
+            if not match:
+                continue
+            key, op, value = match.group(1), match.group(2), match.group(3).strip()
+            value = self.expand(value, pc.variables)
+            if op == '=':
+                pc.variables[key] = value
+            else:
+                pc.fields[key.lower()] = value
+
+        self.pc_files[path] = pc
+        return pc
+
+
+    @staticmethod
+    def expand(value: str, variables: dict[str, str]) -> str:
+        def replacement(match: re.Match):
+            if match.group(0) == '$$':
+                return '$'
+            return variables.get(match.group(1), '')
+        return re.sub(r'\$\$|\$\{([^}]*)\}', replacement, value)
+
+
+    """
+    Returns the module names listed in a `Requires` field, version constraints are ignored.
+    """
+    @staticmethod
+    def requires(value: str) -> list[str]:
+        modules: list[str] = []
+        tokens = [token for token in re.split(r'[\s,]+', value) if token]
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token in ['=', '!=', '<', '<=', '>', '>=']:
+                i += 2
+                continue
+            modules.append(token)
+            i += 1
+        return modules
+
+
+    """
+    Returns the result of `pkg-config --cflags` for the given `.pc` file, including all modules it requires
+    publicly or privately.
+
+    The `.pc` files read are appended to `pc_files` if it's given, and so is the path a missing module is first
+    looked for, so that the result can be cached by the modification times of the files.
+    """
+    def cflags(self, path: str, pc_files: Optional[list[str]] = None) -> list[str]:
+        fragments: list[str] = []
+        visited: set[str] = set()
+
+        def collect(pc: PcFile):
+            if pc.path in visited:
+                return
+            visited.add(pc.path)
+            if pc_files is not None:
+                pc_files.append(pc.path)
+            try:
+                fragments.extend(shlex.split(pc.fields.get('cflags', '')))
+            except ValueError as e:
+                raise PkgConfigError(f"Invalid Cflags in '{os.path.basename(pc.path)}': {e}")
+            for field in ['requires', 'requires.private']:
+                for module in PkgConfig.requires(pc.fields.get(field, '')):
+                    module_path = self.find(module)
+                    if module_path is None:
+                        if pc_files is not None and len(self.search_dirs) > 0:
+                            pc_files.append(os.path.join(self.search_dirs[0], f'{module}.pc'))
+                        raise PkgConfigError(f"Package '{module}', required by '{os.path.basename(pc.path)}', not found")
+                    collect(self.load(module_path))
+
+        collect(self.load(path))
+
+        # Remove system include directories and duplicated flags
+        res: list[str] = []
+        seen: set[str] = set()
+        i = 0
+        while i < len(fragments):
+            flag = fragments[i]
+            if flag == '-I' and i + 1 < len(fragments):
+                flag = '-I' + fragments[i + 1]
+                i += 1
+            i += 1
+            if flag.startswith('-I'):
+                include_dir = flag[2:]
+                if os.path.normpath(include_dir) in self.system_include_dirs:
+                    continue
+                flag = '-I' + self.rooted(include_dir)
+            if flag in seen:
+                continue
+            seen.add(flag)
+            res.append(flag)
+        return res
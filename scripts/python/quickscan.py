@@ -0,0 +1,791 @@
+from __future__ import annotations
+
+import os
+import re
+
+from typing import Callable, Optional
+
+
+"""
+Approximate classification of the functions declared by C headers, from the tokens of the headers without
+semantic analysis.
+
+The headers of a library are preprocessed by `QuickPreprocessor`, following only the includes of headers of the
+library. Types are resolved through the typedefs and records of these headers, the types of system headers are
+taken as scalars. The classification follows `is_fp_function` and `is_va_function` of ncistat on the
+resolved types.
+"""
+
+token_pattern = re.compile(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|\.\.\.|##|<<|>>|<=|>=|==|!=|&&|\|\||->|'
+                           r'[A-Za-z_]\w*|\d[\w.]*|\S')
+
+keywords = set([
+    'auto', 'break', 'case', 'char', 'const', 'continue', 'default', 'do', 'double', 'else', 'enum', 'extern',
+    'float', 'for', 'goto', 'if', 'inline', 'int', 'long', 'register', 'restrict', 'return', 'short', 'signed',
+    'sizeof', 'static', 'struct', 'switch', 'typedef', 'union', 'unsigned', 'void', 'volatile', 'while',
+    '_Bool', '_Complex', '_Noreturn', '_Thread_local', '_Atomic', 'bool',
+    '__inline', '__inline__', '__restrict', '__restrict__', '__const', '__const__', '__volatile__',
+    '__signed', '__signed__', '__extension__', '__thread', '__int128', '__float128',
+])
+
+# Names followed by a parenthesized group that is not a parameter list
+attribute_names = set([
+    '__attribute__', '__attribute', '__declspec', '__asm__', '__asm', 'asm', '__typeof__', '__typeof', 'typeof',
+    '_Alignas', 'alignas', '__alignof__', '_Static_assert', 'static_assert', 'sizeof',
+])
+
+
+class QuickType:
+    def __init__(self, kind: str, key: str = '', pointers: int = 0):
+        self.kind = kind            # 'scalar', 'record', 'fp' (function pointer) or 'func' (function)
+        self.key = key              # spelling of the record
+        self.pointers = pointers    # levels of pointers over the kind
+
+
+class QuickFunction:
+    def __init__(self, name: str, return_tokens: list[str], params: list[list[str]]):
+        self.name = name
+        self.return_tokens = return_tokens
+        self.params = params
+
+
+"""
+Returns the logical lines of a source, without comments.
+"""
+def logical_lines(content: str) -> list[str]:
+    content = re.sub(r'/\*.*?\*/|//[^\n]*', ' ', content, flags=re.S)
+    content = content.replace('\\\n', '')
+    return content.split('\n')
+
+
+def tokenize(line: str) -> list[str]:
+    return token_pattern.findall(line)
+
+
+"""
+Returns the index of the token closing the group opened at `i`.
+"""
+def match_group(tokens: list[str], i: int) -> int:
+    closing = { '(': ')', '[': ']', '{': '}' }
+    stack: list[str] = []
+    while i < len(tokens):
+        token = tokens[i]
+        if token in closing:
+            stack.append(closing[token])
+        elif len(stack) > 0 and token == stack[-1]:
+            stack.pop()
+            if len(stack) == 0:
+                return i
+        i += 1
+    return len(tokens) - 1
+
+
+"""
+Splits tokens at the top-level occurrences of a separator.
+"""
+def split_top(tokens: list[str], separator: str) -> list[list[str]]:
+    res: list[list[str]] = [[]]
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ['(', '[', '{']:
+            end = match_group(tokens, i)
+            res[-1].extend(tokens[i:end + 1])
+            i = end + 1
+            continue
+        if token == separator:
+            res.append([])
+        else:
+            res[-1].append(token)
+        i += 1
+    return [item for item in res if len(item) > 0]
+
+
+def is_identifier(token: str) -> bool:
+    return (token[0].isalpha() or token[0] == '_') and not token in keywords
+
+
+"""
+Splits the arguments of a macro invocation, empty arguments are kept.
+"""
+def split_arguments(tokens: list[str]) -> list[list[str]]:
+    res: list[list[str]] = [[]]
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ['(', '[', '{']:
+            end = match_group(tokens, i)
+            res[-1].extend(tokens[i:end + 1])
+            i = end + 1
+            continue
+        if token == ',':
+            res.append([])
+        else:
+            res[-1].append(token)
+        i += 1
+    return res
+
+
+"""
+Minimal preprocessor for the headers of a library.
+
+Object-like and function-like macros are expanded, rescanning only the result of each expansion. Conditionals
+are evaluated with the macros defined so far, a condition using a macro that is not defined keeps all branches
+since the macro may come from a header that is not read.
+"""
+class QuickPreprocessor:
+    predefined = {
+        '__STDC__': '1', '__STDC_VERSION__': '201710L', '__STDC_HOSTED__': '1',
+        '__GNUC__': '12', '__GNUC_MINOR__': '2', '__GNUC_PATCHLEVEL__': '0',
+        '__x86_64__': '1', '__x86_64': '1', '__amd64__': '1', '__linux__': '1', '__linux': '1', '__unix__': '1',
+        '__unix': '1', '__ELF__': '1', '__LP64__': '1', '_LP64': '1', '__CHAR_BIT__': '8',
+        '__SIZEOF_INT__': '4', '__SIZEOF_LONG__': '8', '__SIZEOF_LONG_LONG__': '8', '__SIZEOF_POINTER__': '8',
+        '__ORDER_LITTLE_ENDIAN__': '1234', '__ORDER_BIG_ENDIAN__': '4321', '__BYTE_ORDER__': '1234',
+    }
+
+    def __init__(self, flags: list[str]):
+        self.macros: dict[str, tuple[Optional[list[str]], list[str]]] = {}     # name -> (parameters, body)
+        for name, value in QuickPreprocessor.predefined.items():
+            self.macros[name] = None, tokenize(value)
+        for i in range(0, len(flags)):
+            if flags[i] in ['-D', '-U'] and i + 1 < len(flags):
+                flag = flags[i] + flags[i + 1]
+            else:
+                flag = flags[i]
+            if flag.startswith('-D') and len(flag) > 2:
+                name, equal, value = flag[2:].partition('=')
+                self.macros[name] = None, tokenize(value if equal else '1')
+            elif flag.startswith('-U') and len(flag) > 2:
+                self.macros.pop(flag[2:], None)
+
+
+    """
+    Returns the tokens of a source after preprocessing, `include` is called with the name of each header included
+    and whether it's quoted.
+    """
+    def run(self, content: str, include: Callable[[str, bool], None]) -> list[str]:
+        tokens: list[str] = []
+        pending: list[str] = []
+
+        # Each level is (parent active, branch taken, active)
+        stack: list[tuple[bool, bool, bool]] = []
+        active = True
+        for line in logical_lines(content):
+            stripped = line.lstrip()
+            if not stripped.startswith('#'):
+                if active:
+                    pending += tokenize(line)
+                continue
+
+            directive = tokenize(stripped[1:])
+            if len(directive) == 0:
+                continue
+            name, args = directive[0], directive[1:]
+            if name in ['if', 'ifdef', 'ifndef']:
+                condition = self.condition(name, args) if active else False
+                stack.append((active, condition is True, active and condition is not False))
+            elif name == 'elif':
+                if len(stack) > 0:
+                    parent_active, taken, _ = stack[-1]
+                    condition = self.condition(name, args) if parent_active and not taken else False
+                    stack[-1] = parent_active, taken or condition is True, parent_active and condition is not False
+            elif name == 'else':
+                if len(stack) > 0:
+                    parent_active, taken, _ = stack[-1]
+                    stack[-1] = parent_active, True, parent_active and not taken
+            elif name == 'endif':
+                if len(stack) > 0:
+                    stack.pop()
+            elif active and name in ['define', 'undef', 'include']:
+                tokens += self.expand(pending)
+                pending = []
+                if name == 'define':
+                    self.define(stripped)
+                elif name == 'undef':
+                    if len(args) > 0:
+                        self.macros.pop(args[0], None)
+                else:
+                    self.include(args, include)
+            active = stack[-1][2] if len(stack) > 0 else True
+
+        tokens += self.expand(pending)
+        return tokens
+
+
+    def define(self, line: str):
+        match = re.match(r'#\s*define\s+(\w+)(\()?(.*)$', line)
+        if not match:
+            return
+        name = match.group(1)
+        if not match.group(2):
+            self.macros[name] = None, tokenize(match.group(3))
+            return
+        params_str, _, body = match.group(3).partition(')')
+        params: list[str] = []
+        for param in [param.strip() for param in params_str.split(',') if param.strip()]:
+            if param == '...':
+                params.append('__VA_ARGS__')
+            else:
+                params.append(param.rstrip('.').strip())
+        self.macros[name] = params, tokenize(body)
+
+
+    def include(self, args: list[str], include: Callable[[str, bool], None]):
+        if len(args) > 0 and not args[0].startswith('"') and args[0] != '<':
+            args = self.expand(args)
+        if len(args) == 0:
+            return
+        if args[0].startswith('"'):
+            include(args[0][1:-1], True)
+        elif args[0] == '<' and '>' in args:
+            include(''.join(args[1:args.index('>')]), False)
+
+
+    def condition(self, name: str, args: list[str]) -> Optional[bool]:
+        if name == 'ifdef':
+            return len(args) > 0 and args[0] in self.macros
+        if name == 'ifndef':
+            return len(args) > 0 and not args[0] in self.macros
+        return self.evaluate(args)
+
+
+    """
+    Evaluates the expression of `#if`, returns None if it depends on unknown macros.
+    """
+    def evaluate(self, tokens: list[str]) -> Optional[bool]:
+        replaced: list[str] = []
+        i = 0
+        while i < len(tokens):
+            if tokens[i] == 'defined':
+                if i + 1 < len(tokens) and tokens[i + 1] == '(':
+                    name = tokens[i + 2] if i + 2 < len(tokens) else ''
+                    i += 4
+                else:
+                    name = tokens[i + 1] if i + 1 < len(tokens) else ''
+                    i += 2
+                replaced.append('1' if name in self.macros else '0')
+                continue
+            replaced.append(tokens[i])
+            i += 1
+
+        operators = { '&&': 'and', '||': 'or', '!': 'not', '/': '//' }
+        expression: list[str] = []
+        for token in self.expand(replaced):
+            if token[0].isdigit():
+                token = re.sub(r'[uUlL]+$', '', token)
+                if re.fullmatch(r'0[0-7]+', token):
+                    token = str(int(token, 8))
+                expression.append(token)
+            elif token[0].isalpha() or token[0] in ['_', "'", '"', '?', ':']:
+                return None
+            else:
+                expression.append(operators.get(token, token))
+        try:
+            return bool(eval(' '.join(expression), { '__builtins__': {} }, {}))
+        except Exception:
+            return None
+
+
+    """
+    Expands the macros in tokens, macros in `hide` are not expanded again.
+    """
+    def expand(self, tokens: list[str], hide: frozenset[str] = frozenset()) -> list[str]:
+        res: list[str] = []
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if not token in self.macros or token in hide:
+                res.append(token)
+                i += 1
+                continue
+
+            params, body = self.macros[token]
+            if params is None:
+                res += self.expand(body, hide | { token })
+                i += 1
+                continue
+            if i + 1 >= len(tokens) or tokens[i + 1] != '(':
+                res.append(token)
+                i += 1
+                continue
+
+            end = match_group(tokens, i + 1)
+            args = split_arguments(tokens[i + 2:end])
+            if len(params) > 0 and params[-1] == '__VA_ARGS__' and len(args) > len(params):
+                rest: list[str] = []
+                for arg in args[len(params) - 1:]:
+                    rest += arg + [',']
+                args = args[:len(params) - 1] + [rest[:-1]]
+            while len(args) < len(params):
+                args.append([])
+            res += self.expand(self.substitute(body, params, args, hide), hide | { token })
+            i = end + 1
+        return res
+
+
+    def substitute(self, body: list[str], params: list[str], args: list[list[str]], hide: frozenset[str]) -> list[str]:
+        indexes = { params[k]: k for k in range(0, len(params)) }
+        res: list[str] = []
+        j = 0
+        while j < len(body):
+            token = body[j]
+            if token == '#' and j + 1 < len(body) and body[j + 1] in indexes:
+                res.append('"' + ' '.join(args[indexes[body[j + 1]]]) + '"')
+                j += 2
+                continue
+            if token == '##' and j + 1 < len(body):
+                right = args[indexes[body[j + 1]]] if body[j + 1] in indexes else [body[j + 1]]
+                if len(right) > 0:
+                    left = res.pop() if len(res) > 0 else ''
+                    res += tokenize(left + right[0]) + right[1:]
+                j += 2
+                continue
+            if token in indexes:
+                # Operands of `##` are not expanded
+                arg = args[indexes[token]]
+                res += arg if j + 1 < len(body) and body[j + 1] == '##' else self.expand(arg, hide)
+                j += 1
+                continue
+            res.append(token)
+            j += 1
+        return res
+
+
+"""
+Scans the headers of a library, each header is scanned once, after the headers it includes. Only the headers
+listed and the headers found next to them or in the `-I` directories are read, the system headers are not.
+"""
+class QuickScanner:
+    def __init__(self, headers: list[str], flags: list[str]):
+        self.headers: dict[str, str] = { os.path.normpath(header): header for header in headers }
+        self.header_names: dict[str, list[str]] = {}        # base name -> headers
+        for header in headers:
+            self.header_names.setdefault(os.path.basename(header), []).append(header)
+        self.include_dirs: list[str] = []
+        for i in range(0, len(flags)):
+            if flags[i] == '-I' and i + 1 < len(flags):
+                self.include_dirs.append(flags[i + 1])
+            elif flags[i].startswith('-I') and len(flags[i]) > 2:
+                self.include_dirs.append(flags[i][2:])
+        self.preprocessor = QuickPreprocessor(flags)
+
+        self.functions: dict[str, list[QuickFunction]] = {}    # header -> function declarations in order
+        self.typedefs: dict[str, list[str]] = {}                # name -> declaration without `typedef`
+        self.records: dict[str, tuple[str, list[str], str]] = {}    # spelling -> (kind, fields, header)
+        self.anonymous_cnt = 0
+        self.includes: dict[str, list[str]] = {}                # header -> headers read that it includes
+        self.current_header = ''
+
+
+    """
+    Scans a header if it's not scanned yet, returns False if it cannot be read.
+    """
+    def scan_header(self, header_file: str) -> bool:
+        if header_file in self.functions:
+            return True
+        try:
+            with open(header_file, 'r', errors='replace') as file:
+                content = file.read()
+        except OSError:
+            return False
+        self.functions[header_file] = []
+        self.includes[header_file] = []
+
+        def include(name: str, quoted: bool):
+            path = self.find_header(name, quoted, header_file)
+            if path is not None:
+                self.includes[header_file].append(path)
+                self.scan_header(path)
+
+        tokens = self.preprocessor.run(content, include)
+        self.current_header = header_file
+        self.functions[header_file] = self.scan(tokens)
+        return True
+
+
+    def find_header(self, name: str, quoted: bool, includer: str) -> Optional[str]:
+        candidates: list[str] = []
+        if quoted:
+            candidates.append(os.path.normpath(os.path.join(os.path.dirname(includer), name)))
+        for header in self.header_names.get(os.path.basename(name), []):
+            if header.endswith('/' + name):
+                candidates.append(os.path.normpath(header))
+        for dir in self.include_dirs:
+            candidates.append(os.path.normpath(os.path.join(dir, name)))
+
+        for path in candidates:
+            if path in self.headers:
+                return self.headers[path]
+            if path in self.functions or os.path.isfile(path):
+                return path
+        return None
+
+
+    """
+    Returns the headers a header sees, itself included.
+    """
+    def visible_headers(self, header_file: str) -> set[str]:
+        headers: set[str] = set()
+        stack = [header_file]
+        while len(stack) > 0:
+            header = stack.pop()
+            if header in headers:
+                continue
+            headers.add(header)
+            stack.extend(self.includes.get(header, []))
+        return headers
+
+
+    """
+    Returns the function declarations of the tokens in order, the typedefs and records they define are added to the
+    scanner.
+    """
+    def scan(self, tokens: list[str]) -> list[QuickFunction]:
+        functions: list[QuickFunction] = []
+        statement: list[str] = []
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token == ';':
+                self.scan_statement(statement, functions)
+                statement = []
+                i += 1
+                continue
+            if token == '{':
+                # Blocks of `extern "C"` are transparent
+                if len(statement) >= 2 and statement[-2] == 'extern' and statement[-1] == '"C"':
+                    statement = statement[:-2]
+                    i += 1
+                    continue
+                end = match_group(tokens, i)
+                if len(statement) > 0 and statement[-1] == ')' and not statement[0] in ['typedef', 'struct', 'union', 'enum']:
+                    # Function definition
+                    self.scan_statement(statement, functions)
+                    statement = []
+                    i = end + 1
+                    continue
+                statement += self.define_record(statement, tokens[i + 1:end])
+                i = end + 1
+                continue
+            if token == '}':
+                # End of an `extern "C"` block
+                statement = []
+                i += 1
+                continue
+            statement.append(token)
+            i += 1
+        return functions
+
+
+    """
+    Records the body of a record defined after `prefix`, returns the tokens replacing the body. Records nested in
+    the body are replaced the same way.
+    """
+    def define_record(self, prefix: list[str], body: list[str]) -> list[str]:
+        kind = ''
+        tag = ''
+        if len(prefix) >= 2 and prefix[-2] in ['struct', 'union', 'enum'] and is_identifier(prefix[-1]):
+            kind, tag = prefix[-2], prefix[-1]
+        elif len(prefix) >= 1 and prefix[-1] in ['struct', 'union', 'enum']:
+            kind = prefix[-1]
+        if kind in ['', 'enum']:
+            return ['{', '}']
+
+        fields: list[str] = []
+        i = 0
+        while i < len(body):
+            if body[i] == '{':
+                end = match_group(body, i)
+                fields += self.define_record(fields, body[i + 1:end])
+                i = end + 1
+                continue
+            fields.append(body[i])
+            i += 1
+
+        if tag:
+            spelling = f'{kind} {tag}'
+        else:
+            # Renamed after the typedef if there is one
+            spelling = f'{kind} (anonymous {self.anonymous_cnt})'
+            self.anonymous_cnt += 1
+        self.records[spelling] = kind, fields, self.current_header
+        return ['{', spelling, '}']
+
+
+    def scan_statement(self, statement: list[str], functions: list[QuickFunction]):
+        while len(statement) > 0 and statement[0] in ['extern', '__extension__']:
+            statement = statement[1:]
+        if len(statement) == 0:
+            return
+        if statement[0] == 'typedef':
+            self.scan_typedef(statement[1:])
+            return
+
+        # Find the name of the function, the first candidate that doesn't look like a macro wins
+        candidates: list[tuple[int, int, list[str]]] = []      # (name, parameters, return type)
+        i = 0
+        while i < len(statement):
+            token = statement[i]
+            if token == '=':
+                return
+            if token == '{':
+                i = match_group(statement, i) + 1
+                continue
+            if token == '(':
+                end = match_group(statement, i)
+                if end == i + 2 and is_identifier(statement[i + 1]) and end + 1 < len(statement) and \
+                        statement[end + 1] == '(':
+                    # Parenthesized name, `type (name)(...)`
+                    candidates.append((i + 1, end + 1, statement[:i]))
+                    end = match_group(statement, end + 1)
+                elif i + 3 < end and statement[i + 1] == '*' and is_identifier(statement[i + 2]) and \
+                        statement[i + 3] == '(' and match_group(statement, i + 3) == end - 1:
+                    # Function returning a function pointer, `type (*name(...))(...)`
+                    candidates.append((i + 2, i + 3, statement[:i] + ['(', '*', ')'] + statement[end + 1:]))
+                elif i > 0 and is_identifier(statement[i - 1]) and not statement[i - 1] in attribute_names and \
+                        i + 1 < len(statement) and not statement[i + 1] in ['*', '^']:
+                    candidates.append((i - 1, i, statement[:i - 1]))
+                i = end + 1
+                continue
+            i += 1
+        if len(candidates) == 0:
+            return
+        name_index, params_index, return_tokens = candidates[-1]
+        for candidate in candidates:
+            if statement[candidate[0]] != statement[candidate[0]].upper():
+                name_index, params_index, return_tokens = candidate
+                break
+
+        end = match_group(statement, params_index)
+        params = split_top(statement[params_index + 1:end], ',')
+        functions.append(QuickFunction(statement[name_index], return_tokens, params))
+
+
+    def scan_typedef(self, statement: list[str]):
+        declarators = split_top(statement, ',')
+        if len(declarators) == 0:
+            return
+        first = declarators[0]
+        name = QuickScanner.declared_name(first)
+        if name is None:
+            return
+
+        # An anonymous record is named after its first typedef
+        for i in range(0, len(first) - 1):
+            if first[i] == '{' and first[i + 1].startswith(('struct (anonymous', 'union (anonymous')):
+                self.records[name] = self.records.pop(first[i + 1])
+                first = first[:i + 1] + [name] + first[i + 2:]
+                break
+        self.typedefs[name] = first
+
+        # Declarators after the first share its base type
+        i = len(first) - 1 - first[::-1].index(name)
+        base = [token for token in first[:i] + first[i + 1:] if token != '*']
+        for declarator in declarators[1:]:
+            other_name = QuickScanner.declared_name(declarator)
+            if other_name:
+                self.typedefs[other_name] = base + declarator
+
+
+    """
+    Returns the name declared by a declarator.
+    """
+    @staticmethod
+    def declared_name(declarator: list[str]) -> Optional[str]:
+        # Function pointer or function type, `(*name)(...)`, `(name)(...)` or `name(...)`
+        for i in range(0, len(declarator) - 3):
+            if declarator[i] == '(' and is_identifier(declarator[i + 1]) and declarator[i + 2] == ')' and \
+                    declarator[i + 3] == '(':
+                return declarator[i + 1]
+        for i in range(0, len(declarator) - 1):
+            if declarator[i] == '(' and declarator[i + 1] in ['*', '^']:
+                end = match_group(declarator, i)
+                names = [token for token in declarator[i + 1:end] if is_identifier(token) and not token in attribute_names]
+                return names[-1] if len(names) > 0 else None
+        names: list[str] = []
+        i = 0
+        while i < len(declarator):
+            token = declarator[i]
+            if token in ['(', '['] and len(names) > 0:
+                break
+            if token in ['(', '[', '{']:
+                i = match_group(declarator, i) + 1
+                continue
+            if is_identifier(token) and not token in attribute_names:
+                names.append(token)
+            i += 1
+        return names[-1] if len(names) > 0 else None
+
+
+    """
+    Resolves the type of a declaration, the declared name is ignored.
+    """
+    def resolve(self, tokens: list[str], visited: Optional[set[str]] = None) -> QuickType:
+        visited = visited if visited is not None else set()
+        tokens = [token for token in tokens if not token in ['const', 'volatile', 'restrict', '__restrict',
+                                                             '__restrict__', '__const', 'register', 'static',
+                                                             'inline', '__inline', '__inline__', 'extern']]
+
+        # Function pointer declarator, `ret (*name)(...)`
+        for i in range(0, len(tokens) - 1):
+            if tokens[i] == '(' and tokens[i + 1] in ['*', '^']:
+                end = match_group(tokens, i)
+                pointers = tokens[i + 1:end].count('*') + tokens[i + 1:end].count('^') - 1
+                if end + 1 < len(tokens) and tokens[end + 1] == '(':
+                    return QuickType('fp', '', pointers)
+                return QuickType('scalar', '', pointers)
+
+        pointers = tokens.count('*') + tokens.count('[')
+        for i in range(0, len(tokens) - 1):
+            if tokens[i] in ['struct', 'union']:
+                if tokens[i + 1] == '{':
+                    return QuickType('record', tokens[i + 2], pointers)
+                return QuickType('record', f'{tokens[i]} {tokens[i + 1]}', pointers)
+            if tokens[i] == 'enum':
+                return QuickType('scalar', '', pointers)
+
+        # Names not defined by the headers are macros or types from other headers, taken as scalars
+        names = [token for token in tokens if token in self.typedefs]
+        if len(names) == 0:
+            return QuickType('scalar', '', pointers)
+        name = names[0]
+        if name in visited:
+            return QuickType('scalar', '', pointers)
+        visited.add(name)
+
+        type = self.resolve_typedef(name, self.typedefs[name], visited)
+        type.pointers += pointers
+        return type
+
+
+    def resolve_typedef(self, name: str, declarator: list[str], visited: set[str]) -> QuickType:
+        # Function type, `typedef ret name(...)` or `typedef ret (name)(...)`
+        for i in range(0, len(declarator) - 1):
+            if declarator[i] == name and (declarator[i + 1] == '(' or
+                                          (i > 0 and declarator[i - 1] == '(' and declarator[i + 1:i + 3] == [')', '('])):
+                return QuickType('func')
+        # The record of an anonymous record is named after the typedef too
+        i = len(declarator) - 1 - declarator[::-1].index(name)
+        tokens = declarator[:i] + declarator[i + 1:]
+        return self.resolve(tokens, visited)
+
+
+    """
+    Classifies a record the same as `is_fp_record` of ncistat, records without a body or defined by headers that
+    are not visible are not function pointer records.
+    """
+    def classify_record(self, spelling: str, visited: set[str], records_map: dict[str, tuple[bool, bool]],
+                        visible: set[str]) -> tuple[bool, bool]:
+        if spelling in visited:
+            return False, False
+        visited.add(spelling)
+        if spelling in records_map:
+            return records_map[spelling]
+        if not spelling in self.records:
+            return False, False
+
+        kind, body, header_file = self.records[spelling]
+        if not header_file in visible:
+            records_map[spelling] = False, False
+            return False, False
+        fields = [self.resolve(field) for field in split_top(body, ';')]
+        if kind == 'union':
+            for field in fields:
+                if self.is_primitive_fp(field):
+                    records_map[spelling] = True, True
+                    return True, True
+                if field.kind == 'record':
+                    is_fp1, _ = self.classify_record(field.key, visited, records_map, visible)
+                    if is_fp1:
+                        records_map[spelling] = True, True
+                        return True, True
+            records_map[spelling] = False, False
+            return False, False
+
+        is_fp = False
+        for field in fields:
+            if self.is_direct_fp(field):
+                is_fp = True
+                continue
+            if field.kind == 'record' and field.pointers == 0:
+                is_fp1, is_complex1 = self.classify_record(field.key, visited, records_map, visible)
+                if is_fp1:
+                    is_fp = True
+                    if is_complex1:
+                        records_map[spelling] = True, True
+                        return True, True
+                continue
+            if field.kind == 'record':
+                is_fp1, _ = self.classify_record(field.key, visited, records_map, visible)
+                if is_fp1:
+                    records_map[spelling] = True, True
+                    return True, True
+            elif self.is_primitive_fp(field):
+                records_map[spelling] = True, True
+                return True, True
+        records_map[spelling] = is_fp, False
+        return is_fp, False
+
+
+    @staticmethod
+    def is_direct_fp(type: QuickType) -> bool:
+        return (type.kind == 'fp' and type.pointers == 0) or (type.kind == 'func' and type.pointers == 1)
+
+
+    @staticmethod
+    def is_primitive_fp(type: QuickType) -> bool:
+        return type.kind in ['fp', 'func'] and not (type.kind == 'func' and type.pointers == 0)
+
+
+    """
+    Returns if the function has function pointers in its signature and if they are complex, the same as
+    `is_fp_function` of ncistat.
+    """
+    def is_fp_function(self, function: QuickFunction, records_map: dict[str, tuple[bool, bool]],
+                       visible: set[str]) -> tuple[bool, bool]:
+        types = [self.resolve(function.return_tokens)]
+        for param in function.params:
+            if param != ['void'] and param != ['...']:
+                types.append(self.resolve(param))
+
+        exists = False
+        for type in types:
+            if QuickScanner.is_direct_fp(type):
+                exists = True
+                continue
+            if type.kind == 'record' and type.pointers <= 1:
+                exists1, complex = self.classify_record(type.key, set(), records_map, visible)
+                if not exists1:
+                    continue
+                exists = True
+                if not complex:
+                    continue
+                return True, True
+            if type.kind == 'record':
+                is_fp1, _ = self.classify_record(type.key, set(), records_map, visible)
+                if is_fp1:
+                    return True, True
+            elif QuickScanner.is_primitive_fp(type):
+                return True, True
+        return exists, False
+
+
+    """
+    Returns if the function is variadic and if it's complex, the same as `is_va_function` of ncistat. Functions
+    taking a `va_list` are not counted, since `is_va_function` never matches the canonical spelling of `va_list`
+    on x86_64.
+    """
+    def is_va_function(self, function: QuickFunction) -> tuple[bool, bool]:
+        params = [param for param in function.params if param != ['void']]
+
+        def is_format(param: list[str]) -> bool:
+            tokens = [token for token in param if not token in ['const', '__const']]
+            if len(tokens) > 0 and is_identifier(tokens[-1]) and tokens[-1] != 'char':
+                tokens = tokens[:-1]
+            return tokens in [['char', '*'], ['char', '[', ']']]
+
+        if len(params) > 0 and params[-1] == ['...']:
+            if len(params) > 1 and is_format(params[-2]):
+                return True, False
+            return True, True
+        return False, False
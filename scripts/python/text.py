@@ -1,8 +1,12 @@
 from __future__ import annotations
 
+import os
 import re
+import mmap
+import filecmp
+import tempfile
 
-from typing import Optional
+from typing import Iterable, Optional, Union
 
 """
 Reads a multi-line file, composing each line as an item into a set.
@@ -28,6 +32,117 @@ def read_list_file_as_list(filename: str) -> list[str]:
     return res
 
 
+"""
+Writes the content to the file only if it differs from the current content, so that the modification time of an
+unchanged file is kept. The file is replaced atomically. Returns whether the file is written.
+"""
+def write_file_if_changed(file_path: str, content: Union[str, bytes]) -> bool:
+    data = content.encode('utf-8') if isinstance(content, str) else content
+    try:
+        with open(file_path, 'rb') as file:
+            if file.read() == data:
+                return False
+    except OSError:
+        pass
+
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(file_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.chmod(temp_path, 0o666 & ~current_umask())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return True
+
+
+"""
+Same as `write_file_if_changed`, but the content is written fragment by fragment into a temporary file as it is
+produced, so that the whole content is never held in memory. The temporary file is compared with the current file
+afterwards and discarded if they are equal.
+"""
+def write_fragments_if_changed(file_path: str, fragments: Iterable[str]) -> bool:
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(file_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as file:
+            for fragment in fragments:
+                file.write(fragment)
+        if os.path.isfile(file_path) and filecmp.cmp(temp_path, file_path, shallow=False):
+            os.remove(temp_path)
+            return False
+        os.chmod(temp_path, 0o666 & ~current_umask())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return True
+
+
+"""
+Edits of a file that are addressed by the byte offsets in its original content, which is mapped into memory and never
+modified. The edits are collected first and applied in one linear pass by `apply`.
+
+Edits at the same offset are applied in the reverse order of adding, so that adding the edits from the end of the file
+to the beginning gives the same result as making them one by one. An edit that starts inside a range replaced by
+another edit is dropped.
+"""
+class EditBuffer:
+    def __init__(self, file_path: str):
+        self.edits: list[tuple[int, int, int, bytes]] = []   # (start, -sequence, end, text)
+        self._file = open(file_path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self.content: Union[bytes, mmap.mmap] = \
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+
+    def __enter__(self) -> EditBuffer:
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if isinstance(self.content, mmap.mmap):
+            self.content.close()
+        self.content = b''
+        self._file.close()
+
+    def text(self, start: int, end: int) -> bytes:
+        return self.content[start:end]
+
+    def insert(self, offset: int, text: Union[str, bytes]):
+        self.replace(offset, offset, text)
+
+    def replace(self, start: int, end: int, text: Union[str, bytes]):
+        data = text.encode('utf-8') if isinstance(text, str) else text
+        self.edits.append((start, -len(self.edits), end, data))
+
+    """
+    Returns the edited content, the original content is not changed.
+    """
+    def apply(self) -> bytes:
+        pieces: list[bytes] = []
+        pos = 0
+        for start, _, end, data in sorted(self.edits):
+            if start < pos:
+                continue
+            pieces.append(self.content[pos:start])
+            pieces.append(data)
+            pos = end
+        pieces.append(self.content[pos:])
+        return b''.join(pieces)
+
+
+def current_umask() -> int:
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
 """
 Replaces the variable referenced in the text file (in the form of @VAR@) with the corresponding value in the dict.
 """
@@ -44,5 +159,4 @@ def replace_file_placeholders(file_path: str, replacements: dict[str, str], outp
     if output_file is None:
         output_file = file_path
 
-    with open(output_file, 'w', encoding='utf-8') as file:
-        file.write(updated_content)
\ No newline at end of file
+    write_file_if_changed(output_file, updated_content)
\ No newline at end of file
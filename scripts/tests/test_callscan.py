@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from python.callscan import may_call_indirectly, typedef_names
+from python.quickscan import tokenize
+
+
+# Sources that call through a function pointer, or may do so
+INDIRECT = [
+    'void f(void (*fp)(int)) { fp(1); }',
+    'typedef void (*fp_t)(int); void f(fp_t fp) { fp(1); }',
+    'void (*table[2])(int); void f(void) { table[0](1); }',
+    'struct s { void (*fn)(int); }; void f(struct s *p) { p->fn(1); }',
+    'struct s { void (*fn)(int); }; void f(struct s v) { v.fn(1); }',
+    'void f(void (*fp)(int)) { (*fp)(1); }',
+    'void h(int); void g(int); void f(int c) { (c ? h : g)(1); }',
+    'void f(void fn(int)) { fn(1); }',
+    'void f(void) { unknown(1); }',
+    # Names that shadow a function
+    'void h(int); void f(void) { void (*h)(int) = 0; h(1); }',
+    'void h(int); typedef void (*fp_t)(int); void f(fp_t h) { h(1); }',
+    'void h(int); void f(void) { __typeof__(&h) h = 0; h(1); }',
+    'void h(int); void f(void) { typeof(h) *h = 0; h(1); }',
+    'typedef void (*fp_t)(int); void h(int); void f(void) { _Atomic(fp_t) h = 0; h(1); }',
+    'typedef void (*fp_t)(int); void h(int); void f(void) { _Atomic(fp_t) const h = 0; h(1); }',
+]
+
+# Sources whose calls are all direct
+DIRECT = [
+    'void h(int); void f(void) { h(1); }',
+    'void h(int); void f(void) { int x = (int) 1; h(x); }',
+    'typedef int my_int; void h(my_int); void f(void) { h((my_int) (1)); }',
+    'void h(int); void f(void) { __typeof__(&h) p = h; h(1); }',
+    'void h(int); typedef __typeof__(h) *fp_t; void f(void) { h(1); }',
+    'typedef void (*fp_t)(int); void h(int); void f(void) { _Atomic(fp_t) p = 0; h(1); }',
+    'int h(int); void f(void) { int x = sizeof(h(1)); }',
+]
+
+
+class MayCallIndirectlyTest(unittest.TestCase):
+    def test_indirect(self):
+        for source in INDIRECT:
+            self.assertTrue(may_call_indirectly(source), source)
+
+    def test_direct(self):
+        for source in DIRECT:
+            self.assertFalse(may_call_indirectly(source), source)
+
+    def test_typedef_names(self):
+        self.assertEqual(typedef_names(tokenize('__typeof__(fp) T;')), ['T'])
+        self.assertEqual(typedef_names(tokenize('_Atomic(int) a, *b;')), ['a', 'b'])
+        self.assertEqual(typedef_names(tokenize('void (*fp_t)(int);')), ['fp_t'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import os
+import sys
+import shutil
+import asyncio
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ncifilter
+
+
+HEADERS = {
+    # Declares a type used by the others
+    'types.h': 'typedef unsigned int my_enum;\n',
+    # Uses the type without including its header, valid only after `types.h`
+    'dependent.h': 'my_enum dependent_value(void);\n',
+    # Includes a header of its own, but still depends on `types.h`
+    'dependent_include.h': '#include <stddef.h>\nmy_enum dependent_size(size_t n);\n',
+    # Self-contained
+    'self.h': '#include "types.h"\nmy_enum self_value(void);\n',
+    # Only valid if `types.h` was not included before
+    'conflict.h': 'typedef int my_enum;\nmy_enum conflict_value(void);\n',
+    'include_dependent.h': '#include "dependent.h"\n',
+    'missing.h': '#include "nope.h"\n',
+    'syntax.h': 'int syntax_value = ;\n',
+}
+
+
+@unittest.skipIf(shutil.which('gcc') is None, 'gcc is not installed')
+class ValidateHeadersTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        for name, content in HEADERS.items():
+            with open(os.path.join(self.temp_dir.name, name), 'w') as file:
+                file.write(content)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def per_header(self, headers: list[str]) -> set[str]:
+        async def check() -> list[tuple[int, set[int]]]:
+            semaphore = asyncio.Semaphore(4)
+            return await asyncio.gather(*[ncifilter.compile_headers([ header ], [], semaphore) for header in headers])
+        results = asyncio.run(check())
+        return set([ headers[i] for i in range(0, len(headers)) if results[i][0] == 0 ])
+
+    def batched(self, headers: list[str]) -> set[str]:
+        return asyncio.run(ncifilter.validate_headers(headers, [], asyncio.Semaphore(4)))
+
+    def test_matches_per_header_check(self):
+        names = sorted(HEADERS.keys())
+        # Each order puts the dependent headers both before and after the header they depend on
+        for order in [ names, list(reversed(names)), names[1:] + names[:1] ]:
+            headers = [ os.path.join(self.temp_dir.name, name) for name in order ]
+            expected = self.per_header(headers)
+            self.assertEqual(self.batched(headers), expected, order)
+
+        valid = set(os.path.basename(header) for header in self.per_header(headers))
+        self.assertEqual(valid, set([ 'types.h', 'self.h', 'conflict.h' ]))
+
+
+if __name__ == '__main__':
+    unittest.main()
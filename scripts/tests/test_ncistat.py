@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+config_path = os.path.join(script_dir, 'ncconfig.json')
+
+
+def libclang_available() -> bool:
+    try:
+        with open(config_path, 'r') as file:
+            return os.path.exists(json.load(file)['libclang'])
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+HEADERS = {
+    'a.h': '#include "b.h"\n#include "nope.h"\ntypedef void (*cb)(int);\nvoid a_fn(cb f);\n',
+    'b.h': 'int b_fn(int);\nvoid b_va(const char *f, ...);\n',
+    'c.h': '#include "a.h"\nint c_fn(void);\n',
+}
+
+
+@unittest.skipIf(not libclang_available(), 'libclang is not configured')
+class UnresolvedIncludeTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        include_dir = os.path.join(self.temp_dir.name, 'include')
+        os.makedirs(include_dir)
+        for name, content in HEADERS.items():
+            with open(os.path.join(include_dir, name), 'w') as file:
+                file.write(content)
+        self.info_file = os.path.join(self.temp_dir.name, 'info.json')
+        with open(self.info_file, 'w') as file:
+            json.dump([{
+                'name': 'libtest',
+                'flags': [f'-I{include_dir}'],
+                'libs': [],
+                'headers': [os.path.join(include_dir, name) for name in sorted(HEADERS.keys())],
+            }], file)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def stat(self, name: str, options: list[str]) -> dict:
+        output_dir = os.path.join(self.temp_dir.name, name)
+        process = subprocess.run(
+            [sys.executable, os.path.join(script_dir, 'ncistat.py'), self.info_file, output_dir,
+             '--no-journal', '--no-ast-cache', '--no-record-cache',
+             '--include-graph', os.path.join(self.temp_dir.name, f'{name}.graph')] + options,
+            capture_output=True, text=True)
+        self.assertEqual(process.returncode, 0, process.stderr)
+        with open(os.path.join(output_dir, 'libtest.json'), 'r') as file:
+            return json.load(file)
+
+    def assert_same_as_default(self, options: list[str]):
+        expected = self.stat('default', [])
+        self.assertEqual(sum(file['function_cnt'] for file in expected['files']), 4)
+        self.assertEqual(self.stat('mode', options), expected)
+
+    def test_umbrella(self):
+        self.assert_same_as_default(['--umbrella'])
+
+    def test_roots(self):
+        self.assert_same_as_default(['--roots'])
+
+    def test_roots_parallel(self):
+        self.assert_same_as_default(['--roots', '-j', '2'])
+
+
+if __name__ == '__main__':
+    unittest.main()